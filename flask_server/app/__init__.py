@@ -4,13 +4,62 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from .routes.inference import predict_bp
+from .routes.registry import registry_bp
+from .routes.metrics import metrics_bp
+from .routes.jobs import jobs_bp, JobManager
+from .routes.responses import PngEncoder
+from .models.registry import ModelRegistry
+from .models.scheduler import BatchScheduler
+from .models.cache import PredictionCache
+from .models.rcnn import RCNN
+from .models.yolo import YOLO
 
 src_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..','..','..'))
 sys.path.insert(0, src_dir)
 
-def create_app():
+def create_app(model_factories=None, preload_models=False, max_batch_size=4, max_wait_ms=10,
+               job_workers=2, max_queued_jobs=16, job_result_ttl=600,
+               png_workers=4, png_compress_level=6, png_cache_size=256,
+               prediction_cache_size=64, prediction_cache_dir=None, prediction_cache_disk_bytes=1 << 30):
     app = Flask(__name__)
+    if model_factories is None:
+        model_factories = {"RCNN": RCNN, "YOLO": YOLO}
+    # unknown model ids fall back to YOLO, as the frontend has always assumed
+    registry = ModelRegistry(model_factories, default_model_id="YOLO" if "YOLO" in model_factories else None)
+    if preload_models:
+        registry.load_all()
+    app.extensions['model_registry'] = registry
+    # images the model has already seen, with the same weights and settings, are answered without inference
+    app.extensions['prediction_cache'] = PredictionCache(
+        max_entries=prediction_cache_size,
+        disk_dir=prediction_cache_dir,
+        max_disk_bytes=prediction_cache_disk_bytes,
+    )
+    # concurrent requests for the same model are coalesced into shared forward passes
+    app.extensions['batch_scheduler'] = BatchScheduler(
+        registry,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        cache=app.extensions['prediction_cache'],
+    )
+    # masks in a response are encoded concurrently, and repeated masks only once
+    app.extensions['png_encoder'] = PngEncoder(
+        num_workers=png_workers,
+        compress_level=png_compress_level,
+        cache_size=png_cache_size,
+    )
+    # long analyses can be submitted as background jobs and polled for their result
+    app.extensions['job_manager'] = JobManager(
+        app.extensions['batch_scheduler'],
+        encoder=app.extensions['png_encoder'],
+        num_workers=job_workers,
+        max_queued=max_queued_jobs,
+        result_ttl=job_result_ttl,
+    )
     app.register_blueprint(predict_bp)
+    app.register_blueprint(registry_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(jobs_bp)
     CORS(app)
     # , resources={r"/predict": {"origins": "*", "methods": ["POST", "OPTIONS"], "allow_headers": ["Content-Type", "Authorization"]}}
     return app
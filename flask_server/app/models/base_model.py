@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+import hashlib
+import json
 
 class Model(ABC):
     @abstractmethod
@@ -7,4 +9,34 @@ class Model(ABC):
 
     @abstractmethod
     def predict(self, x):
-        pass
\ No newline at end of file
+        pass
+
+    def predict_batch(self, xs):
+        return [self.predict(x) for x in xs]
+
+    def get_fingerprint(self):
+        """
+        A string that changes whenever the model's predictions could, e.g. its weights or post-processing settings.
+        Predictions are only cached for models that have one.
+        """
+        return None
+
+    @staticmethod
+    def batches_by_shape(xs, max_batch_size):
+        """ Yield lists of indices into xs, grouping same-shaped inputs into batches of at most max_batch_size """
+        groups = {}
+        for i, x in enumerate(xs):
+            groups.setdefault(x.shape, []).append(i)
+        for indices in groups.values():
+            for start in range(0, len(indices), max_batch_size):
+                yield indices[start:start + max_batch_size]
+
+
+def fingerprint(weights_path: str, settings: dict) -> str:
+    """ sha256 over the contents of a weights file and the JSON of the settings applied to its outputs """
+    digest = hashlib.sha256()
+    with open(weights_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
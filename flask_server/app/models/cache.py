@@ -0,0 +1,160 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    Content-addressed store of ModelResponses, so re-analysing an image the model has already seen skips inference.
+
+    Entries are keyed on the decoded pixels, the model_id and the model's fingerprint (its weights and
+    post-processing settings), so reloading different weights or changing thresholds never serves stale
+    predictions. Up to max_entries responses are kept in memory, least recently used first out. If disk_dir
+    is given, responses are also pickled there and the least recently used files are removed once the
+    directory grows beyond max_disk_bytes, so they survive restarts and memory evictions. The directory is
+    scanned once on start; after that its size and file order are tracked as files are written and read.
+    Disk errors (a full disk, a file evicted while it is being read) are counted and treated as not cached.
+    """
+
+    def __init__(self, max_entries: int = 64, disk_dir: str = None, max_disk_bytes: int = 1 << 30) -> None:
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: OrderedDict[str, object] = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_errors = 0
+        # path -> size of every file in disk_dir, least recently used first
+        self.disk_files: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self.disk_lock = threading.Lock()
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.scan_disk()
+
+    @staticmethod
+    def key(image: np.ndarray, model_id: str, fingerprint: str) -> str:
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha256(image)
+        digest.update(f"{image.shape}|{image.dtype.str}|{model_id}|{fingerprint}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        """ The cached response for key, or None """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return self.entries[key]
+        response = self.read_from_disk(key)
+        with self.lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.remember(key, response)
+        return response
+
+    def put(self, key: str, response) -> None:
+        with self.lock:
+            self.remember(key, response)
+        self.write_to_disk(key, response)
+
+    def remember(self, key: str, response) -> None:
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def scan_disk(self) -> None:
+        files = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        with self.disk_lock:
+            for _, path, size in sorted(files):
+                self.disk_files[path] = size
+            self.disk_bytes = sum(self.disk_files.values())
+
+    def read_from_disk(self, key: str):
+        if self.disk_dir is None:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                response = pickle.load(file)
+            # the modification time orders files for eviction after a restart
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.count_disk_error()
+            return None
+        with self.disk_lock:
+            if path in self.disk_files:
+                self.disk_files.move_to_end(path)
+        return response
+
+    def write_to_disk(self, key: str, response) -> None:
+        if self.disk_dir is None:
+            return
+        path = self.path(key)
+        # write then rename, so a concurrent reader never sees a partial file
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_path, 'wb') as file:
+                pickle.dump(response, file, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(temporary_path)
+            os.replace(temporary_path, path)
+        except Exception:
+            # caching is best effort: a full disk or an unpicklable response leaves it uncached
+            self.count_disk_error()
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            return
+        with self.disk_lock:
+            self.disk_bytes += size - self.disk_files.pop(path, 0)
+            self.disk_files[path] = size
+            self.evict_from_disk()
+
+    def evict_from_disk(self) -> None:
+        """ Remove the least recently used files until the directory fits max_disk_bytes. Call holding disk_lock """
+        while self.disk_bytes > self.max_disk_bytes and self.disk_files:
+            path, size = self.disk_files.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                self.count_disk_error()
+
+    def count_disk_error(self) -> None:
+        with self.lock:
+            self.disk_errors += 1
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "disk_errors": self.disk_errors,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -1,11 +1,14 @@
-from .base_model import Model
+from .base_model import Model, fingerprint
+from .tiling import predict_tiled
 import torch
 import numpy as np
-from flask_server.app.routes.responses import AnnotationLabel, ModelAnnotation, ModelResponse
+from flask_server.app.routes.responses import AnnotationLabel, ModelAnnotation, ModelResponse, crop_to_content
 from torchvision.transforms import v2
 from src.mask_rcnn_training.training_utils.ring_mask_converter import process
+from src.mask_rcnn_training.training_utils.postprocessing import crop_histograms, histogram_statistics, postprocess_predictions, statistics_per_mask
 from src.mask_rcnn_training.training_utils.utils import NestedTensorHandler, convert_labels#, print_structure
-from src.mask_rcnn_training.training_utils.model_builder import get_model
+from src.mask_rcnn_training.training_utils.model_builder import get_model, OnnxMaskRCNN
+from src.mask_rcnn_training.training_utils.quantization import optimise_for_cpu, load_calibration_images
 import json
 
 class RCNN(Model):
@@ -14,15 +17,26 @@ class RCNN(Model):
         self.configs_path = configs_path
         self.inference_configs, self.training_configs = self.load_configs()
         self.hyper_params = self.training_configs['hyper_params']
-        self.device = torch.device('cuda:0' if self.inference_configs['use_gpu'] and torch.cuda.is_available() else 'cpu')
-        self.model = self.build_model()
-        self.label_order, self.id2label, self.label2id, self.name2id, self.id2name, self.name2label, self.label2name = self.get_conversions()
+        # "torch" runs the eager model, "onnx" an exported graph on ONNX Runtime (CPU only)
+        self.backend = self.inference_configs.get('backend', 'torch')
+        # None, "dynamic" (int8 heads) or "static" (int8 backbone and heads); quantised kernels only run on the CPU
+        self.quantization = self.inference_configs.get('quantization')
+        use_gpu = self.inference_configs['use_gpu'] and self.backend == 'torch' and self.quantization is None
+        self.device = torch.device('cuda:0' if use_gpu and torch.cuda.is_available() else 'cpu')
+        self.max_batch_size = self.inference_configs.get('max_batch_size', 4)
+        # images larger than tile_size on either side are run as overlapping tiles (None runs every image whole)
+        self.tile_size = self.inference_configs.get('tile_size')
+        self.tile_overlap = self.inference_configs.get('tile_overlap', 128)
+        self.tile_merge_threshold = self.inference_configs.get('tile_merge_threshold', 0.5)
+        self.fingerprint = None
         self.transforms = v2.Compose([
             v2.ToImage(),
             v2.Grayscale(),
             v2.ToDtype(torch.float32, scale=True),
             v2.Lambda(lambda x: x / 255.0),
         ])
+        self.model = self.build_model()
+        self.label_order, self.id2label, self.label2id, self.name2id, self.id2name, self.name2label, self.label2name = self.get_conversions()
         self.name2annotation = dict([
             ("Pod", AnnotationLabel.POD),
             ("Seed", AnnotationLabel.SEED),
@@ -51,11 +65,16 @@ class RCNN(Model):
         targets = NestedTensorHandler.get_structure_on_device(targets, self.device)
         return images, targets
 
-    def postprocess(self, images, preds):
-        if self.hyper_params['post-process']:
-            return process(images, preds, self.label_order)
-        else:
-            return images, preds
+    def postprocess(self, preds, intensity_images=None, box_format='xywh'):
+        return postprocess_predictions(
+            preds,
+            self.label_order,
+            binary_threshold=self.hyper_params['binary_threshold'],
+            remove_overlap=self.hyper_params['post-process'],
+            box_format=box_format,
+            intensity_images=intensity_images,
+            device='cpu',
+        )
         
     def load_configs(self):
         with open(self.configs_path, 'r') as file:
@@ -65,57 +84,135 @@ class RCNN(Model):
         return inference_configs, training_configs
     
     def build_model(self):
+        if self.backend == 'onnx':
+            # exported with `python -m src.mask_rcnn_training.export`, runs on the CPU
+            return OnnxMaskRCNN(
+                self.inference_configs['onnx_path'],
+                intra_op_threads=self.inference_configs.get('intra_op_threads', 0),
+                inter_op_threads=self.inference_configs.get('inter_op_threads', 0),
+            )
         model = get_model(
             self.training_configs['num_classes'] + 1,
             max_detections=self.hyper_params['max_detections'],
             model_path=self.training_configs['model_path'],
         ).to(self.device)
         model.eval()
+        if self.quantization is not None or self.inference_configs.get('channels_last', False):
+            model = optimise_for_cpu(
+                model,
+                quantization=self.quantization,
+                channels_last=self.inference_configs.get('channels_last', False),
+                calibration_images=self.get_calibration_images() if self.quantization == 'static' else None,
+            )
         return model
 
-    def convert_bboxes(self, bboxes: torch.Tensor) -> list[list]:
-        boxes = []
-        for i in range(len(bboxes)):
-            x, y, x2, y2 = bboxes[i].tolist()
-            boxes.append([x, y, x2-x, y2-y])
-        return boxes
-
-    def deconvert(self, labels):
-        return torch.tensor([self.label2id[int(label)] for label in labels])
+    def get_calibration_images(self):
+        # the Trainer loads images scaled to [0, 1], predict feeds the transforms [0, 255]
+        images = load_calibration_images(
+            self.inference_configs['calibration_images_path'],
+            self.inference_configs['calibration_annotations_name'],
+            self.inference_configs.get('num_calibration_images', 8),
+        )
+        return [self.transforms(image * 255) for image in images]
 
-    def binarise(self, pred):
-        pred['masks'] = (pred['masks'] > self.hyper_params['binary_threshold']).to(self.device)
-        return pred
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            weights_path = self.training_configs['model_path']
+            if self.backend == 'onnx':
+                weights_path = self.inference_configs['onnx_path']
+            self.fingerprint = fingerprint(
+                weights_path,
+                {"inference": self.inference_configs, "training": self.training_configs},
+            )
+        return self.fingerprint
 
-    def get_annotations(self, numpy_image: np.ndarray, pred: dict[str, torch.tensor]) -> ModelAnnotation:
+    def get_annotations(self, numpy_image: np.ndarray, pred: dict[str, torch.tensor]) -> list[ModelAnnotation]:
         annotations = []
-        for i in range(len(pred['labels'])):
-            bbox = pred['boxes'][i]
-            mask = pred['masks'][i].numpy().squeeze().astype(np.uint8)
-            name = self.label2name[int(pred['labels'][i])]
-            label = self.name2annotation[name]
-            area = float(mask.sum())
-            mean_intensity = float((numpy_image*mask).sum()/(area+1e-5))
-            confidence = float(pred['scores'][i])
-            seed_id = None
-            annotations.append(ModelAnnotation(bbox=bbox, mask=mask*255, label=label, area=area, mean_intensity=mean_intensity, confidence=confidence, seed_id=seed_id))
-        return annotations        
+        masks = pred['masks'].numpy().reshape(-1, *numpy_image.shape).view(np.uint8)
+        boxes, labels, scores = pred['boxes'].tolist(), pred['labels'].tolist(), pred['scores'].tolist()
+        areas, mean_intensities = pred['areas'].tolist(), pred['mean_intensities'].tolist()
+        stats = statistics_per_mask(pred['statistics'])
+        for i in range(len(masks)):
+            mask, offset = crop_to_content(masks[i])
+            annotations.append(self.make_annotation(
+                numpy_image, boxes[i], mask, offset, labels[i], scores[i],
+                area=areas[i], mean_intensity=mean_intensities[i], stats=stats[i],
+            ))
+        return annotations
 
-    def predict_internal(self, torch_image: torch.tensor):
-        torch_image = self.transforms(torch_image)
+    def make_annotation(self, numpy_image: np.ndarray, bbox: list, mask: np.ndarray, offset: tuple[int, int], label, score,
+                        area: float, mean_intensity: float, stats: dict) -> ModelAnnotation:
+        x, y = offset
+        name = self.label2name[int(label)]
+        return ModelAnnotation(bbox=bbox, mask=mask*255, label=self.name2annotation[name], area=area, mean_intensity=mean_intensity, confidence=float(score), seed_id=None, offset=(x, y), image_shape=numpy_image.shape, stats=stats)
+
+    def predict_internal(self, torch_images: list[torch.tensor], box_format='xywh') -> list[dict[str, torch.tensor]]:
+        """ Predictions for raw (1, height, width) images, post-processed on the model's device and returned on the CPU """
+        model_images = [self.transforms(torch_image).to(self.device) for torch_image in torch_images]
         with torch.no_grad():
-            pred = self.model([torch_image])[0]
-        #print(torch.unique(pred['masks']))
-        pred = self.binarise(pred)
-        pred = self.postprocess([torch_image], [pred])[1][0]
-        #print(torch.unique(pred['masks']))
-        return NestedTensorHandler.get_structure_on_device(pred, 'cpu')
-                
-    def predict(self, numpy_image: np.ndarray):
+            preds = self.model(model_images)
+        return self.postprocess(preds, intensity_images=torch_images, box_format=box_format)
+
+    def get_response(self, numpy_image: np.ndarray, pred: dict[str, torch.tensor]) -> ModelResponse:
         height, width = numpy_image.shape
-        torch_image = torch.tensor(numpy_image, dtype=torch.float).view(1, height, width)
-        pred = self.predict_internal(torch_image)
-        pred['boxes'] = self.convert_bboxes(pred['boxes'])
         annotations = self.get_annotations(numpy_image, pred)
         return ModelResponse(annotations=annotations, height=height, width=width)
-    
\ No newline at end of file
+
+    def predict_tiles(self, tiles: list[np.ndarray]) -> list[tuple]:
+        torch_images = [torch.tensor(tile, dtype=torch.float).unsqueeze(0) for tile in tiles]
+        outputs = []
+        for tile, pred in zip(tiles, self.predict_internal(torch_images, box_format='xyxy')):
+            masks = pred['masks'].numpy().reshape(-1, *tile.shape).astype(np.uint8)
+            outputs.append((pred['boxes'].numpy(), pred['scores'].numpy(), pred['labels'].numpy(), masks))
+        return outputs
+
+    def predict_tiled(self, numpy_image: np.ndarray) -> ModelResponse:
+        """ Run a large image as overlapping tiles at full resolution, stitching detections across tile edges """
+        detections = predict_tiled(
+            numpy_image,
+            self.predict_tiles,
+            tile_size=self.tile_size,
+            overlap=self.tile_overlap,
+            batch_size=self.max_batch_size,
+            threshold=self.tile_merge_threshold,
+        )
+        # statistics are computed over each merged mask's own extent rather than the whole image
+        torch_image = torch.from_numpy(numpy_image)
+        crops, windows = [], []
+        for detection in detections:
+            x, y = detection.offset
+            crops.append(torch.from_numpy(detection.crop.astype(bool)))
+            windows.append(torch_image[y:y+detection.crop.shape[0], x:x+detection.crop.shape[1]])
+        statistics = histogram_statistics(crop_histograms(crops, windows))
+        areas, mean_intensities = statistics['area'].tolist(), statistics['mean'].tolist()
+        stats = statistics_per_mask(statistics)
+        annotations = []
+        for i, detection in enumerate(detections):
+            x0, y0, x1, y1 = detection.box.tolist()
+            annotations.append(self.make_annotation(
+                numpy_image, [x0, y0, x1 - x0, y1 - y0], detection.crop, detection.offset, detection.label, detection.score,
+                area=areas[i], mean_intensity=mean_intensities[i], stats=stats[i],
+            ))
+        height, width = numpy_image.shape
+        return ModelResponse(annotations=annotations, height=height, width=width)
+
+    def needs_tiling(self, numpy_image: np.ndarray) -> bool:
+        return self.tile_size is not None and max(numpy_image.shape) > self.tile_size
+
+    def predict_batch(self, numpy_images: list[np.ndarray]) -> list[ModelResponse]:
+        responses = [None] * len(numpy_images)
+        for i, numpy_image in enumerate(numpy_images):
+            if self.needs_tiling(numpy_image):
+                responses[i] = self.predict_tiled(numpy_image)
+        # images of the same size are batched together so the detector does not pad them to a common size
+        untiled = [i for i, response in enumerate(responses) if response is None]
+        for batch in self.batches_by_shape([numpy_images[i] for i in untiled], self.max_batch_size):
+            batch = [untiled[i] for i in batch]
+            torch_images = [torch.tensor(numpy_images[i], dtype=torch.float).unsqueeze(0) for i in batch]
+            preds = self.predict_internal(torch_images)
+            for i, pred in zip(batch, preds):
+                responses[i] = self.get_response(numpy_images[i], pred)
+        return responses
+
+    def predict(self, numpy_image: np.ndarray):
+        return self.predict_batch([numpy_image])[0]
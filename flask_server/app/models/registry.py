@@ -0,0 +1,87 @@
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+import torch
+
+from .base_model import Model
+
+
+class ModelRegistry:
+    """
+    Process-wide store of built models, keyed by model_id.
+
+    Each model is built at most once (lazily on first use, or eagerly via load) and kept in eval mode.
+    Inference on a model is serialised by a per-model lock, and reload builds the replacement before
+    swapping it in so requests never see a half-loaded model.
+    """
+
+    def __init__(self, factories: dict[str, Callable[[], Model]], default_model_id: str = None) -> None:
+        self.factories = factories
+        self.default_model_id = default_model_id
+        self.models: dict[str, Model] = {}
+        self.locks = {model_id: threading.RLock() for model_id in factories}
+
+    def resolve(self, model_id: str) -> str:
+        if model_id in self.factories:
+            return model_id
+        if self.default_model_id is not None:
+            return self.default_model_id
+        raise KeyError(f"Unknown model_id {model_id}. Expected one of {list(self.factories.keys())}")
+
+    def build(self, model_id: str) -> Model:
+        model = self.factories[model_id]()
+        if isinstance(getattr(model, 'model', None), torch.nn.Module):
+            model.model.eval()
+        return model
+
+    def load(self, model_id: str) -> Model:
+        model_id = self.resolve(model_id)
+        with self.locks[model_id]:
+            if model_id not in self.models:
+                self.models[model_id] = self.build(model_id)
+            return self.models[model_id]
+
+    def load_all(self) -> None:
+        for model_id in self.factories:
+            self.load(model_id)
+
+    def unload(self, model_id: str) -> bool:
+        model_id = self.resolve(model_id)
+        with self.locks[model_id]:
+            return self.models.pop(model_id, None) is not None
+
+    def reload(self, model_id: str) -> Model:
+        model_id = self.resolve(model_id)
+        model = self.build(model_id)
+        with self.locks[model_id]:
+            self.models[model_id] = model
+        return model
+
+    def fingerprint(self, model_id: str):
+        """ The fingerprint of the current model for model_id, loading it if needed """
+        model = self.models.get(self.resolve(model_id))
+        if model is None:
+            model = self.load(model_id)
+        return model.get_fingerprint()
+
+    def is_loaded(self, model_id: str) -> bool:
+        return self.resolve(model_id) in self.models
+
+    def loaded(self) -> list[str]:
+        return list(self.models.keys())
+
+    @contextmanager
+    def acquire(self, model_id: str):
+        """ Yield the model for model_id, holding its lock so only one request uses it at a time """
+        model_id = self.resolve(model_id)
+        with self.locks[model_id]:
+            yield self.load(model_id)
+
+    def predict(self, model_id: str, image):
+        with self.acquire(model_id) as model:
+            return model.predict(image)
+
+    def predict_batch(self, model_id: str, images: list):
+        with self.acquire(model_id) as model:
+            return model.predict_batch(images)
@@ -0,0 +1,145 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from .cache import PredictionCache
+from .registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class BatchMetrics:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        self.last_batch_size = 0
+        self.batch_sizes: dict[int, int] = {}
+
+    def record(self, batch_size: int) -> None:
+        with self.lock:
+            self.batches += 1
+            self.images += batch_size
+            self.last_batch_size = batch_size
+            self.batch_sizes[batch_size] = self.batch_sizes.get(batch_size, 0) + 1
+
+    def to_json(self, queue_depth: int) -> dict:
+        with self.lock:
+            return {
+                "queue_depth": queue_depth,
+                "batches": self.batches,
+                "images": self.images,
+                "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+                "last_batch_size": self.last_batch_size,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
+
+
+class BatchScheduler:
+    """
+    Coalesces images submitted by concurrent requests into batched forward passes.
+
+    Each model_id has its own queue and worker thread. The worker takes the first waiting image, then keeps
+    collecting until it has max_batch_size images or max_wait_ms has passed, runs them through the shared
+    model in one pass and resolves each request's future with its own ModelResponse.
+
+    If a PredictionCache is given, images the model has already predicted are answered from it without queueing.
+    New predictions are cached under the fingerprint of the model instance that made them, so a reload between
+    a request's submission and its batch running never files one model's predictions under the other's.
+    """
+
+    def __init__(self, registry: ModelRegistry, max_batch_size: int = 4, max_wait_ms: float = 10,
+                 cache: PredictionCache = None) -> None:
+        self.registry = registry
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queues: dict[str, queue.Queue] = {}
+        self.workers: dict[str, threading.Thread] = {}
+        self.metrics: dict[str, BatchMetrics] = {}
+        self.lock = threading.Lock()
+
+    def get_queue(self, model_id: str) -> queue.Queue:
+        with self.lock:
+            if model_id not in self.queues:
+                self.queues[model_id] = queue.Queue()
+                self.metrics[model_id] = BatchMetrics()
+                self.workers[model_id] = threading.Thread(target=self.run, args=(model_id,), daemon=True)
+                self.workers[model_id].start()
+            return self.queues[model_id]
+
+    def submit(self, model_id: str, image) -> Future:
+        model_id = self.registry.resolve(model_id)
+        future = Future()
+        if self.cache is not None:
+            fingerprint = self.registry.fingerprint(model_id)
+            response = None if fingerprint is None else self.cache.get(self.cache.key(image, model_id, fingerprint))
+            if response is not None:
+                future.set_result(response)
+                return future
+        self.get_queue(model_id).put((image, future))
+        return future
+
+    def remember(self, model_id: str, fingerprint, batch: list, responses: list) -> None:
+        if self.cache is None or fingerprint is None:
+            return
+        # a failing cache must not kill the worker thread, which every later request for model_id waits on
+        try:
+            for (image, _), response in zip(batch, responses):
+                self.cache.put(self.cache.key(image, model_id, fingerprint), response)
+        except Exception:
+            logger.exception("Could not cache predictions of %s", model_id)
+
+    def predict_batch(self, model_id: str, images: list) -> list:
+        futures = [self.submit(model_id, image) for image in images]
+        return [future.result() for future in futures]
+
+    def predict(self, model_id: str, image):
+        return self.submit(model_id, image).result()
+
+    def collect(self, requests: queue.Queue) -> list:
+        batch = [requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self, model_id: str) -> None:
+        requests = self.queues[model_id]
+        while True:
+            batch = self.collect(requests)
+            batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self.metrics[model_id].record(len(batch))
+            try:
+                with self.registry.acquire(model_id) as model, torch.no_grad():
+                    responses = model.predict_batch([image for image, _ in batch])
+                    # read while the registry lock keeps a reload from swapping in another model
+                    fingerprint = model.get_fingerprint()
+                if len(responses) != len(batch):
+                    # zipping would leave the unmatched requests waiting forever
+                    raise RuntimeError(f"{model_id} returned {len(responses)} responses for a batch of {len(batch)} images")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), response in zip(batch, responses):
+                future.set_result(response)
+            self.remember(model_id, fingerprint, batch, responses)
+
+    def get_metrics(self) -> dict:
+        # a snapshot, as get_queue may be adding a model's queue and metrics from another thread
+        with self.lock:
+            models = [(model_id, metrics, self.queues[model_id]) for model_id, metrics in self.metrics.items()]
+        return {model_id: metrics.to_json(requests.qsize()) for model_id, metrics, requests in models}
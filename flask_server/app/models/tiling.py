@@ -0,0 +1,174 @@
+from typing import Callable
+
+import numpy as np
+
+from ..routes.responses import crop_to_content
+
+
+class Detection:
+    """ One instance found in a tiled image, in full-image coordinates, with its mask cropped to its extent """
+
+    def __init__(self, box: np.ndarray, score: float, label: int, crop: np.ndarray, offset: tuple[int, int], tile: int) -> None:
+        self.box = box
+        self.score = score
+        self.label = label
+        self.crop = crop
+        self.offset = offset
+        self.tiles = {tile}
+
+    @property
+    def window(self) -> tuple[int, int, int, int]:
+        x0, y0 = self.offset
+        return x0, y0, x0 + self.crop.shape[1], y0 + self.crop.shape[0]
+
+    def merge(self, other: 'Detection') -> None:
+        """ Absorb a detection of the same instance from another tile: union of boxes and masks, best score """
+        self.box = np.concatenate((np.minimum(self.box[:2], other.box[:2]), np.maximum(self.box[2:], other.box[2:])))
+        self.score = max(self.score, other.score)
+        self.tiles |= other.tiles
+        if other.crop.size == 0:
+            return
+        if self.crop.size == 0:
+            self.crop, self.offset = other.crop, other.offset
+            return
+        x0, y0, x1, y1 = self.window
+        other_x0, other_y0, other_x1, other_y1 = other.window
+        left, top = min(x0, other_x0), min(y0, other_y0)
+        merged = np.zeros((max(y1, other_y1) - top, max(x1, other_x1) - left), dtype=self.crop.dtype)
+        merged[y0 - top:y1 - top, x0 - left:x1 - left] |= self.crop
+        merged[other_y0 - top:other_y1 - top, other_x0 - left:other_x1 - left] |= other.crop
+        self.crop, self.offset = merged, (left, top)
+
+
+def tile_origins(length: int, tile_size: int, overlap: int) -> list[int]:
+    """ Start positions of tiles covering [0, length), consecutive tiles sharing at least overlap pixels """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    origins = list(range(0, length - tile_size, stride))
+    # the last tile is flush with the edge rather than hanging over it
+    origins.append(length - tile_size)
+    return origins
+
+
+def get_tiles(height: int, width: int, tile_size: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """ (x, y, width, height) of overlapping tiles covering an image, all of the same size """
+    tile_height, tile_width = min(tile_size, height), min(tile_size, width)
+    return [
+        (x, y, tile_width, tile_height)
+        for y in tile_origins(height, tile_size, overlap)
+        for x in tile_origins(width, tile_size, overlap)
+    ]
+
+
+def region_in_window(window: tuple[int, int, int, int], rects: list[tuple[int, int, int, int]]) -> np.ndarray:
+    """ Boolean mask over a window (x0, y0, x1, y1) of the pixels inside any of rects (x0, y0, x1, y1) """
+    x0, y0, x1, y1 = window
+    region = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    for rect_x0, rect_y0, rect_x1, rect_y1 in rects:
+        left, top = max(x0, rect_x0), max(y0, rect_y0)
+        right, bottom = min(x1, rect_x1), min(y1, rect_y1)
+        if left < right and top < bottom:
+            region[top - y0:bottom - y0, left - x0:right - x0] = True
+    return region
+
+
+def shared_region_iou(detection: Detection, other: Detection, tiles: list[tuple[int, int, int, int]]) -> float:
+    """
+    IoU of two detections' masks, counted only where the tiles that saw them overlap. Two tiles see exactly the
+    same pixels there, so the same instance (or the parts of it either side of a tile edge) agrees closely,
+    while neighbouring instances do not.
+    """
+    x0, y0, x1, y1 = detection.window
+    other_x0, other_y0, other_x1, other_y1 = other.window
+    left, top, right, bottom = max(x0, other_x0), max(y0, other_y0), min(x1, other_x1), min(y1, other_y1)
+    if left >= right or top >= bottom:
+        return 0.0
+    shared = []
+    for tile in detection.tiles:
+        x, y, w, h = tiles[tile]
+        for other_tile in other.tiles:
+            other_x, other_y, other_w, other_h = tiles[other_tile]
+            shared.append((max(x, other_x), max(y, other_y), min(x + w, other_x + other_w), min(y + h, other_y + other_h)))
+    inside = np.count_nonzero(detection.crop & region_in_window(detection.window, shared))
+    other_inside = np.count_nonzero(other.crop & region_in_window(other.window, shared))
+    intersection = np.count_nonzero(
+        detection.crop[top - y0:bottom - y0, left - x0:right - x0]
+        & other.crop[top - other_y0:bottom - other_y0, left - other_x0:right - other_x0]
+        & region_in_window((left, top, right, bottom), shared)
+    )
+    union = inside + other_inside - intersection
+    return intersection / union if union else 0.0
+
+
+def grid_cells(window: tuple[int, int, int, int], cell_size: int):
+    x0, y0, x1, y1 = window
+    for cell_y in range(y0 // cell_size, max(y1 - 1, y0) // cell_size + 1):
+        for cell_x in range(x0 // cell_size, max(x1 - 1, x0) // cell_size + 1):
+            yield cell_x, cell_y
+
+
+def merge_detections(detections: list[Detection], tiles: list[tuple[int, int, int, int]], threshold: float = 0.5,
+                     cell_size: int = 64) -> list[Detection]:
+    """
+    Cross-tile NMS with mask merging. Detections are visited best score first; one whose mask matches an already
+    kept detection of the same label from other tiles (shared_region_iou above threshold) is the same instance,
+    or a part of it cut off by a tile edge, so it is merged into that detection rather than kept. Detections
+    from the same tile were already separated by the model's own NMS.
+
+    Kept detections are hashed into a grid of cell_size pixel cells by their windows, so each detection is only
+    compared with those near it.
+    """
+    kept: list[Detection] = []
+    grid: dict[tuple[int, int], set[int]] = {}
+    for detection in sorted(detections, key=lambda d: d.score, reverse=True):
+        nearby = sorted(set().union(*(grid.get(cell, ()) for cell in grid_cells(detection.window, cell_size))))
+        best, best_overlap = None, threshold
+        for i in nearby:
+            if kept[i].label != detection.label or kept[i].tiles & detection.tiles:
+                continue
+            overlap = shared_region_iou(detection, kept[i], tiles)
+            if overlap > best_overlap:
+                best, best_overlap = i, overlap
+        if best is None:
+            best = len(kept)
+            kept.append(detection)
+        else:
+            kept[best].merge(detection)
+        for cell in grid_cells(kept[best].window, cell_size):
+            grid.setdefault(cell, set()).add(best)
+    return kept
+
+
+def predict_tiled(
+    image: np.ndarray,
+    predict_tiles: Callable[[list[np.ndarray]], list[tuple]],
+    tile_size: int,
+    overlap: int,
+    batch_size: int = 4,
+    threshold: float = 0.5,
+) -> list[Detection]:
+    """
+    Detect instances in an image too large to run whole by running overlapping tiles in batches and stitching the
+    detections back together. predict_tiles takes a list of same-sized tiles and returns, for each, the
+    (boxes (N, 4) as x0, y0, x1, y1, scores (N,), labels (N,), masks (N, H, W)) found in it. Masks are cropped as soon
+    as each batch returns, so only one batch of tile-sized masks is held at a time.
+    """
+    height, width = image.shape[:2]
+    tiles = get_tiles(height, width, tile_size, overlap)
+    detections = []
+    for start in range(0, len(tiles), batch_size):
+        batch = tiles[start:start + batch_size]
+        outputs = predict_tiles([image[y:y + h, x:x + w] for x, y, w, h in batch])
+        for tile, (x, y, _, _), (boxes, scores, labels, masks) in zip(range(start, start + len(batch)), batch, outputs):
+            for box, score, label, mask in zip(boxes, scores, labels, masks):
+                crop, (crop_x, crop_y) = crop_to_content(mask)
+                detections.append(Detection(
+                    box=np.asarray(box, dtype=np.float64) + [x, y, x, y],
+                    score=float(score),
+                    label=int(label),
+                    crop=crop,
+                    offset=(crop_x + x, crop_y + y) if crop.size else (0, 0),
+                    tile=tile,
+                ))
+    return merge_detections(detections, tiles, threshold)
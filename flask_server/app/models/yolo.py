@@ -1,4 +1,4 @@
-from .base_model import Model
+from .base_model import Model, fingerprint
 from ultralytics import YOLO as UltralyticsYOLO
 import os
 from PIL import Image
@@ -6,6 +6,7 @@ import numpy as np
 import torch
 from ..routes.responses import ModelAnnotation, ModelResponse, AnnotationLabel
 import torch.nn.functional as F
+from src.mask_rcnn_training.training_utils.postprocessing import crop_histograms, histogram_statistics, statistics_per_mask
 
 
 THRESHOLD = 0.0
@@ -17,9 +18,42 @@ annotation_map = {
     4:5, # void
 }
 
+def nearest_indices(input_size: int, output_size: int) -> torch.Tensor:
+    """ The input index each output index reads under F.interpolate(mode='nearest'), found by interpolating a ramp """
+    ramp = torch.arange(input_size, dtype=torch.float32).view(1, 1, -1)
+    return F.interpolate(ramp, size=output_size, mode='nearest').view(-1).long()
+
+
+def upsample_crop(mask: torch.Tensor, rows: torch.Tensor, columns: torch.Tensor) -> tuple[torch.Tensor, tuple[int, int]]:
+    """
+    The nearest-neighbour upsampling of a low resolution bool mask, given the source rows and columns of every output
+    row and column, cropped to its non-zero extent: the same crop and (x, y) offset as crop_to_content of the full
+    upsampled mask, but only the pixels inside the extent are ever gathered.
+    """
+    source_rows = mask.any(dim=1).nonzero().view(-1)
+    source_columns = mask.any(dim=0).nonzero().view(-1)
+    if len(source_rows) == 0:
+        return torch.zeros((0, 0), dtype=torch.bool), (0, 0)
+    # the source indices are non-decreasing, so the outputs reading the non-zero source span are contiguous
+    y0 = int(torch.searchsorted(rows, int(source_rows[0])))
+    y1 = int(torch.searchsorted(rows, int(source_rows[-1]), right=True))
+    x0 = int(torch.searchsorted(columns, int(source_columns[0])))
+    x1 = int(torch.searchsorted(columns, int(source_columns[-1]), right=True))
+    crop = mask[rows[y0:y1]][:, columns[x0:x1]]
+    # when downsampling, the outputs may skip the outermost non-zero pixels, so trim to what was sampled
+    crop_rows, crop_columns = crop.any(dim=1).nonzero().view(-1), crop.any(dim=0).nonzero().view(-1)
+    if len(crop_rows) == 0:
+        return torch.zeros((0, 0), dtype=torch.bool), (0, 0)
+    top, bottom, left, right = int(crop_rows[0]), int(crop_rows[-1]) + 1, int(crop_columns[0]), int(crop_columns[-1]) + 1
+    return crop[top:bottom, left:right], (x0 + left, y0 + top)
+
+
 class YOLO(Model):
-    def __init__(self, weights_path="app/models/final_model_weights/yolo.pt"):
+    def __init__(self, weights_path="app/models/final_model_weights/yolo.pt", max_batch_size=4):
         super(YOLO, self).__init__()
+        self.max_batch_size = max_batch_size
+        self.weights_path = weights_path
+        self.fingerprint = None
         self.model = self.build_model(weights_path)
 
     def build_model(self, weights_path):
@@ -28,52 +62,69 @@ class YOLO(Model):
 
         return UltralyticsYOLO(weights_path)
 
+    def get_fingerprint(self):
+        if self.fingerprint is None:
+            self.fingerprint = fingerprint(self.weights_path, {"threshold": THRESHOLD, "annotation_map": annotation_map})
+        return self.fingerprint
+
     def predict(self, input):
-        image = Image.fromarray(input)
+        return self.predict_batch([input])[0]
+
+    def predict_batch(self, inputs):
+        # ultralytics letterboxes a list of same-sized images to one shape and runs them as a single batch
+        responses = [None] * len(inputs)
+        for batch in self.batches_by_shape(inputs, self.max_batch_size):
+            images = [Image.fromarray(inputs[i]) for i in batch]
+            results = self.model(images, stream=True)
+            for i, image, result in zip(batch, images, results):
+                responses[i] = self.get_response(image, result)
+        return responses
+
+    def get_response(self, image, result):
         device = "cpu"
-        result = list(self.model(image, stream=True))[0]
 
         # get indices of scores above threshold
         kept_indices = np.where(result.boxes.conf.to(device) > THRESHOLD)[0]
-        # for mask in result.masks.data:
-        #     print(mask.shape)
-
-        # masks = [F.interpolate(mask, size=(image.height, image.width), mode='nearest') for mask in result.masks.data ]
-        # print(result.masks.data.shape)
-        # masks = F.interpolate(result.masks.data, size=(result.masks.data.shape[0],image.height, image.width))
-        masks = F.interpolate(result.masks.data.unsqueeze(1), size=(image.height, image.width), mode='nearest').squeeze(1)
-
-        annotations = [
-            ModelAnnotation(
-                bbox=self.get_response_bbox(result.boxes.xyxy[idx].to(device).tolist()),
-                mask=np.floor(masks[idx].to(device).numpy()*255).astype(np.uint8),
-                label=AnnotationLabel( annotation_map[int(result.boxes.cls[idx].to(torch.int).item())] ),
-                mean_intensity = self.calculate_average_intensity(masks[idx].to(device).numpy(), np.array(image)),
-                area = self.calculate_area(masks[idx].to(device).numpy()),
-                confidence = result.boxes.conf[idx].to(device).item(),
+        kept = torch.as_tensor(kept_indices, dtype=torch.long, device=result.masks.data.device)
+        # the masks stay at the model's resolution; each is only upsampled over its own extent
+        masks = (result.masks.data[kept] * 255 >= 1).to(device)
+        rows = nearest_indices(masks.shape[1], image.height)
+        columns = nearest_indices(masks.shape[2], image.width)
+
+        numpy_image = np.array(image)
+        torch_image = torch.from_numpy(numpy_image)
+        crops, offsets = [], []
+        for mask in masks:
+            crop, offset = upsample_crop(mask, rows, columns)
+            crops.append(crop)
+            offsets.append(offset)
+        # statistics of every kept mask reduced at once, read back together
+        statistics = histogram_statistics(crop_histograms(
+            crops, [torch_image[y:y+crop.shape[0], x:x+crop.shape[1]] for crop, (x, y) in zip(crops, offsets)],
+        ))
+        areas, mean_intensities = statistics['area'].tolist(), statistics['mean'].tolist()
+        stats = statistics_per_mask(statistics)
+        boxes = result.boxes.xyxy[kept].to(device).tolist()
+        classes = result.boxes.cls[kept].to(device).to(torch.int).tolist()
+        confidences = result.boxes.conf[kept].to(device).tolist()
+        annotations = []
+        for i in range(len(kept_indices)):
+            annotations.append(ModelAnnotation(
+                bbox=self.get_response_bbox(boxes[i]),
+                mask=crops[i].numpy().view(np.uint8) * 255,
+                label=AnnotationLabel( annotation_map[classes[i]] ),
+                mean_intensity = mean_intensities[i],
+                area = areas[i],
+                confidence = confidences[i],
                 seed_id=-1,
-            )
-            for idx in kept_indices
-        ]
-
-
-
+                offset=offsets[i],
+                image_shape=numpy_image.shape,
+                stats=stats[i],
+            ))
 
         # Return a ModelResponse object
         return ModelResponse(annotations=annotations, width=image.width, height=image.height)
 
-    def calculate_average_intensity(self, mask, image):
-        mask = mask.astype(bool)
-        
-        if np.all(~mask):
-            return 0.0
-
-        return float(np.mean(image[mask]))
-    
-    def calculate_area(self, mask):
-        mask = mask.astype(bool)
-        return float(np.sum(mask))
-    
     def get_response_bbox(self, bbox: list[float]) -> list[float]:
         return [bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]]
     
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 
 class BoundingBox:
@@ -57,6 +58,43 @@ class BoundingBoxCollection:
         return f"{self.root} -> {self.boxes[1:]}"
 
 
+class BoundingBoxIndex:
+    """
+    Sorted-interval index over [x, y, width, height] boxes.
+
+    Boxes are sorted by their left edge, so the boxes that can touch a query box are found with two binary
+    searches (left edge no further right than the query's right edge, and no further left than the query's
+    left edge minus the widest box) before an exact test on the remaining candidates.
+    """
+    def __init__(self, bboxes: list[list[float]]) -> None:
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.min_x = boxes[:, 0]
+        self.min_y = boxes[:, 1]
+        self.max_x = self.min_x + boxes[:, 2]
+        self.max_y = self.min_y + boxes[:, 3]
+        self.order = np.argsort(self.min_x, kind="stable")
+        self.sorted_min_x = self.min_x[self.order]
+        # one pixel of slack keeps the pre-filter conservative under float rounding; the exact test follows
+        self.max_width = float(boxes[:, 2].max()) + 1 if len(boxes) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def query(self, bbox: list[float]) -> np.ndarray:
+        """ Indices, in ascending order, of the boxes overlapping or touching bbox """
+        min_x, min_y = float(bbox[0]), float(bbox[1])
+        max_x, max_y = min_x + float(bbox[2]), min_y + float(bbox[3])
+        lo = np.searchsorted(self.sorted_min_x, min_x - self.max_width, side="left")
+        hi = np.searchsorted(self.sorted_min_x, max_x, side="right")
+        candidates = self.order[lo:hi]
+        hits = (
+            (self.max_x[candidates] >= min_x)
+            & (self.min_y[candidates] <= max_y)
+            & (self.max_y[candidates] >= min_y)
+        )
+        return np.sort(candidates[hits])
+
+
 def get_bbox_hierarchy(bboxs: list[BoundingBox]) -> list[BoundingBoxCollection]:
     # Root boxes
     root_boxes = []
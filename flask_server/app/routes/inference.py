@@ -1,14 +1,9 @@
-from flask import Blueprint, jsonify, request, make_response
+from flask import Blueprint, Response, current_app, jsonify, request, make_response
 from werkzeug.utils import secure_filename
+import json
 import traceback
 
-from ..models.rcnn import RCNN
-from ..models.yolo import YOLO
-
-import io
-import numpy as np
-from PIL import Image
-import base64
+from .utils import read_request, get_mask_format, get_composite_format, wants_stream, NDJSON_MIMETYPE
 
 
 predict_bp = Blueprint('predict', __name__)
@@ -26,27 +21,44 @@ def predict():
         response.headers.add("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
         return response
     else:
-        data = request.get_json()
-        
-        model_id = data.get('model_id')
-        base64_image = data['images'][0]
-
-        # Decode the base64 image
-        image_data = base64.b64decode(base64_image.split(",")[1])
-        image = Image.open(io.BytesIO(image_data)).convert("L")
-        image = np.array(image)
+        model_id, images = read_request(request)
+        mask_format = get_mask_format(request)
+        composite_format = get_composite_format(request)
         
-        # Instantiate model based on model_id
-        if model_id == "RCNN":
-            model = RCNN()
-        else:
-            model = YOLO()
+        # Images are queued on the shared models and batched with those from concurrent requests
+        scheduler = current_app.extensions['batch_scheduler']
         
-        # Generate prediction
-        prediction = model.predict(image)
-        prediction = prediction.to_json()
-        return jsonify(prediction)
+        encoder = current_app.extensions['png_encoder']
+        if wants_stream(request):
+            futures = [scheduler.submit(model_id, image) for image in images]
+            return Response(stream_predictions(futures, mask_format, composite_format, encoder), mimetype=NDJSON_MIMETYPE)
+
+        # Generate one prediction per image, batching same-sized images together
+        predictions = [prediction.to_json(mask_format, composite_format, encoder)
+                       for prediction in scheduler.predict_batch(model_id, images)]
+        return jsonify(format_predictions(predictions))
+
+
+def format_predictions(predictions: list[dict]):
+    # A single image keeps the original (unbatched) response shape
+    if len(predictions) == 1:
+        return predictions[0]
+    return predictions
+
+
+def stream_predictions(futures, mask_format, composite_format, encoder):
+    """
+    Newline-delimited JSON records for each image's prediction, in order, each tagged with the image's index.
+    Annotations are sent as soon as they are encoded. An image that fails gets an error record in place of the
+    rest of its records, since the response status has already gone out, and the images after it are still sent.
+    """
+    for image, future in enumerate(futures):
+        try:
+            for record in future.result().iter_json(mask_format, composite_format, encoder):
+                yield json.dumps({"image": image, **record}) + "\n"
+        except Exception:
+            yield json.dumps({"image": image, "type": "error", "exception": traceback.format_exc()}) + "\n"
 
 
 def filename(file):
-    return secure_filename(file.filename)
\ No newline at end of file
+    return secure_filename(file.filename)
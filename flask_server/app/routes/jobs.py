@@ -0,0 +1,169 @@
+from flask import Blueprint, current_app, jsonify, request, url_for
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from .inference import format_predictions
+from .responses import PngEncoder
+from .utils import read_request, get_mask_format, get_composite_format
+
+
+jobs_bp = Blueprint('jobs', __name__)
+
+
+class JobStatus:
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETE = "COMPLETE"
+    FAILED = "FAILED"
+
+
+class Job:
+    def __init__(self, model_id: str, images: list, mask_format: str = "png", composite_format: str = "masks") -> None:
+        self.job_id = uuid.uuid4().hex
+        self.model_id = model_id
+        self.images = images
+        self.mask_format = mask_format
+        self.composite_format = composite_format
+        self.status = JobStatus.QUEUED
+        self.completed_images = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def progress(self) -> float:
+        return self.completed_images / len(self.images) if self.images else 1.0
+
+    def to_json(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "model_id": self.model_id,
+            "status": self.status,
+            "progress": self.progress(),
+            "num_images": len(self.images),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs predictions in a fixed pool of worker threads so requests can return a job id straight away.
+
+    At most max_queued jobs wait for a worker; submitting beyond that raises queue.Full. Finished jobs (and their
+    results) are forgotten result_ttl seconds after they finish.
+    """
+
+    def __init__(self, scheduler, num_workers: int = 2, max_queued: int = 16, result_ttl: float = 600,
+                 encoder: PngEncoder = None) -> None:
+        self.scheduler = scheduler
+        self.encoder = encoder
+        self.result_ttl = result_ttl
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.jobs: dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.workers = [threading.Thread(target=self.run, daemon=True) for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, model_id: str, images: list, mask_format: str = "png", composite_format: str = "masks") -> Job:
+        self.expire()
+        job = Job(model_id, images, mask_format, composite_format)
+        self.pending.put_nowait(job)
+        with self.lock:
+            self.jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Job:
+        self.expire()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def expire(self) -> None:
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def run(self) -> None:
+        while True:
+            job = self.pending.get()
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            try:
+                futures = [self.scheduler.submit(job.model_id, image) for image in job.images]
+                predictions = []
+                for future in futures:
+                    predictions.append(future.result().to_json(job.mask_format, job.composite_format, self.encoder))
+                    job.completed_images += 1
+                job.result = format_predictions(predictions)
+                job.status = JobStatus.COMPLETE
+            except Exception:
+                job.error = traceback.format_exc()
+                job.status = JobStatus.FAILED
+            finally:
+                # the decoded images are no longer needed once the job has run
+                job.images = [None] * len(job.images)
+                job.finished_at = time.time()
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+        return {
+            "queued": self.pending.qsize(),
+            "max_queued": self.pending.maxsize,
+            "jobs": {status: statuses.count(status) for status in set(statuses)},
+        }
+
+
+def get_job_manager() -> JobManager:
+    return current_app.extensions['job_manager']
+
+def unknown_job(job_id):
+    return {"exception": f"Unknown or expired job_id {job_id}"}, 404
+
+@jobs_bp.errorhandler(Exception)
+def handle_exception(e: Exception):
+    return {"exception": traceback.format_exc()}, 500
+
+@jobs_bp.route('/jobs', methods=['POST'])
+def create_job():
+    model_id, images = read_request(request)
+    mask_format = get_mask_format(request)
+    composite_format = get_composite_format(request)
+    try:
+        job = get_job_manager().submit(model_id, images, mask_format, composite_format)
+    except queue.Full:
+        return {"exception": "Too many queued jobs, try again later"}, 503
+    response = jsonify(job.to_json())
+    response.status_code = 202
+    response.headers['Location'] = url_for('jobs.job_status', job_id=job.job_id)
+    return response
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    return jsonify(job.to_json())
+
+@jobs_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return unknown_job(job_id)
+    if job.status == JobStatus.FAILED:
+        return {"exception": job.error}, 500
+    if job.status != JobStatus.COMPLETE:
+        response = jsonify(job.to_json())
+        response.status_code = 202
+        return response
+    return jsonify(job.result)
@@ -0,0 +1,14 @@
+from flask import Blueprint, current_app, jsonify
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "loaded_models": current_app.extensions['model_registry'].loaded(),
+        "batching": current_app.extensions['batch_scheduler'].get_metrics(),
+        "jobs": current_app.extensions['job_manager'].get_metrics(),
+        "prediction_cache": current_app.extensions['prediction_cache'].get_metrics(),
+        "png_encoding": current_app.extensions['png_encoder'].get_metrics(),
+    })
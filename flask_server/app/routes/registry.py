@@ -0,0 +1,44 @@
+from flask import Blueprint, current_app, jsonify
+import traceback
+
+
+registry_bp = Blueprint('registry', __name__)
+
+@registry_bp.errorhandler(Exception)
+def handle_exception(e: Exception):
+    return {"exception": traceback.format_exc()}, 500
+
+def get_registry():
+    return current_app.extensions['model_registry']
+
+def unknown_model(model_id):
+    return {"exception": f"Unknown model_id {model_id}"}, 404
+
+@registry_bp.route('/models', methods=['GET'])
+def list_models():
+    registry = get_registry()
+    return jsonify({model_id: registry.is_loaded(model_id) for model_id in registry.factories})
+
+@registry_bp.route('/models/<model_id>/load', methods=['POST'])
+def load_model(model_id):
+    registry = get_registry()
+    if model_id not in registry.factories:
+        return unknown_model(model_id)
+    registry.load(model_id)
+    return jsonify({"model_id": model_id, "loaded": True})
+
+@registry_bp.route('/models/<model_id>/unload', methods=['POST'])
+def unload_model(model_id):
+    registry = get_registry()
+    if model_id not in registry.factories:
+        return unknown_model(model_id)
+    registry.unload(model_id)
+    return jsonify({"model_id": model_id, "loaded": False})
+
+@registry_bp.route('/models/<model_id>/reload', methods=['POST'])
+def reload_model(model_id):
+    registry = get_registry()
+    if model_id not in registry.factories:
+        return unknown_model(model_id)
+    registry.reload(model_id)
+    return jsonify({"model_id": model_id, "loaded": True})
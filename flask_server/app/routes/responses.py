@@ -5,6 +5,12 @@ import base64
 from PIL import Image
 import io
 import cv2 as cv
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from .bounding_boxes import BoundingBoxIndex
 
 
 class AnnotationLabel(Enum):
@@ -27,31 +33,85 @@ class ModelAnnotation:
         area: float,
         mean_intensity: float,
         seed_id: int,
+        offset: tuple[int, int] = None,
+        image_shape: tuple[int, int] = None,
+        stats: dict[str, float] = None,
     ) -> None:
-        
+        """
+        The mask is stored cropped to its non-zero extent. It can be given either as a full-frame mask
+        (offset=None), which is cropped here, or already cropped, with the (x, y) offset of its top left
+        corner and the (height, width) of the full image.
+        stats are optional further statistics of the pixels under the mask (std, min, max, percentiles),
+        only serialised when given.
+        """
+        if offset is None:
+            image_shape = mask.shape
+            mask, offset = crop_to_content(mask)
+
         self.bbox = bbox
-        self.mask = mask
+        self.crop = mask
+        self.offset = offset
+        self.image_shape = image_shape
         self.label = label
         self.confidence = confidence
         self.area = area
         self.mean_intensity = mean_intensity
+        self.stats = stats
         self.seed_id = None
-        self.hull = self.get_hull()
+        self._hull = None
+        self._hull_area = None
+
+    @property
+    def mask(self) -> np.ndarray:
+        """ Full-frame view of the mask, materialised on demand """
+        return self.to_full_frame(self.crop)
+
+    @property
+    def window(self) -> tuple[int, int, int, int]:
+        """ (x0, y0, x1, y1) of the cropped mask in the full image """
+        x0, y0 = self.offset
+        return x0, y0, x0 + self.crop.shape[1], y0 + self.crop.shape[0]
+
+    def window_bbox(self) -> list[int]:
+        """ The window as an [x, y, width, height] box """
+        x0, y0, x1, y1 = self.window
+        return [x0, y0, x1 - x0, y1 - y0]
+
+    @property
+    def hull(self) -> np.ndarray:
+        """ Convex hull of the mask, in the same cropped frame as the mask """
+        if self._hull is None:
+            self._hull = get_convex_hull(self.crop)
+        return self._hull
+
+    @property
+    def hull_area(self) -> int:
+        if self._hull_area is None:
+            self._hull_area = int(np.count_nonzero(self.hull))
+        return self._hull_area
+
+    def to_full_frame(self, crop: np.ndarray) -> np.ndarray:
+        full = np.zeros(self.image_shape, dtype=crop.dtype)
+        x0, y0, x1, y1 = self.window
+        full[y0:y1, x0:x1] = crop
+        return full
 
     def get_hull(self) -> np.ndarray:
-        if self.mask.any():
-            contours, _ = cv.findContours(
-                self.mask, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE
-            )
-            hull = cv.convexHull(np.vstack(contours))
-            hull_mask = cv.drawContours(np.zeros_like(self.mask), [hull], -1, 255, -1)
-            return hull_mask
-        else:
-            return np.zeros_like(self.mask)
+        return self.to_full_frame(self.hull)
     
     def overlap(self, other: 'ModelAnnotation') -> float:
-        intersection = cv.bitwise_and(self.hull, other.hull).sum()
-        union = cv.bitwise_or(self.hull, other.hull).sum()
+        """ Intersection over union of the convex hulls, computed only over the window where the crops meet """
+        x0, y0, x1, y1 = self.window
+        other_x0, other_y0, other_x1, other_y1 = other.window
+        left, top = max(x0, other_x0), max(y0, other_y0)
+        right, bottom = min(x1, other_x1), min(y1, other_y1)
+        intersection = 0
+        if left < right and top < bottom:
+            intersection = np.count_nonzero(
+                self.hull[top - y0:bottom - y0, left - x0:right - x0]
+                & other.hull[top - other_y0:bottom - other_y0, left - other_x0:right - other_x0]
+            )
+        union = self.hull_area + other.hull_area - intersection
         if union > 0:
             return intersection / union
         else:
@@ -73,18 +133,23 @@ class ModelAnnotation:
                    or self_min_y > other_max_y 
                    or self_max_y < other_min_y)
 
-    def to_json(self) -> dict:
-        mask = add_transparency(self.mask)
-        mask_str = get_base64_encoding(mask)
-        return {
+    def to_json(self, mask_format: str = "png", encoder: "PngEncoder" = None) -> dict:
+        if mask_format == "rle":
+            mask = get_rle_encoding(self.crop, self.offset)
+        else:
+            mask = encode_mask(self.mask, mask_format, encoder)
+        response = {
             "bbox": self.bbox,
-            "mask": mask_str,
+            "mask": mask,
             "label": self.label.value,
             "confidence": self.confidence,
             "area": self.area,
             "mean_intensity": self.mean_intensity,
             "seed_id": self.seed_id,
         }
+        if self.stats is not None:
+            response["stats"] = self.stats
+        return response
 
 
 class ModelResponse:
@@ -94,27 +159,68 @@ class ModelResponse:
         self.height = height
         self.populate_seed_indices()
 
-    def to_json(self) -> dict:
-        return {
+    def to_json(self, mask_format: str = "png", composite_format: str = "masks", encoder: "PngEncoder" = None) -> dict:
+        """ Serialise the response. Masks are encoded by encoder, which runs them on its thread pool if it has one """
+        encoder = encoder or DEFAULT_PNG_ENCODER
+        response = {
             "width": self.width,
             "height": self.height,
-            "annotations": [a.to_json() for a in self.annotations],
-            "composite_masks": {k: get_base64_encoding(add_transparency(v)) 
-                                for k,v in self.get_composite_masks().items()},
-            "seed_indices": self.flatten_seed_indices(),
+            "annotations": encoder.map(lambda a: a.to_json(mask_format, encoder), self.annotations),
         }
+        if composite_format == "masks":
+            composite_masks = self.get_composite_masks()
+            encoded = encoder.map(lambda mask: encode_mask(mask, mask_format, encoder), composite_masks.values())
+            response["composite_masks"] = dict(zip(composite_masks.keys(), encoded))
+        elif composite_format == "label_map":
+            response["label_map"] = encoder.encode(self.get_label_map())
+        else:
+            raise ValueError(f"Unknown composite format {composite_format}. Expected one of {COMPOSITE_FORMATS}")
+        response["seed_indices"] = self.flatten_seed_indices()
+        return response
+
+    def iter_json(self, mask_format: str = "png", composite_format: str = "masks", encoder: "PngEncoder" = None):
+        """
+        The same content as to_json, as a sequence of records that can be sent as soon as each is serialised:
+        a header, one record per annotation (in order), the composites, and finally the seed indices.
+        """
+        encoder = encoder or DEFAULT_PNG_ENCODER
+        yield {"type": "header", "width": self.width, "height": self.height, "num_annotations": len(self.annotations)}
+        annotations = encoder.imap(lambda a: a.to_json(mask_format, encoder), self.annotations)
+        for i, annotation in enumerate(annotations):
+            yield {"type": "annotation", "index": i, "annotation": annotation}
+        if composite_format == "masks":
+            composite_masks = self.get_composite_masks()
+            encoded = encoder.map(lambda mask: encode_mask(mask, mask_format, encoder), composite_masks.values())
+            yield {"type": "composite_masks", "composite_masks": dict(zip(composite_masks.keys(), encoded))}
+        elif composite_format == "label_map":
+            yield {"type": "label_map", "label_map": encoder.encode(self.get_label_map())}
+        else:
+            raise ValueError(f"Unknown composite format {composite_format}. Expected one of {COMPOSITE_FORMATS}")
+        yield {"type": "seed_indices", "seed_indices": self.flatten_seed_indices()}
 
-    def get_composite_masks(self) -> dict[int, str]:
-        distinct_labels = {annotation.label.value for annotation in self.annotations}
+    def get_composite_masks(self) -> dict[int, np.ndarray]:
+        """ One full-frame mask per label, built in a single pass that ORs each cropped mask into its label's plane """
         composite_masks = {}
-        for label in distinct_labels:
-            composite_mask = np.zeros((self.height, self.width), dtype=np.uint8)
-            for annotation in self.annotations:
-                if annotation.label.value != label:
-                    continue
-                composite_mask = cv.bitwise_or(composite_mask, annotation.mask)
-            composite_masks[label] = composite_mask
-        return composite_masks
+        for annotation in self.annotations:
+            label = annotation.label.value
+            if label not in composite_masks:
+                composite_masks[label] = np.zeros((self.height, self.width), dtype=np.uint8)
+            x0, y0, x1, y1 = annotation.window
+            window = composite_masks[label][y0:y1, x0:x1]
+            np.bitwise_or(window, annotation.crop, out=window)
+        return dict(sorted(composite_masks.items()))
+
+    def get_label_map(self) -> np.ndarray:
+        """
+        All composites packed into one uint8 image: bit n of a pixel is set when an annotation with label value n
+        covers it, so a pixel covered by a seed (1) and a void (5) has value 0b100010.
+        """
+        label_map = np.zeros((self.height, self.width), dtype=np.uint8)
+        for annotation in self.annotations:
+            x0, y0, x1, y1 = annotation.window
+            window = label_map[y0:y1, x0:x1]
+            window[annotation.crop > 0] |= np.uint8(1 << annotation.label.value)
+        return label_map
 
     def flatten_seed_indices(self) -> list[list[int]]:
         seed_dict = {}
@@ -131,13 +237,16 @@ class ModelResponse:
 
         for i, seed in enumerate(seeds):
             seed.seed_id = i
+
+        # hulls can only overlap where the mask windows meet, so only seeds whose window touches the
+        # annotation's window are candidates; they are visited in seed order to keep ties stable
+        seed_index = BoundingBoxIndex([seed.window_bbox() for seed in seeds])
         
         for annotation in other:
             seed_id = None
             max_overlap = 0
-            for seed in seeds:
-                if not annotation.bbox_overlap(seed):
-                    continue
+            for i in seed_index.query(annotation.window_bbox()):
+                seed = seeds[i]
                 overlap = annotation.overlap(seed)
                 if overlap > max_overlap:
                     seed_id = seed.seed_id
@@ -148,14 +257,173 @@ class ModelResponse:
                 annotation.seed_id = None
 
 
-def get_base64_encoding(mask: np.ndarray) -> str:
+MASK_FORMATS = ("png", "rle")
+COMPOSITE_FORMATS = ("masks", "label_map")
+
+
+def crop_to_content(mask: np.ndarray) -> tuple[np.ndarray, tuple[int, int]]:
+    """ Crop a mask to the bounding box of its non-zero pixels, returning the crop and its (x, y) offset """
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return mask[:0, :0], (0, 0)
+    y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    # copy so the full-frame mask is not kept alive by the crop
+    return mask[y0:y1, x0:x1].copy(), (int(x0), int(y0))
+
+
+def get_convex_hull(mask: np.ndarray) -> np.ndarray:
+    if mask.any():
+        contours, _ = cv.findContours(
+            mask, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE
+        )
+        hull = cv.convexHull(np.vstack(contours))
+        hull_mask = cv.drawContours(np.zeros_like(mask), [hull], -1, 255, -1)
+        return hull_mask
+    else:
+        return np.zeros_like(mask)
+
+
+def encode_mask(mask: np.ndarray, mask_format: str = "png", encoder: "PngEncoder" = None):
+    """ Encode a full-frame mask as a base64 PNG with transparency ("png") or as RLE cropped to its extent ("rle") """
+    if mask_format == "png":
+        return (encoder or DEFAULT_PNG_ENCODER).encode(add_transparency(mask))
+    elif mask_format == "rle":
+        return get_rle_encoding(mask)
+    raise ValueError(f"Unknown mask format {mask_format}. Expected one of {MASK_FORMATS}")
+
+
+def get_rle_encoding(mask: np.ndarray, offset: tuple[int, int] = (0, 0)) -> dict:
+    """
+    COCO-style uncompressed RLE of the non-zero pixels of a mask, cropped to their bounding box.
+    If the mask is itself a crop of a larger image, offset is the (x, y) position of its top left corner.
+
+    Returns:
+        offset: [x, y] of the top left corner of the crop in the full image
+        size: [height, width] of the crop
+        counts: alternating run lengths of background and mask pixels, in column-major order, starting with background
+    """
+    crop, (x0, y0) = crop_to_content(mask)
+    if crop.size == 0:
+        return {"offset": [0, 0], "size": [0, 0], "counts": []}
+    return {
+        "offset": [x0 + int(offset[0]), y0 + int(offset[1])],
+        "size": [crop.shape[0], crop.shape[1]],
+        "counts": rle_counts(crop > 0),
+    }
+
+
+def rle_counts(binary_mask: np.ndarray) -> list[int]:
+    flat = binary_mask.flatten(order="F")
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [len(flat)])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def decode_rle(rle: dict, height: int, width: int) -> np.ndarray:
+    """ Rasterise an RLE produced by get_rle_encoding back to a full-frame 0/255 mask """
+    mask = np.zeros((height, width), dtype=np.uint8)
+    crop_height, crop_width = rle["size"]
+    if crop_height == 0 or crop_width == 0:
+        return mask
+    values = np.zeros(len(rle["counts"]), dtype=np.uint8)
+    values[1::2] = 255
+    crop = np.repeat(values, rle["counts"]).reshape((crop_height, crop_width), order="F")
+    x0, y0 = rle["offset"]
+    mask[y0:y0 + crop_height, x0:x0 + crop_width] = crop
+    return mask
+
+
+def get_base64_encoding(mask: np.ndarray, compress_level: int = 6) -> str:
     mask_image = Image.fromarray(mask)
     buffer = io.BytesIO()
-    mask_image.save(buffer, format="png")
+    mask_image.save(buffer, format="png", compress_level=compress_level)
     mask_str = base64.b64encode(buffer.getvalue()).decode("utf-8")
     return mask_str
 
 
+class PngEncoder:
+    """
+    Encodes masks as base64 PNGs for ModelResponse.to_json.
+
+    With num_workers > 1 the masks of a response are encoded concurrently on a thread pool (zlib releases the GIL
+    while compressing), with at most window = 2 * num_workers encodings ahead of whoever reads the results. compress_level trades size for speed: 6 is PIL's default, 1 is much faster for slightly
+    larger payloads. Up to cache_size encodings are kept, keyed on a hash of the mask's content, so repeated masks
+    (empty composites, the same image analysed twice) are only encoded once.
+    """
+
+    def __init__(self, num_workers: int = 0, compress_level: int = 6, cache_size: int = 0) -> None:
+        self.num_workers = max(num_workers, 1)
+        self.window = 2 * self.num_workers
+        self.compress_level = compress_level
+        self.cache_size = cache_size
+        self.cache: OrderedDict[tuple, str] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.pool = ThreadPoolExecutor(num_workers, thread_name_prefix="png-encoder") if num_workers > 1 else None
+
+    def map(self, fn, items) -> list:
+        """ Apply fn to every item, on the thread pool if there is one, keeping the order of items """
+        return list(self.imap(fn, items))
+
+    def imap(self, fn, items):
+        """
+        Like map, but yields each result as soon as it and those before it are ready. Items are only taken from items
+        (and submitted) as results are yielded, keeping window in flight, so a slow reader holds back the encoding
+        rather than every encoded result piling up in memory.
+        """
+        if self.pool is None:
+            yield from (fn(item) for item in items)
+            return
+        items = iter(items)
+        pending = deque(self.pool.submit(fn, item) for item in itertools.islice(items, self.window))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                # top the window up before yielding, so the workers stay busy while the reader handles this result
+                pending.extend(self.pool.submit(fn, item) for item in itertools.islice(items, 1))
+                yield result
+        finally:
+            # the reader stopped early (e.g. the client disconnected)
+            for future in pending:
+                future.cancel()
+
+    def encode(self, mask: np.ndarray) -> str:
+        if self.cache_size <= 0:
+            return get_base64_encoding(mask, self.compress_level)
+        mask = np.ascontiguousarray(mask)
+        key = (hashlib.blake2b(mask, digest_size=16).digest(), mask.shape, mask.dtype.str)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+            self.misses += 1
+        encoded = get_base64_encoding(mask, self.compress_level)
+        with self.lock:
+            self.cache[key] = encoded
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return encoded
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            return {
+                "workers": self.num_workers,
+                "compress_level": self.compress_level,
+                "cache_size": len(self.cache),
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+            }
+
+
+# Serial and uncached, as masks were always encoded before the encoder became configurable
+DEFAULT_PNG_ENCODER = PngEncoder()
+
+
 def add_transparency(mask) -> np.ndarray:
     transparency = np.zeros_like(mask)
     transparency[mask > 0] = 128
@@ -1,31 +1,88 @@
+import os
+import io
+import base64
+import cv2 as cv
 import numpy as np
-from enum import Enum
-
-class AnnotationLabel(Enum):
-    POD = 0
-    SEED = 1
-    INTERIOR = 2
-    ENDOSPERM = 3
-    INFESTATION = 4
-    VOID = 5
-
-def groupMasksBySeed(annotations):
-    seed_boxes = [(i, ann.bbox) for i, ann in enumerate(annotations) if ann.label == AnnotationLabel.SEED]
-    groups = {seed_index: [] for seed_index, _ in seed_boxes}
-
-    for i, ann in enumerate(annotations):
-        if ann.label != AnnotationLabel.SEED:
-            mask = ann.mask
-            mask_indices = np.where(mask == 255)
-            mask_coords = np.vstack((mask_indices[1], mask_indices[0])).T
-
-            for seed_index, bbox in seed_boxes:
-                if mask_in_bbox(mask_coords, bbox):
-                    groups[seed_index].append(i)
-
-    return [(seed, masks) for seed, masks in groups.items()]
-
-def mask_in_bbox(mask_coords, bbox):
-    x, y, w, h = bbox
-    return np.all((mask_coords[:, 0] >= x) & (mask_coords[:, 0] < x + w) &
-                  (mask_coords[:, 1] >= y) & (mask_coords[:, 1] < y + h))
\ No newline at end of file
+from PIL import Image
+from werkzeug.utils import secure_filename
+from .responses import MASK_FORMATS, COMPOSITE_FORMATS
+
+RLE_MIMETYPE = 'application/vnd.seedbank.rle+json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+def write_files_to_disk(files):
+    for file in files:
+        filename = secure_filename(file.filename)
+        file_path = os.path.join('uploads', filename)
+        with open(file_path, 'wb') as f:
+            f.write(file.read())
+
+def decode_image(buffer: bytes) -> np.ndarray:
+    """ Decode an encoded image (png, jpeg, ...) straight from its bytes into a grayscale array """
+    image = cv.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Could not decode uploaded image")
+    return image
+
+def decode_base64_image(base64_image: str) -> np.ndarray:
+    image_data = base64.b64decode(base64_image.split(",")[1])
+    image = Image.open(io.BytesIO(image_data)).convert("L")
+    return np.array(image)
+
+def read_request(request) -> tuple[str, list[np.ndarray]]:
+    """
+    Read the model_id and grayscale images from a request. Images can be sent as
+    - multipart/form-data: one or more files under the 'images' field, model_id as a form field
+    - application/octet-stream: a single encoded image as the raw body, model_id as a query parameter
+    - application/json: base64 data URLs under 'images' (kept for older clients)
+    """
+    if request.mimetype == 'multipart/form-data':
+        model_id = request.form.get('model_id', request.args.get('model_id'))
+        images = [decode_image(file.read()) for file in request.files.getlist('images')]
+    elif request.mimetype == 'application/octet-stream':
+        model_id = request.args.get('model_id')
+        images = [decode_image(request.stream.read())]
+    else:
+        data = request.get_json()
+        model_id = data.get('model_id')
+        images = [decode_base64_image(base64_image) for base64_image in data['images']]
+    if not images:
+        raise ValueError("No images were uploaded")
+    return model_id, images
+
+def get_request_option(request, name: str):
+    """ An option sent as a query parameter, form field or JSON body field, or None if it was not sent """
+    value = request.args.get(name, request.form.get(name))
+    if value is None and request.is_json:
+        value = request.get_json().get(name)
+    return value
+
+def get_mask_format(request) -> str:
+    """
+    Mask encoding requested by the client, either as a 'mask_format' field (query, form or JSON body)
+    or by accepting the RLE media type. Defaults to base64 PNGs.
+    """
+    mask_format = get_request_option(request, 'mask_format')
+    if mask_format is None:
+        accepts_rle = any(mimetype == RLE_MIMETYPE for mimetype, _ in request.accept_mimetypes)
+        mask_format = "rle" if accepts_rle else "png"
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format {mask_format}. Expected one of {MASK_FORMATS}")
+    return mask_format
+
+def get_composite_format(request) -> str:
+    """
+    How composite masks are returned, from a 'composite_format' field: one mask per label ("masks", the default)
+    or a single PNG packing every label as a bit of each pixel ("label_map").
+    """
+    composite_format = get_request_option(request, 'composite_format') or "masks"
+    if composite_format not in COMPOSITE_FORMATS:
+        raise ValueError(f"Unknown composite format {composite_format}. Expected one of {COMPOSITE_FORMATS}")
+    return composite_format
+
+def wants_stream(request) -> bool:
+    """ Whether the client asked for newline-delimited JSON, with a truthy 'stream' field or by accepting NDJSON """
+    stream = get_request_option(request, 'stream')
+    if stream is not None:
+        return str(stream).lower() in ('1', 'true', 'yes')
+    return any(mimetype == NDJSON_MIMETYPE for mimetype, _ in request.accept_mimetypes)
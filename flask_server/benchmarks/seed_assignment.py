@@ -0,0 +1,89 @@
+"""
+Times ModelResponse.populate_seed_indices on synthetic images with a growing number of seeds, against the
+previous all-pairs assignment over full-frame hull masks.
+
+From the root directory:
+    python -m flask_server.benchmarks.seed_assignment
+"""
+import argparse
+import time
+
+import cv2 as cv
+import numpy as np
+
+from flask_server.app.routes.responses import AnnotationLabel, ModelAnnotation, ModelResponse
+
+
+def make_annotations(num_seeds: int, parts_per_seed: int, rng: np.random.Generator) -> tuple[list, int]:
+    """ A grid of square seeds, each with a few smaller parts inside it """
+    cell = 40
+    columns = int(np.ceil(np.sqrt(num_seeds)))
+    size = columns * cell
+    annotations = []
+    for i in range(num_seeds):
+        x, y = (i % columns) * cell + 4, (i // columns) * cell + 4
+        annotations.append(make_annotation([x, y, 32, 32], AnnotationLabel.SEED, size))
+        for _ in range(parts_per_seed):
+            px, py = x + rng.integers(0, 20), y + rng.integers(0, 20)
+            annotations.append(make_annotation([int(px), int(py), 12, 12], AnnotationLabel.ENDOSPERM, size))
+    return annotations, size
+
+
+def make_annotation(bbox: list[int], label: AnnotationLabel, size: int) -> ModelAnnotation:
+    x, y, w, h = bbox
+    mask = np.zeros((size, size), dtype=np.uint8)
+    cv.ellipse(mask, (x + w // 2, y + h // 2), (w // 2, h // 2), 0, 0, 360, 255, -1)
+    return ModelAnnotation(bbox, mask, label, 0.9, float(w * h), 0.0, None)
+
+
+def brute_force_seed_indices(annotations: list[ModelAnnotation], threshold: float = 0.05) -> list:
+    """ The previous assignment: every part against every seed, IoU over full-frame hulls """
+    seeds = [x for x in annotations if x.label == AnnotationLabel.SEED]
+    hulls = {id(x): x.get_hull() for x in annotations}
+    seed_ids = []
+    for annotation in annotations:
+        if annotation.label == AnnotationLabel.SEED:
+            continue
+        seed_id, max_overlap = None, 0
+        for i, seed in enumerate(seeds):
+            if not annotation.bbox_overlap(seed):
+                continue
+            intersection = cv.bitwise_and(hulls[id(annotation)], hulls[id(seed)])
+            union = cv.bitwise_or(hulls[id(annotation)], hulls[id(seed)])
+            union_area = np.count_nonzero(union)
+            overlap = np.count_nonzero(intersection) / union_area if union_area else 0
+            if overlap > max_overlap:
+                seed_id, max_overlap = i, overlap
+        seed_ids.append(seed_id if max_overlap > threshold else None)
+    return seed_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[25, 100, 200, 400])
+    parser.add_argument("--parts-per-seed", type=int, default=3)
+    parser.add_argument("--skip-brute-force-above", type=int, default=200,
+                        help="Seed count above which the all-pairs baseline is not timed")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'seeds':>6} {'parts':>6} {'image':>10} {'indexed (s)':>12} {'all-pairs (s)':>14}")
+    for num_seeds in args.seeds:
+        annotations, size = make_annotations(num_seeds, args.parts_per_seed, rng)
+        start = time.perf_counter()
+        ModelResponse(annotations, size, size)
+        indexed = time.perf_counter() - start
+
+        brute_force = "-"
+        if num_seeds <= args.skip_brute_force_above:
+            start = time.perf_counter()
+            expected = brute_force_seed_indices(annotations)
+            brute_force = f"{time.perf_counter() - start:.3f}"
+            actual = [x.seed_id for x in annotations if x.label != AnnotationLabel.SEED]
+            assert actual == expected, "indexed assignment disagrees with the all-pairs baseline"
+
+        print(f"{num_seeds:>6} {num_seeds * args.parts_per_seed:>6} {f'{size}x{size}':>10} {indexed:>12.3f} {brute_force:>14}")
+
+
+if __name__ == "__main__":
+    main()
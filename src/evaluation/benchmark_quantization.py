@@ -0,0 +1,91 @@
+"""
+Latency and mAP of the server's RCNN with each CPU optimisation, against the fp32 model.
+
+Every variant is built from the same inference configs with "quantization" and "channels_last" overridden,
+timed on the first --num-images test images and evaluated with full_evaluation on the same unshuffled test images. From the root directory:
+    python -m src.evaluation.benchmark_quantization \
+        --configs src/mask_rcnn_training/configs/inference_configs.json \
+        --test-folder /vol/bitbucket/cdr23/dataset_final/ \
+        --test-json /vol/bitbucket/cdr23/dataset_final/full_test.json \
+        --calibration-folder /vol/bitbucket/cdr23/dataset_final/ \
+        --calibration-json /vol/bitbucket/cdr23/dataset_final/synth_val.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import torch
+
+from flask_server.app.models.rcnn import RCNN
+from src.evaluation.evaluation import full_evaluation, load_data
+
+VARIANTS = {
+    "fp32": {"quantization": None, "channels_last": False},
+    "fp32 channels_last": {"quantization": None, "channels_last": True},
+    "dynamic int8": {"quantization": "dynamic", "channels_last": False},
+    "static int8": {"quantization": "static", "channels_last": False},
+    "static int8 channels_last": {"quantization": "static", "channels_last": True},
+}
+
+
+def build(base_configs: dict, variant: dict) -> RCNN:
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+        json.dump({**base_configs, **variant, "use_gpu": False}, file)
+    try:
+        return RCNN(file.name)
+    finally:
+        os.remove(file.name)
+
+
+def latency(model: RCNN, images: list) -> float:
+    """ Mean seconds per image, after one warm-up prediction """
+    model.predict(images[0])
+    start = time.perf_counter()
+    for image in images:
+        model.predict(image)
+    return (time.perf_counter() - start) / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", required=True, help="RCNN inference configs")
+    parser.add_argument("--test-folder", required=True)
+    parser.add_argument("--test-json", required=True)
+    parser.add_argument("--calibration-folder", required=True)
+    parser.add_argument("--calibration-json", required=True)
+    parser.add_argument("--num-calibration-images", type=int, default=8)
+    parser.add_argument("--num-images", type=int, default=20, help="Images to time each variant on")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS))
+    args = parser.parse_args()
+
+    with open(args.configs, 'r') as file:
+        base_configs = json.load(file)
+    base_configs.update({
+        "calibration_images_path": args.calibration_folder,
+        "calibration_annotations_name": args.calibration_json,
+        "num_calibration_images": args.num_calibration_images,
+    })
+
+    images = []
+    for batch_images, _ in load_data(args.test_folder, args.test_json, batch_size=1, shuffle=False):
+        images.append((batch_images[0] * 255).to(torch.uint8).numpy().squeeze())
+        if len(images) >= args.num_images:
+            break
+
+    results = {}
+    for name in ["fp32"] + [name for name in args.variants if name != "fp32"]:
+        model = build(base_configs, VARIANTS[name])
+        # unshuffled, so every variant is scored on the same images and the mAP deltas compare like with like
+        _, mean_map = full_evaluation(model, args.test_folder, args.test_json, shuffle=False)
+        results[name] = (latency(model, images), mean_map)
+
+    fp32_latency, fp32_map = results["fp32"]
+    print(f"{'variant':<28} {'latency (s)':>12} {'speed-up':>9} {'mAP':>8} {'mAP delta':>10}")
+    for name, (seconds, mean_map) in results.items():
+        print(f"{name:<28} {seconds:>12.3f} {fp32_latency / seconds:>8.2f}x {mean_map:>8.4f} {mean_map - fp32_map:>+10.4f}")
+
+
+if __name__ == "__main__":
+    main()
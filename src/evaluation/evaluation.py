@@ -1,10 +1,9 @@
 from torchmetrics.detection.mean_ap import MeanAveragePrecision as mAP
 from src.mask_rcnn_training.training_utils.ring_mask_converter import process
 from src.mask_rcnn_training.training_utils.utils import NestedTensorHandler, convert_labels#, print_structure
+from src.mask_rcnn_training.training_utils.data_loading import load_coco_dataset, make_loader
 
 from flask_server.app.routes.responses import ModelResponse
-from torchvision.transforms import v2
-from torchvision import datasets
 import torch
 import numpy as np
 import gc
@@ -29,7 +28,8 @@ def format_response_for_eval(
     labels = torch.zeros(size=(length,))
     scores = torch.zeros(size=(length,))
     for i, annot in enumerate(response.annotations):
-        masks[i] = torch.tensor(annot.mask)
+        x0, y0, x1, y1 = annot.window
+        masks[i, y0:y1, x0:x1] = torch.tensor(annot.crop)
         boxes[i] = torch.FloatTensor(annot.bbox)
         labels[i] = annotlabel2label[int(annot.label.value)]
         scores[i] = annot.confidence
@@ -45,31 +45,11 @@ def load_data(
     folder_path: str,
     file_path: str,
     batch_size: int,
-    shuffle: bool=True
+    shuffle: bool=True,
+    loader_configs: dict=None,
 ) -> torch.utils.data.DataLoader:
-    transforms = v2.Compose([
-        v2.ToImage(),
-        v2.Grayscale(),
-        v2.ToDtype(torch.float32, 
-        scale=True),
-    ])
-    dataset = datasets.CocoDetection(
-        folder_path, 
-        file_path, 
-        transforms=transforms
-    )
-    dataset = datasets.wrap_dataset_for_transforms_v2(
-        dataset, 
-        target_keys=["boxes", "labels", "masks"]
-    )
-    loader = torch.utils.data.DataLoader(
-        dataset, 
-        batch_size=batch_size, 
-        collate_fn=lambda batch: tuple(zip(*batch)), 
-        shuffle=shuffle,
-        num_workers=4,
-    )
-    return loader
+    """ loader_configs as the "data_loader" training configs (see data_loading.LOADER_DEFAULTS) """
+    return make_loader(load_coco_dataset(folder_path, file_path), batch_size, shuffle=shuffle, loader_configs=loader_configs)
 
 def preprocess(images, targets, label_order, device):
     id2label = {3: 1, 2: 2, 0: 3, 4: 4, 1: 5}
@@ -86,14 +66,16 @@ def full_evaluation(
     device: torch.device=torch.device('cuda:0' if torch.cuda.is_available() else 'cpu'),
     pred_func=lambda image, response: None,
     targ_func=lambda image, target, threshold, label2name: None,
+    shuffle: bool=True,
 ) -> dict[str, float]:
     # this code is not efficient - keep the number of images small!
+    # only the first ~100 images are evaluated: pass shuffle=False to evaluate the same ones on every call
     device = torch.device('cpu')
     loader = load_data(
         folder_path=test_folder, 
         file_path=test_json, 
         batch_size=1, 
-        shuffle=True
+        shuffle=shuffle
     )
     metric = mAP(
         class_metrics=True, 
@@ -0,0 +1,77 @@
+"""
+Times ring_mask_converter.process (vectorised, batched overlap removal) against the previous per-mask loop on
+random predictions shaped like the model's.
+
+From the root directory:
+    python -m src.mask_rcnn_training.benchmark_remove_overlap
+"""
+import argparse
+import time
+
+import torch
+
+from src.mask_rcnn_training.training_utils.ring_mask_converter import process
+
+
+def loop_remove_overlap(image, masks, labels, label_order, binary_threshold=0.5):
+    """ The previous implementation: per-mask loops over float (classes, height, width) planes """
+    label2id = dict([(int(label), i) for i, label in enumerate(label_order)])
+    total_masks = torch.zeros(size=(len(label_order), image.shape[1], image.shape[2])).to(masks.device)
+    for i in range(len(masks)):
+        j = label2id[int(labels[i])]
+        total_masks[j,:,:] = total_masks[j,:,:].bool() | (masks[i,:,:] > 0.5)
+    anti_masks = torch.zeros_like(total_masks)
+    for i in range(len(label_order)):
+        anti_masks[i,:,:] = torch.any(total_masks[i+1:,:,:].view(-1, image.shape[1], image.shape[2]).bool(), dim=0)
+    masks_out = torch.zeros_like(masks)
+    label2id = dict([(int(key), i) for i, key in enumerate(label_order)])
+    for i in range(len(masks)):
+        j = label2id[int(labels[i])]
+        masks_out[i,:,:] = (masks[i,:,:] > binary_threshold).bool() & ~anti_masks[j,:,:].bool()
+    return masks_out
+
+
+def time_it(fn, repeats: int, device: torch.device) -> float:
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=[1024, 1024], metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--masks", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    height, width = args.size
+    label_order = torch.tensor([1, 2, 3, 4, 5])
+    print(f"{'masks/image':>11} {'batch':>6} {'loop (s)':>10} {'vectorised (s)':>15} {'speed-up':>9}")
+    for num_masks in args.masks:
+        images = tuple(torch.rand(size=(1, height, width), device=device) for _ in range(args.batch_size))
+        targets = tuple({
+            'boxes': torch.zeros(size=(num_masks, 4), device=device),
+            'masks': torch.rand(size=(num_masks, 1, height, width), device=device) > 0.5,
+            'labels': label_order[torch.randint(len(label_order), size=(num_masks,))].to(device),
+            'scores': torch.rand(size=(num_masks,), device=device),
+        } for _ in range(args.batch_size))
+
+        loop = time_it(lambda: [
+            loop_remove_overlap(image, target['masks'], target['labels'], label_order)
+            for image, target in zip(images, targets)
+        ], args.repeats, device)
+        vectorised = time_it(lambda: process(images, targets, label_order), args.repeats, device)
+        print(f"{num_masks:>11} {args.batch_size:>6} {loop:>10.4f} {vectorised:>15.4f} {loop / vectorised:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Times a few training iterations for each combination of autocast dtype and backbone compilation, reporting images
+per second and peak memory, to choose the "autocast_dtype" and "compile_backbone" training configs for a machine.
+
+From the root directory:
+    python -m src.mask_rcnn_training.benchmark_training \
+        --configs src/mask_rcnn_training/configs/training_configs.json \
+        --iterations 20 --dtypes float32 bfloat16 float16 --compile 0 1
+
+float16 is skipped on CPU. The model is reloaded from the configs for every combination.
+"""
+import argparse
+import itertools
+
+import torch
+
+from src.mask_rcnn_training.training_utils.trainer import Trainer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", default="src/mask_rcnn_training/configs/training_configs.json")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed training iterations per combination")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed iterations first (compilation happens here)")
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "bfloat16", "float16"])
+    parser.add_argument("--compile", type=int, nargs="+", default=[0, 1], choices=[0, 1])
+    args = parser.parse_args()
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+
+    trainer = Trainer(args.configs)
+    print(f"Device: {trainer.device} | Batch size: {trainer.hyper_params['train_batch_size']}")
+    print(f"{'autocast':>9} {'compile':>8} {'images/s':>9} {'peak memory (MiB)':>18}")
+    for dtype, compile_backbone in itertools.product(args.dtypes, args.compile):
+        if dtype == "float16" and trainer.device.type != 'cuda':
+            continue
+        torch.manual_seed(0)
+        trainer.configs['autocast_dtype'] = dtype
+        trainer.configs['compile_backbone'] = bool(compile_backbone)
+        trainer.autocast_dtype = trainer.get_autocast_dtype(dtype)
+        trainer.scaler = trainer.get_grad_scaler()
+        trainer.model = trainer.load_model()
+        result = trainer.benchmark(args.iterations, warmup=args.warmup)
+        print(f"{dtype:>9} {bool(compile_backbone)!s:>8} {result['images_per_second']:>9.2f} {result['peak_memory_mib']:>18.0f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
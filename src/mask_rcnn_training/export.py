@@ -0,0 +1,40 @@
+"""
+Export trained Mask R-CNN weights to ONNX, for the RCNN server's "onnx" backend.
+
+From the root directory:
+    python -m src.mask_rcnn_training.export \
+        --configs flask_server/app/models/rcnn_inference_configs/fixed_inference_configs.json \
+        --output flask_server/app/models/final_model_weights/rcnn.onnx
+
+then set "backend": "onnx" and "onnx_path" in the server's inference_configs.json.
+"""
+import argparse
+import json
+
+from src.mask_rcnn_training.training_utils.model_builder import get_model, export_onnx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", required=True, help="Fixed inference configs with num_classes, hyper_params and model_path")
+    parser.add_argument("--weights", default=None, help="Weights to export, instead of the configs' model_path")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--sample-size", type=int, nargs=2, default=[512, 512], metavar=("HEIGHT", "WIDTH"),
+                        help="Size of the image traced during export; exported graphs accept any size")
+    args = parser.parse_args()
+
+    with open(args.configs, 'r') as file:
+        configs = json.load(file)
+    model = get_model(
+        configs['num_classes'] + 1,
+        max_detections=configs['hyper_params']['max_detections'],
+        model_path=args.weights or configs['model_path'],
+    )
+    # the server feeds single channel (grayscale) images
+    export_onnx(model, args.output, sample_shape=(1, *args.sample_size), opset_version=args.opset)
+    print(f"Exported {args.weights or configs['model_path']} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
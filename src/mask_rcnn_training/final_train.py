@@ -1,13 +1,17 @@
 from training_utils.trainer import Trainer
+from training_utils.distributed import cleanup_distributed, is_main_process
 import torch
 
+# for data parallel training over N processes (e.g. GPUs), launch with: torchrun --nproc_per_node=N <this script>
 torch.manual_seed(0)
 def main():
     trainer = Trainer('src/mask_rcnn_training/configs/training_configs.json')
     trainer.configs['model_folder'] = "/vol/bitbucket/or623/seed_models/final_models/"
     trainer.hyper_params['num_epochs'] = 20
-    print_trainer_configs(trainer)
+    if is_main_process():
+        print_trainer_configs(trainer)
     trainer.train()
+    cleanup_distributed()
 
 def print_trainer_configs(trainer):
     print("\nTrainer Configs\n")
@@ -1,6 +1,7 @@
 import torch
 import torch.utils.data
 from src.mask_rcnn_training.training_utils.ring_mask_converter import process
+from src.mask_rcnn_training.training_utils.postprocessing import postprocess_predictions
 from src.mask_rcnn_training.training_utils.utils import NestedTensorHandler, convert_labels
 from src.mask_rcnn_training.training_utils.model_builder import get_model
 import json
@@ -37,19 +38,7 @@ class Inferer:
     def predict(self, images):
         images = NestedTensorHandler.get_structure_on_device(images, self.device)
         preds = self.predict_internal(images)
-        images, preds = self.postprocess(images, preds)
-        for i in range(len(preds)):
-            preds = self.binarise(preds)
-            preds[i]['labels'] = self.deconvert(preds[i]['labels'])
-        return preds
-
-    def deconvert(self, labels):
-        return torch.tensor([self.label2id[int(label)] for label in labels])
-
-    def binarise(self, preds):
-        for i in range(len(preds)):
-            preds[i]['masks'] = (preds[i]['masks'] > self.hyper_params['binary_threshold']).to(self.device)
-        return preds
+        return self.postprocess(images, preds)
 
     def get_conversions(self):
         label_order = torch.tensor(self.training_configs['label_order'])
@@ -70,10 +59,17 @@ class Inferer:
         return images, targets
 
     def postprocess(self, images, preds):
-        if self.hyper_params['post-process']:
-            return process(images, preds, self.label_order)
-        else:
-            return images, preds
+        """ Binary masks with overlap removed, labels converted back to dataset ids and mask statistics, on the CPU """
+        return postprocess_predictions(
+            preds,
+            self.label_order,
+            binary_threshold=self.hyper_params['binary_threshold'],
+            remove_overlap=self.hyper_params['post-process'],
+            label_map=self.label2id,
+            # images are scaled to [0, 1], statistics are reported over 8-bit grey levels
+            intensity_images=[image.mean(dim=0) * 255 for image in images],
+            device='cpu',
+        )
 
     def evaluate_map(self, preds, targets):
         targets = self.mask_to_uint8_mask(list(targets))
@@ -0,0 +1,42 @@
+"""
+Pack a COCO dataset into pre-decoded, memory-mapped files for training (see training_utils/packed_dataset.py).
+
+From the root directory:
+    python -m src.mask_rcnn_training.pack_dataset \
+        --images-folder /vol/bitbucket/cdr23/dataset_final/ \
+        --annotations /vol/bitbucket/cdr23/dataset_final/synth_train.json \
+        --output /vol/bitbucket/cdr23/dataset_final/packed_train \
+        --class-order Seed Interior Endosperm Void Infestation
+
+then set "train_packed_path" (and likewise "val_packed_path") in the training configs. With --class-order (the
+training configs' class_order), overlap is removed while packing and the Trainer skips doing it every epoch.
+"""
+import argparse
+import json
+import time
+
+from src.mask_rcnn_training.training_utils.packed_dataset import pack_coco_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images-folder", required=True)
+    parser.add_argument("--annotations", required=True, help="COCO annotations json")
+    parser.add_argument("--output", required=True, help="Directory to write the packed dataset to")
+    parser.add_argument("--class-order", nargs="+", default=None,
+                        help="Category names from lowest to highest precedence, to remove overlap while packing")
+    args = parser.parse_args()
+
+    overlap_order = None
+    if args.class_order is not None:
+        with open(args.annotations, 'r') as file:
+            name2id = dict([(row['name'], row['id']) for row in json.load(file)['categories']])
+        overlap_order = [name2id[name] for name in args.class_order]
+
+    start = time.perf_counter()
+    num_images = pack_coco_dataset(args.images_folder, args.annotations, args.output, overlap_order=overlap_order)
+    print(f"Packed {num_images} images to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
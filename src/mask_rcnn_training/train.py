@@ -1,7 +1,9 @@
 from training_utils.trainer import Trainer
+from training_utils.distributed import cleanup_distributed, is_main_process
 import torch
 import sys
 
+# for data parallel training over N processes (e.g. GPUs), launch with: torchrun --nproc_per_node=N <this script>
 torch.manual_seed(0)
 def main(post_process, data):
     trainer = Trainer('src/mask_rcnn_training/configs/grid_search_training_configs.json')
@@ -21,8 +23,10 @@ def main(post_process, data):
     trainer.hyper_params['num_epochs'] = 10
     
     
-    print_trainer_configs(trainer)
+    if is_main_process():
+        print_trainer_configs(trainer)
     trainer.train()
+    cleanup_distributed()
 
 def print_trainer_configs(trainer):
     print("\nTrainer Configs\n")
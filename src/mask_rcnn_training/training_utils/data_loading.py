@@ -0,0 +1,125 @@
+import random
+import time
+import numpy as np
+import torch
+import torch.utils.data
+from torch.utils.data.distributed import DistributedSampler
+from torchvision import datasets
+from torchvision.transforms import v2
+
+# the "data_loader" section of the training configs; anything left out takes these values
+LOADER_DEFAULTS = {
+    "num_workers": 4,
+    "pin_memory": False,
+    "persistent_workers": False,
+    "prefetch_factor": None,
+    "seed": None,
+}
+
+def collate(batch):
+    """ (images, targets) tuples from a list of (image, target) pairs. A module level function, so spawned workers can pickle it """
+    return tuple(zip(*batch))
+
+def seed_worker(worker_id):
+    """ Seed numpy and random in each worker from the seed torch gives it, so augmentations are reproducible """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+def load_coco_dataset(folder_path, file_path):
+    """ A COCO dataset of grayscale float images in [0, 1] with 'boxes', 'labels' and 'masks' targets """
+    transforms = v2.Compose([
+        v2.ToImage(),
+        v2.Grayscale(),
+        v2.ToDtype(torch.float32, scale=True),
+    ])
+    dataset = datasets.CocoDetection(folder_path, file_path, transforms=transforms)
+    return datasets.wrap_dataset_for_transforms_v2(dataset, target_keys=["boxes", "labels", "masks"])
+
+def make_loader(dataset, batch_size, shuffle=True, loader_configs=None, distributed=False):
+    """
+    A DataLoader over dataset with the options of loader_configs (see LOADER_DEFAULTS):
+        num_workers: worker processes loading batches (0 loads in the main process)
+        pin_memory: collate into page-locked memory, so copies to the GPU can overlap compute
+        persistent_workers: keep workers alive between epochs rather than starting them again
+        prefetch_factor: batches each worker loads ahead (None for torch's default)
+        seed: seeds the shuffling and the workers, for reproducible epochs (None leaves them random)
+    With distributed, each process of the initialised process group loads its own shard through a DistributedSampler.
+    Call loader.sampler.set_epoch every epoch to shuffle differently. The sampler repeats items so shards are the same length.
+    """
+    configs = {**LOADER_DEFAULTS, **(loader_configs or {})}
+    unknown = set(configs) - set(LOADER_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown data loader configs {sorted(unknown)}. Expected some of {list(LOADER_DEFAULTS)}")
+    options = dict(
+        batch_size=batch_size,
+        collate_fn=collate,
+        num_workers=configs['num_workers'],
+        pin_memory=configs['pin_memory'] and torch.cuda.is_available(),
+    )
+    # these only apply to worker processes
+    if configs['num_workers'] > 0:
+        options['persistent_workers'] = configs['persistent_workers']
+        if configs['prefetch_factor'] is not None:
+            options['prefetch_factor'] = configs['prefetch_factor']
+    if distributed:
+        # the sampler shuffles, with the same seed in every process so the shards do not overlap
+        options['sampler'] = DistributedSampler(dataset, shuffle=shuffle, seed=configs['seed'] or 0)
+    else:
+        options['shuffle'] = shuffle
+    if configs['seed'] is not None:
+        generator = torch.Generator()
+        generator.manual_seed(configs['seed'])
+        options['generator'] = generator
+        options['worker_init_fn'] = seed_worker
+    return torch.utils.data.DataLoader(dataset, **options)
+
+
+class ThroughputMonitor:
+    """
+    Times a pass over a DataLoader: how many images it yielded per second, and how much of the pass was spent
+    waiting for the next batch rather than using it. A waiting fraction near 0 means the loader keeps up; near 1
+    means training is starved of data and more workers (or packed data) would help.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.images = 0
+        self.batches = 0
+        self.waiting = 0.0
+        self.elapsed = 0.0
+
+    def track(self, loader):
+        """ Yield the batches of loader, timing the pass """
+        self.reset()
+        start = time.perf_counter()
+        iterator = iter(loader)
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            self.waiting += time.perf_counter() - wait_start
+            self.images += len(batch[0])
+            self.batches += 1
+            self.elapsed = time.perf_counter() - start
+            yield batch
+        self.elapsed = time.perf_counter() - start
+
+    def report(self):
+        return {
+            "images": self.images,
+            "batches": self.batches,
+            "seconds": self.elapsed,
+            "images_per_second": self.images / self.elapsed if self.elapsed > 0 else 0.0,
+            "waiting_seconds": self.waiting,
+            "waiting_fraction": self.waiting / self.elapsed if self.elapsed > 0 else 0.0,
+        }
+
+    def summary(self):
+        report = self.report()
+        return (f"{report['images']} images in {report['seconds']:.1f}s | {report['images_per_second']:.2f} images/s | "
+                f"Waiting on data: {report['waiting_seconds']:.1f}s ({100 * report['waiting_fraction']:.1f}%)")
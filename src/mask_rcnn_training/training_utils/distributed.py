@@ -0,0 +1,47 @@
+import os
+import torch
+import torch.distributed as dist
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+def is_main_process():
+    """ Whether this process should write checkpoints, plots and printed logs: rank 0, or the only process """
+    return get_rank() == 0
+
+def init_distributed(use_gpu, backend=None):
+    """
+    Join the process group torchrun describes in the environment (WORLD_SIZE, RANK, LOCAL_RANK, MASTER_ADDR and
+    MASTER_PORT) and return this process's device. Without torchrun, or with a single process, nothing is initialised
+    and the device is cuda:0 or the CPU as before.
+    backend defaults to nccl on GPUs and gloo on CPU.
+    """
+    use_cuda = use_gpu and torch.cuda.is_available()
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return torch.device('cuda:0' if use_cuda else 'cpu')
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if use_cuda:
+        torch.cuda.set_device(local_rank)
+    if not is_distributed():
+        dist.init_process_group(backend=backend or ('nccl' if use_cuda else 'gloo'))
+    return torch.device(f'cuda:{local_rank}' if use_cuda else 'cpu')
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+def all_reduce_sum(tensor):
+    """ tensor summed over all processes (tensor itself with a single process) """
+    if not is_distributed():
+        return tensor
+    # nccl only reduces GPU tensors
+    device = torch.device('cuda', torch.cuda.current_device()) if dist.get_backend() == 'nccl' else torch.device('cpu')
+    reduced = tensor.to(device)
+    dist.all_reduce(reduced, op=dist.ReduceOp.SUM)
+    return reduced.to(tensor.device)
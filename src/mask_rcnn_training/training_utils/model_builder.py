@@ -1,3 +1,4 @@
+import inspect
 import torch
 from torchvision.models.detection import maskrcnn_resnet50_fpn_v2
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
@@ -28,4 +29,52 @@ def get_model(num_classes, max_detections=200, model_path=None):
                 map_location=torch.device('cpu'),
             )
         )
-    return model
\ No newline at end of file
+    return model
+
+ONNX_OUTPUTS = ["boxes", "labels", "scores", "masks"]
+
+def export_onnx(model, output_path, sample_shape=(1, 512, 512), opset_version=17):
+    """ Trace a Mask R-CNN on one sample image and save it as an ONNX graph taking a single (C, H, W) image of any size """
+    model = model.cpu().eval()
+    sample = torch.rand(sample_shape)
+    # newer torch defaults to the dynamo exporter, which cannot export torchvision's detection models
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        model,
+        ([sample],),
+        output_path,
+        opset_version=opset_version,
+        input_names=["image"],
+        output_names=ONNX_OUTPUTS,
+        dynamic_axes={"image": [1, 2], "boxes": [0], "labels": [0], "scores": [0], "masks": [0, 2, 3]},
+        **legacy,
+    )
+    return output_path
+
+class OnnxMaskRCNN:
+    """
+    Runs an exported Mask R-CNN with ONNX Runtime on the CPU, called like the eager model: a list of (C, H, W)
+    image tensors in, a list of prediction dicts of tensors out.
+    """
+    def __init__(self, onnx_path, intra_op_threads=0, inter_op_threads=0):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime") from e
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime pick the number of threads
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images):
+        # the graph was traced on a single image, so a batch is run one image at a time
+        preds = []
+        for image in images:
+            outputs = self.session.run(ONNX_OUTPUTS, {self.input_name: image.detach().cpu().numpy()})
+            preds.append({name: torch.from_numpy(output) for name, output in zip(ONNX_OUTPUTS, outputs)})
+        return preds
+
+    def eval(self):
+        return self
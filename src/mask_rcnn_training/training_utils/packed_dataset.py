@@ -0,0 +1,135 @@
+import json
+import os
+import numpy as np
+import torch
+import torch.utils.data
+from torchvision import datasets, tv_tensors
+from torchvision.transforms import v2
+from src.mask_rcnn_training.training_utils.ring_mask_converter import remove_overlap
+
+PACKED_FORMAT_VERSION = 1
+# one int64 row per image in index.bin
+INDEX_FIELDS = ("image_offset", "height", "width", "instance_start", "num_instances", "mask_offset")
+ARRAYS = (("images", np.uint8), ("masks", np.uint8), ("boxes", np.float32), ("labels", np.int64))
+
+def pack_coco_dataset(folder_path: str, annotations_path: str, output_dir: str, overlap_order: list[int] = None) -> int:
+    """
+    Convert a COCO instance segmentation dataset into the packed format read by PackedMaskDataset, so each JPEG is
+    decoded and each polygon rasterised once rather than every epoch. Written to output_dir:
+        images.bin  uint8 grayscale pixels of every image, back to back
+        masks.bin   each image's (num_instances, height, width) masks, bit-packed, back to back
+        boxes.bin   float32 xyxy boxes of every instance
+        labels.bin  int64 COCO category ids of every instance
+        index.bin   int64 rows of INDEX_FIELDS, one per image
+        meta.json   written last, so an interrupted conversion is never mistaken for a complete one
+
+    overlap_order: COCO category ids from lowest to highest precedence (outside to inside). If given, the masks are
+    stored with their overlap already removed, as ring_mask_converter.process would do in training.
+    Returns the number of images packed.
+    """
+    dataset = datasets.wrap_dataset_for_transforms_v2(
+        datasets.CocoDetection(folder_path, annotations_path, transforms=v2.Compose([v2.ToImage(), v2.Grayscale()])),
+        target_keys=["boxes", "labels", "masks"],
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    meta_path = os.path.join(output_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    index = []
+    image_offset = mask_offset = instance_start = 0
+    files = {name: open(os.path.join(output_dir, f"{name}.bin"), 'wb') for name, _ in ARRAYS}
+    try:
+        for image, target in dataset:
+            height, width = image.shape[-2:]
+            # images without annotations come back without these keys
+            masks = target.get('masks', torch.zeros((0, height, width), dtype=torch.uint8))
+            labels = target.get('labels', torch.zeros(0, dtype=torch.int64))
+            boxes = target.get('boxes', torch.zeros((0, 4)))
+            if overlap_order is not None and len(masks) > 0:
+                masks = remove_overlap(image, masks, labels, torch.as_tensor(overlap_order))
+            packed_masks = np.packbits(masks.numpy().astype(bool))
+
+            files["images"].write(image.numpy().astype(np.uint8).tobytes())
+            files["masks"].write(packed_masks.tobytes())
+            files["boxes"].write(boxes.numpy().astype(np.float32).tobytes())
+            files["labels"].write(labels.numpy().astype(np.int64).tobytes())
+            index.append((image_offset, height, width, instance_start, len(labels), mask_offset))
+            image_offset += height * width
+            mask_offset += len(packed_masks)
+            instance_start += len(labels)
+    finally:
+        for file in files.values():
+            file.close()
+
+    np.asarray(index, dtype=np.int64).reshape(-1, len(INDEX_FIELDS)).tofile(os.path.join(output_dir, "index.bin"))
+    meta = {
+        "version": PACKED_FORMAT_VERSION,
+        "num_images": len(index),
+        "num_instances": instance_start,
+        "overlap_order": None if overlap_order is None else [int(i) for i in overlap_order],
+        "folder_path": folder_path,
+        "annotations_path": annotations_path,
+    }
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+    return len(index)
+
+
+class PackedMaskDataset(torch.utils.data.Dataset):
+    """
+    A dataset written by pack_coco_dataset. Items are the same (image, target) pairs as the Trainer's COCO loader
+    gives (a float32 grayscale image in [0, 1] and a target with 'boxes', 'labels' and 'masks'), sliced out of
+    memory-mapped files, with only the item's own masks unpacked.
+
+    The files are mapped on first access, so each DataLoader worker maps them itself rather than being sent a copy.
+    overlap_order is the precedence the masks had their overlap removed with when packed, or None.
+    """
+
+    def __init__(self, packed_dir: str) -> None:
+        self.packed_dir = packed_dir
+        meta_path = os.path.join(packed_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No packed dataset at {packed_dir}. Create one with `python -m src.mask_rcnn_training.pack_dataset`")
+        with open(meta_path, 'r') as file:
+            self.meta = json.load(file)
+        if self.meta['version'] != PACKED_FORMAT_VERSION:
+            raise ValueError(f"Packed dataset {packed_dir} has version {self.meta['version']}, expected {PACKED_FORMAT_VERSION}. Pack it again")
+        self.index = np.fromfile(os.path.join(packed_dir, "index.bin"), dtype=np.int64).reshape(-1, len(INDEX_FIELDS))
+        self.overlap_order = self.meta['overlap_order']
+        self.to_float = v2.ToDtype(torch.float32, scale=True)
+        self.arrays = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getstate__(self) -> dict:
+        # workers map the files again rather than pickling the mapped data
+        state = self.__dict__.copy()
+        state['arrays'] = None
+        return state
+
+    def open(self) -> None:
+        self.arrays = {}
+        for name, dtype in ARRAYS:
+            path = os.path.join(self.packed_dir, f"{name}.bin")
+            # an empty file cannot be mapped
+            self.arrays[name] = np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) > 0 else np.zeros(0, dtype=dtype)
+
+    def __getitem__(self, i: int):
+        if self.arrays is None:
+            self.open()
+        image_offset, height, width, start, count, mask_offset = (int(value) for value in self.index[i])
+        pixels = np.array(self.arrays['images'][image_offset:image_offset + height * width]).reshape(1, height, width)
+        num_bits = count * height * width
+        masks = np.unpackbits(self.arrays['masks'][mask_offset:mask_offset + (num_bits + 7) // 8], count=num_bits)
+        boxes = np.array(self.arrays['boxes'][4 * start:4 * (start + count)]).reshape(count, 4)
+        labels = np.array(self.arrays['labels'][start:start + count])
+
+        image = self.to_float(tv_tensors.Image(torch.from_numpy(pixels)))
+        target = {
+            'boxes': tv_tensors.BoundingBoxes(torch.from_numpy(boxes), format='XYXY', canvas_size=(height, width)),
+            'labels': torch.from_numpy(labels),
+            'masks': tv_tensors.Mask(torch.from_numpy(masks.reshape(count, height, width))),
+        }
+        return image, target
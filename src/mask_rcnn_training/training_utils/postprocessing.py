@@ -0,0 +1,172 @@
+import torch
+from src.mask_rcnn_training.training_utils.ring_mask_converter import remove_overlap_batch
+
+BOX_FORMATS = ("xyxy", "xywh")
+PERCENTILES = (10, 25, 50, 75, 90)
+
+def map_labels(labels: torch.tensor, label_map: dict[int, int]) -> torch.tensor:
+    """ label_map[label] for every label, as one lookup on the labels' device """
+    if len(labels) == 0:
+        return labels.long()
+    keys = torch.tensor(list(label_map.keys()), dtype=torch.long, device=labels.device)
+    values = torch.tensor(list(label_map.values()), dtype=torch.long, device=labels.device)
+    size = int(max(keys.max(), labels.max())) + 1
+    lookup = torch.full((size,), -1, dtype=torch.long, device=labels.device)
+    known = torch.zeros(size, dtype=torch.bool, device=labels.device)
+    lookup[keys] = values
+    known[keys] = True
+    if not bool(known[labels.long()].all()):
+        raise KeyError(f"Labels {labels[~known[labels.long()]].unique().tolist()} are not in {sorted(label_map)}")
+    return lookup[labels.long()]
+
+def order_statistics(cumulative: torch.tensor, ranks: torch.tensor) -> torch.tensor:
+    """ The ranks[i, j]-th smallest (from 0) value of each histogram, given the (num_masks, levels) cumulative counts """
+    return torch.searchsorted(cumulative, ranks.contiguous(), right=True).to(torch.float64)
+
+def grey_levels(image: torch.tensor, levels: int = 256) -> torch.tensor:
+    """ image as long histogram bin indices in [0, levels) """
+    return image.round().clamp(0, levels - 1).long()
+
+def mask_histograms(masks: torch.tensor, image: torch.tensor, levels: int = 256, chunk_size: int = 32) -> torch.tensor:
+    """
+    (num_masks, levels) counts of the grey levels of image under each of a (num_masks, ..., height, width) bool stack.
+    The histograms of chunk_size masks at a time are counted with a single bincount over the chunk's pixels.
+    """
+    masks = masks.flatten(1)
+    image_levels = grey_levels(image.to(masks.device).reshape(-1), levels)
+    histograms = torch.zeros(len(masks), levels, dtype=torch.long, device=masks.device)
+    for start in range(0, len(masks), chunk_size):
+        chunk = masks[start:start + chunk_size]
+        rows, columns = chunk.nonzero(as_tuple=True)
+        counts = torch.bincount(rows * levels + image_levels[columns], minlength=len(chunk) * levels)
+        histograms[start:start + len(chunk)] = counts.view(len(chunk), levels)
+    return histograms
+
+def crop_histograms(crops: list[torch.tensor], windows: list[torch.tensor], levels: int = 256) -> torch.tensor:
+    """ (num_masks, levels) grey level counts under masks cropped to their extent, each given with its image window """
+    histograms = torch.zeros(len(crops), levels, dtype=torch.long)
+    for i, (crop, window) in enumerate(zip(crops, windows)):
+        histograms[i] = torch.bincount(grey_levels(window[crop], levels), minlength=levels)
+    return histograms
+
+def histogram_statistics(histograms: torch.tensor, percentiles: tuple = PERCENTILES) -> dict[str, torch.tensor]:
+    """
+    Statistics of the pixels counted in each row of (num_masks, levels) grey level histograms, all reduced at once:
+    'area', 'mean', 'std' (population), 'min', 'max' and f'p{q}' for each of percentiles (linearly interpolated, as
+    np.percentile). Each is a float64 (num_masks,) tensor, zero for empty masks.
+    """
+    values = torch.arange(histograms.shape[1], dtype=torch.float64, device=histograms.device)
+    counts = histograms.to(torch.float64)
+    areas = counts.sum(dim=1)
+    safe_areas = areas.clamp(min=1)
+    means = counts @ values / safe_areas
+    variances = (counts @ values.square() / safe_areas - means.square()).clamp(min=0)
+    statistics = {'area': areas, 'mean': means, 'std': variances.sqrt()}
+
+    cumulative = histograms.cumsum(dim=1)
+    last = (areas - 1).clamp(min=0)
+    quantiles = torch.tensor(percentiles, dtype=torch.float64, device=histograms.device) / 100
+    positions = last[:, None] * quantiles[None, :]
+    lower = positions.floor()
+    ranks = torch.cat((torch.zeros_like(last)[:, None], last[:, None], lower, torch.minimum(lower + 1, last[:, None])), dim=1)
+    ordered = order_statistics(cumulative, ranks.long())
+    lower_values, upper_values = ordered[:, 2:2 + len(percentiles)], ordered[:, 2 + len(percentiles):]
+    interpolated = lower_values + (positions - lower) * (upper_values - lower_values)
+    empty = areas == 0
+    statistics['min'] = ordered[:, 0].masked_fill(empty, 0)
+    statistics['max'] = ordered[:, 1].masked_fill(empty, 0)
+    for i, q in enumerate(percentiles):
+        statistics[f'p{q}'] = interpolated[:, i].masked_fill(empty, 0)
+    return statistics
+
+def mask_statistics(masks: torch.tensor, image: torch.tensor, percentiles: tuple = PERCENTILES, levels: int = 256,
+                    chunk_size: int = 32) -> dict[str, torch.tensor]:
+    """
+    histogram_statistics of the image pixels under each of a (num_masks, ..., height, width) bool stack. image holds
+    integer grey levels in [0, levels), as 8-bit images do, in any dtype.
+    """
+    return histogram_statistics(mask_histograms(masks, image, levels, chunk_size), percentiles)
+
+def statistics_per_mask(statistics: dict[str, torch.tensor], exclude: tuple = ('area', 'mean')) -> list[dict[str, float]]:
+    """ Batched statistics as one {name: float} dict per mask, read back in a single transfer """
+    names = [name for name in statistics if name not in exclude]
+    if not names:
+        return [{} for _ in range(len(next(iter(statistics.values()), ())))]
+    rows = torch.stack([statistics[name] for name in names], dim=1).tolist()
+    return [dict(zip(names, row)) for row in rows]
+
+def postprocess_predictions(
+    preds: list[dict[str, torch.tensor]],
+    label_order: torch.tensor,
+    binary_threshold: float = 0.5,
+    remove_overlap: bool = True,
+    label_map: dict[int, int] = None,
+    box_format: str = "xyxy",
+    intensity_images: list[torch.tensor] = None,
+    device: torch.device = 'cpu',
+) -> list[dict[str, torch.tensor]]:
+    """
+    Post-process a batch of raw Mask R-CNN predictions with batched tensor operations on the device they were made on.
+
+    Masks are thresholded at binary_threshold and, if remove_overlap, cut by the masks of higher precedence labels
+    (see ring_mask_converter). Labels are mapped through label_map if given, boxes converted to box_format, and the
+    area of each mask is counted. If intensity_images are given (one grey level image shaped like each image), the
+    mask_statistics of each mask over its image are computed as well.
+
+    The results are then moved to device together: the per-instance values of the whole batch are packed into one
+    tensor and the masks of each image size into another, so there is one transfer rather than one per tensor.
+
+    Returns:
+        one dict per image with 'boxes' (float64, in box_format), 'labels', 'scores', 'masks' (bool, shaped like the
+        raw masks), 'areas' (float64) and, if intensity_images is given, 'mean_intensities' (float64) and 'statistics'
+        (the other mask_statistics, as a dict of float64 tensors)
+    """
+    if box_format not in BOX_FORMATS:
+        raise ValueError(f"Unknown box format {box_format}. Expected one of {BOX_FORMATS}")
+    if len(preds) == 0:
+        return []
+    masks = [pred['masks'] > binary_threshold for pred in preds]
+    if remove_overlap:
+        # the masks stand in for the images: only their trailing (height, width) is used
+        masks = remove_overlap_batch(masks, masks, [pred['labels'] for pred in preds], label_order)
+    counts = [len(image_masks) for image_masks in masks]
+
+    boxes = torch.cat([pred['boxes'].reshape(-1, 4) for pred in preds]).to(torch.float64)
+    if box_format == "xywh":
+        boxes = torch.cat((boxes[:, :2], boxes[:, 2:] - boxes[:, :2]), dim=1)
+    labels = torch.cat([pred['labels'] for pred in preds])
+    if label_map is not None:
+        labels = map_labels(labels, label_map)
+    areas = torch.cat([image_masks.flatten(1).sum(dim=1) for image_masks in masks]).to(torch.float64)
+    columns = [boxes, labels[:, None], torch.cat([pred['scores'] for pred in preds])[:, None], areas[:, None]]
+    names = []
+    if intensity_images is not None:
+        per_image = [mask_statistics(image_masks, image) for image_masks, image in zip(masks, intensity_images)]
+        names = [name for name in per_image[0] if name != 'area']
+        columns.extend(torch.cat([statistics[name] for statistics in per_image])[:, None] for name in names)
+    packed = torch.cat([column.to(torch.float64) for column in columns], dim=1).to(device)
+
+    # one transfer per image size, split back into images on the other side
+    moved = [None] * len(preds)
+    groups = {}
+    for i, image_masks in enumerate(masks):
+        groups.setdefault(tuple(image_masks.shape[1:]), []).append(i)
+    for indices in groups.values():
+        group = torch.cat([masks[i] for i in indices]).to(device)
+        for i, image_masks in zip(indices, group.split([counts[i] for i in indices])):
+            moved[i] = image_masks
+
+    out = []
+    for i, rows in enumerate(packed.split(counts)):
+        out.append({
+            'boxes': rows[:, :4],
+            'labels': rows[:, 4].to(preds[i]['labels'].dtype),
+            'scores': rows[:, 5].to(preds[i]['scores'].dtype),
+            'masks': moved[i],
+            'areas': rows[:, 6],
+        })
+        if names:
+            statistics = dict(zip(names, rows[:, 7:].unbind(dim=1)))
+            out[-1]['mean_intensities'] = statistics.pop('mean')
+            out[-1]['statistics'] = statistics
+    return out
@@ -0,0 +1,55 @@
+import copy
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from src.mask_rcnn_training.training_utils.data_loading import load_coco_dataset
+
+QUANTIZATION_MODES = (None, "dynamic", "static")
+
+def quantize_heads_dynamic(model):
+    """ int8 weights for the Linear layers of the box head and predictor, activations quantised on the fly """
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def quantize_backbone_static(model, calibration_images):
+    """
+    int8 weights and activations for the ResNet body of the backbone. Observers are calibrated by running the
+    whole model on calibration_images (as they would be passed to the model), so they see the activations
+    produced by the model's own resizing and normalisation. The FPN and heads stay in floating point.
+    """
+    body = model.backbone.body
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    example_inputs = (torch.rand(1, 3, 224, 224),)
+    model.backbone.body = prepare_fx(body, qconfig_mapping, example_inputs)
+    with torch.no_grad():
+        for image in calibration_images:
+            model([image])
+    model.backbone.body = convert_fx(model.backbone.body)
+    return model
+
+def optimise_for_cpu(model, quantization=None, channels_last=False, calibration_images=None):
+    """
+    A copy of an eval-mode Mask R-CNN prepared for CPU inference.
+    quantization: None, "dynamic" (int8 heads) or "static" (int8 backbone calibrated on calibration_images, and int8 heads)
+    channels_last: store conv weights and activations as NHWC, which the CPU conv and quantised kernels prefer
+    Quantised models are moved to the CPU, as their kernels only run there.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {quantization}. Expected one of {QUANTIZATION_MODES}")
+    model = copy.deepcopy(model).eval()
+    if quantization is not None:
+        model = model.cpu()
+    if quantization == "static":
+        if not calibration_images:
+            raise ValueError("Static quantization needs calibration images")
+        model = quantize_backbone_static(model, calibration_images)
+    if quantization is not None:
+        model = quantize_heads_dynamic(model)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model
+
+def load_calibration_images(images_path, annotations_name, num_images=8):
+    """ The first num_images images of a COCO dataset, in dataset order, loaded as the Trainer loads its validation set """
+    dataset = load_coco_dataset(images_path, annotations_name)
+    return [dataset[i][0] for i in range(min(num_images, len(dataset)))]
@@ -0,0 +1,94 @@
+import os
+import resource
+import sys
+import threading
+import time
+import torch
+
+def process_rss_mib():
+    """ Resident memory of this process in MiB, read from /proc where available, else its peak from getrusage """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KiB elsewhere
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class ResourceSampler:
+    """
+    Samples this process's resource use on a background thread every interval seconds, so the training loop never
+    waits on it. Each sample is a dict appended to log (e.g. the Trainer's training_log['resources']):
+        time: seconds since the sampler started
+        rss_mib: resident memory of this process
+        cpu_percent: CPU time this process used since the previous sample, as a percentage of one core
+        gpu_max_allocated_mib: peak memory allocated by torch on device, or None on CPU
+    DataLoader workers are separate processes and are not included.
+    """
+
+    def __init__(self, interval, device, log=None):
+        self.interval = interval
+        self.device = torch.device(device)
+        self.log = [] if log is None else log
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.start_time = time.perf_counter()
+        self.last_wall = self.start_time
+        self.last_cpu = time.process_time()
+
+    def sample(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        elapsed = wall - self.last_wall
+        sample = {
+            "time": wall - self.start_time,
+            "rss_mib": process_rss_mib(),
+            "cpu_percent": 100 * (cpu - self.last_cpu) / elapsed if elapsed > 0 else 0.0,
+            "gpu_max_allocated_mib": None,
+        }
+        if self.device.type == 'cuda':
+            sample["gpu_max_allocated_mib"] = torch.cuda.max_memory_allocated(self.device) / 2**20
+        self.last_wall, self.last_cpu = wall, cpu
+        self.log.append(sample)
+        return sample
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """ Take a first sample, then keep sampling in the background until stop """
+        if self.thread is not None:
+            return self
+        self.sample()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="ResourceSampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop sampling, taking a last sample so the log covers the whole run """
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.sample()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def latest(self):
+        return self.log[-1] if self.log else None
+
+    def summary(self):
+        sample = self.latest()
+        if sample is None:
+            return "No resource samples"
+        text = f"RSS: {sample['rss_mib']:.0f}MiB | CPU: {sample['cpu_percent']:.0f}%"
+        if sample['gpu_max_allocated_mib'] is not None:
+            text += f" | Peak GPU: {sample['gpu_max_allocated_mib']:.0f}MiB"
+        return text
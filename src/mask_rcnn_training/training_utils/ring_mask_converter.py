@@ -2,12 +2,31 @@ import torch
 from torchvision.tv_tensors._image import Image
 #from matplotlib import pyplot as plt
 
+def label_indices(labels: torch.tensor, label_order: torch.tensor) -> torch.tensor:
+    """ Position of each label in label_order, as a long tensor on the labels' device """
+    label_order = label_order.to(labels.device).long()
+    if len(labels) == 0:
+        return torch.zeros(0, dtype=torch.long, device=labels.device)
+    lookup = torch.full((int(max(label_order.max(), labels.max())) + 1,), -1, dtype=torch.long, device=labels.device)
+    lookup[label_order] = torch.arange(len(label_order), device=labels.device)
+    ids = lookup[labels.long()]
+    if bool((ids < 0).any()):
+        raise KeyError(f"Labels {labels[ids < 0].unique().tolist()} are not in label_order {label_order.tolist()}")
+    return ids
+
+def binarise_masks(masks: torch.tensor, height: int, width: int, binary_threshold: float) -> torch.tensor:
+    """ (num_masks, height, width) bool masks from masks of shape (num_masks, height, width) or (num_masks, 1, height, width) """
+    if masks.dtype == torch.bool and 0 <= binary_threshold < 1:
+        # already binary: comparing would only promote and copy every pixel
+        return masks.reshape(len(masks), height, width)
+    return (masks > binary_threshold).reshape(len(masks), height, width)
+
 def get_total_mask(image: torch.tensor, masks: torch.tensor, labels: torch.tensor, label_order: torch.tensor, binary_threshold: float=0.5) -> torch.tensor:
     """
     Combine all the masks of the same label into one aggregated mask, for each unique label.
     Args:
         image: image tensor of shape (3, height, width)
-        masks: a tensor of masks representing objects in the image of shape (num_masks, height, width)
+        masks: a tensor of masks representing objects in the image of shape (num_masks, height, width) or (num_masks, 1, height, width)
         labels: a tensor of integers each representing a mask label of shape (num_masks, )
         label_order: an ordering (does not work with partial ordering) of integer label precedence from lowest to highest (i.e. outside to inside)
         binary_threshold: the number above which the mask should be considered 1 when binarised to a bool (otherwise any region with value > 0 will become a 1)
@@ -15,14 +34,26 @@ def get_total_mask(image: torch.tensor, masks: torch.tensor, labels: torch.tenso
     Returns:
         total_masks: a tensor of shape (classes, height, width), where the [0,:,:] represents the lowest priority total mask
     """
-    device = masks.device
-    label2id = dict([(int(label), i) for i, label in enumerate(label_order)])
-    total_masks = torch.zeros(size=(len(label_order), image.shape[1], image.shape[2])).to(device)
-    for i in range(len(masks)):
-        j = label2id[int(labels[i])]
-        total_masks[j,:,:] = total_masks[j,:,:].bool() | (masks[i,:,:] > binary_threshold)
+    return get_total_bool_mask(image, masks, labels, label_order, binary_threshold).float()
+
+def get_total_bool_mask(image, masks, labels, label_order, binary_threshold=0.5) -> torch.tensor:
+    """ get_total_mask as bool planes: every mask is OR-ed into its label's plane in one scatter """
+    height, width = image.shape[-2], image.shape[-1]
+    total_masks = torch.zeros(size=(len(label_order), height, width), dtype=torch.bool, device=masks.device)
+    if len(masks) > 0:
+        ids = label_indices(labels.to(masks.device), label_order)
+        # accumulating bools is a logical or
+        total_masks.index_put_((ids,), binarise_masks(masks, height, width, binary_threshold), accumulate=True)
     return total_masks
-    
+
+def get_anti_bool_mask(total_masks: torch.tensor) -> torch.tensor:
+    """ For (..., classes, height, width) bool total masks, the OR of every higher precedence plane for each class """
+    # reverse cumulative OR over the (few) classes, each step covering every image and pixel at once
+    anti_masks = torch.zeros_like(total_masks)
+    for i in range(total_masks.shape[-3] - 2, -1, -1):
+        torch.logical_or(anti_masks[..., i + 1, :, :], total_masks[..., i + 1, :, :], out=anti_masks[..., i, :, :])
+    return anti_masks
+
 def get_anti_mask(image: torch.tensor, masks: torch.tensor, labels: torch.tensor, label_order: torch.tensor, binary_threshold: float=0.5) -> torch.tensor:
     """
     Create an anti-mask for each label which determines where an object is NOT 
@@ -30,7 +61,7 @@ def get_anti_mask(image: torch.tensor, masks: torch.tensor, labels: torch.tensor
 
     Args:
         image: image tensor of shape (3, height, width)
-        masks: a tensor of masks representing objects in the image of shape (num_masks, height, width)
+        masks: a tensor of masks representing objects in the image of shape (num_masks, height, width) or (num_masks, 1, height, width)
         labels: a tensor of integers each representing a mask label of shape (num_masks, )
         label_order: an ordering (does not work with partial ordering) of integer label precedence from lowest to highest (i.e. outside to inside)
         binary_threshold: a float. when a mask pixel is above this value, the pixel is classified as a positive example, else the pixel is assumed to be of a different or background class
@@ -38,48 +69,51 @@ def get_anti_mask(image: torch.tensor, masks: torch.tensor, labels: torch.tensor
     Returns:
         out_masks: a tensor of shape (classes, height, width) where classes is the number of unique labels, and the [0,:,:] mask corresponds to the [0] element of label_order
     """
-    total_masks = get_total_mask(image, masks, labels, label_order) # sorted in first dimension from lest precedence to most precedence
-        
-    out_masks = torch.zeros_like(total_masks)
-    for i in range(len(label_order)):
-        out_masks[i,:,:] = torch.any(total_masks[i+1:,:,:].view(-1, image.shape[1], image.shape[2]).bool(),dim=0)
-    return out_masks
+    # the total masks have always been built with the default threshold
+    total_masks = get_total_bool_mask(image, masks, labels, label_order) # sorted in first dimension from lest precedence to most precedence
+    return get_anti_bool_mask(total_masks).float()
 
 def remove_overlap(image: torch.tensor, masks: torch.tensor, labels: torch.tensor, label_order: torch.tensor, binary_threshold: float=0.5) -> torch.tensor:
     """ Remove the relevant anti-mask pixels from each mask in an image """
-    anti_masks = get_anti_mask(image, masks, labels, label_order, binary_threshold)
-    masks_out = torch.zeros_like(masks)
-    label2id = dict([(int(key), i) for i, key in enumerate(label_order)])
-    
-    for i in range(len(masks)):
+    return remove_overlap_batch([image], [masks], [labels], label_order, binary_threshold)[0]
+
+def remove_overlap_batch(images, masks, labels, label_order: torch.tensor, binary_threshold: float=0.5) -> list[torch.tensor]:
+    """
+    remove_overlap for many images at once. Images of the same size are processed together: all of their masks are
+    scattered into per-image, per-class planes in one go, the anti-masks come from one reverse cumulative OR over
+    the classes, and each mask is cut by its anti-mask in a single gather. Each output has the shape and dtype of
+    the corresponding input masks.
+    """
+    out_masks = [None] * len(images)
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault((image.shape[-2], image.shape[-1], masks[i].device), []).append(i)
+    num_classes = len(label_order)
+    for (height, width, device), indices in groups.items():
+        counts = [len(masks[i]) for i in indices]
+        if sum(counts) == 0:
+            for i in indices:
+                out_masks[i] = torch.zeros_like(masks[i])
+            continue
+        binary = torch.cat([binarise_masks(masks[i], height, width, binary_threshold) for i in indices])
+        image_ids = torch.repeat_interleave(torch.arange(len(indices), device=device), torch.tensor(counts, device=device))
+        class_ids = torch.cat([label_indices(labels[i].to(device), label_order) for i in indices])
+        plane_ids = image_ids * num_classes + class_ids
+
+        # the total masks have always been built with the default threshold
+        total_binary = binary
+        if binary_threshold != 0.5:
+            total_binary = torch.cat([binarise_masks(masks[i], height, width, 0.5) for i in indices])
+        total_masks = torch.zeros(size=(len(indices) * num_classes, height, width), dtype=torch.bool, device=device)
+        total_masks.index_put_((plane_ids,), total_binary, accumulate=True)
+        anti_masks = get_anti_bool_mask(total_masks.view(len(indices), num_classes, height, width)).view(-1, height, width)
+
         # logical operation: where output mask pixels are those that are in the original mask and not the corresponding anti-mask
-        j = label2id[int(labels[i])]
-        masks_out[i,:,:] = (masks[i,:,:]>binary_threshold).bool() & ~anti_masks[j,:,:].bool()
-        """
-        if True: # displaying outputs for debugging purposes
-            print(["Seed Coat", "Interior", "Endosperm", "Void"][labels[i]])
-            fig, ax = plt.subplots(1, 4, sharex=True, sharey=True, dpi=200)
-            
-            ax[0].imshow(masks[i,:,:])
-            ax[0].set_title("Mask")
-            ax[0].axis('off')
-            
-            ax[1].imshow(anti_masks[j,:,:])
-            ax[1].set_title("Anti-Mask")
-            ax[1].axis('off')
-            
-            ax[2].imshow(masks_out[i,:,:])
-            ax[2].set_title("Output")
-            ax[2].axis('off')
-
-            ax[3].imshow(image[2,:,:])
-            ax[3].set_title("Image")
-            ax[3].axis('off')
-            
-            plt.show()
-        """
-    return masks_out
-    
+        kept = binary & ~anti_masks[plane_ids]
+        for i, kept_masks in zip(indices, kept.split(counts)):
+            out_masks[i] = kept_masks.reshape(masks[i].shape).to(masks[i].dtype)
+    return out_masks
+
 def process(images: tuple[Image], targets: tuple[dict[str, torch.tensor]], label_order: torch.tensor):
     """ 
     Convert nested array of images and targets to correct format. Process targets to remove overlap.
@@ -92,20 +126,26 @@ def process(images: tuple[Image], targets: tuple[dict[str, torch.tensor]], label
         images (tuple[torchvision.tv_tensors._image.Image]): a tuple containing many images
         targets (tuple[dict['boxes', 'masks', 'labels']]): all masks have overlap removed
     """
+    out_masks = remove_overlap_batch(
+        images,
+        [target['masks'] for target in targets],
+        [target['labels'] for target in targets],
+        label_order,
+    )
     out_images, out_targets = [], []
     for i in range(len(images)):
         out_images.append(images[i])
         if "scores" in targets[0].keys():
             out_targets.append({
                 'boxes':targets[i]['boxes'],
-                'masks':remove_overlap(images[i], targets[i]['masks'], targets[i]['labels'], label_order),
+                'masks':out_masks[i],
                 'labels':targets[i]['labels'],
                 'scores':targets[i]['scores']
                 })
         else:
             out_targets.append({
                 'boxes':targets[i]['boxes'],
-                'masks':remove_overlap(images[i], targets[i]['masks'], targets[i]['labels'], label_order),
+                'masks':out_masks[i],
                 'labels':targets[i]['labels']
                 })
     return tuple(out_images), tuple(out_targets)
\ No newline at end of file
@@ -1,18 +1,25 @@
 import torch
 import torch.utils.data
-from torchvision import datasets
-from torchvision.transforms import v2
+from torch.nn.parallel import DistributedDataParallel
 from src.mask_rcnn_training.training_utils.ring_mask_converter import process
-from src.mask_rcnn_training.training_utils.utils import get_nvidia_gpu_memory, NestedTensorHandler, convert_labels#, print_structure
+from src.mask_rcnn_training.training_utils.postprocessing import postprocess_predictions
+from src.mask_rcnn_training.training_utils.packed_dataset import PackedMaskDataset
+from src.mask_rcnn_training.training_utils.data_loading import collate, load_coco_dataset, make_loader, ThroughputMonitor
+from src.mask_rcnn_training.training_utils.resource_sampler import ResourceSampler
+from src.mask_rcnn_training.training_utils.distributed import all_reduce_sum, init_distributed, is_distributed, is_main_process
+from src.mask_rcnn_training.training_utils.utils import NestedTensorHandler, convert_labels#, print_structure
 from src.mask_rcnn_training.training_utils.model_builder import get_model
 from src.mask_rcnn_training.training_utils.plotting import compare_maps#, show_progress
 import json
 import gc
+import contextlib
 import time
 import numpy as np
 from torchmetrics.detection.mean_ap import MeanAveragePrecision as mAP
 from matplotlib import pyplot as plt
 
+# the "autocast_dtype" training configs other than "float32", which trains without autocast
+AUTOCAST_DTYPES = {"bfloat16": torch.bfloat16, "float16": torch.float16}
 
 class Trainer:
     def __init__(self, configs_path, full_init=True):
@@ -21,20 +28,41 @@ class Trainer:
             self.configs = self.load_configs()
             self.hyper_params = self.load_hyper_params()
             self.check_configs()
-            self.device = torch.device('cuda:0' if self.configs['use_gpu'] and torch.cuda.is_available() else 'cpu')
+            # one process per device when launched with torchrun, otherwise cuda:0 or the CPU
+            self.device = init_distributed(self.configs['use_gpu'], backend=self.configs.get('distributed_backend'))
             self.train_loader = self.load_data(
                 self.configs['train_images_path'],
                 self.configs['train_annotations_name'],
                 self.hyper_params['train_batch_size'],
+                packed_path=self.configs.get('train_packed_path'),
+                loader_configs=self.configs.get('data_loader'),
             )
             self.val_loader = self.load_data(
                 self.configs['val_images_path'],
                 self.configs['val_annotations_name'],
                 self.hyper_params['val_batch_size'],
+                packed_path=self.configs.get('val_packed_path'),
+                loader_configs=self.configs.get('data_loader'),
             )
+            self.autocast_dtype = self.get_autocast_dtype(self.configs.get('autocast_dtype'))
+            self.scaler = self.get_grad_scaler()
             self.model = self.load_model()
-            self.training_log = dict([(key, []) for key in ['losses', 'train_maps', 'val_maps']])
+            self.training_log = dict([(key, []) for key in ['losses', 'train_maps', 'val_maps', 'resources']])
+            self.throughput = ThroughputMonitor()
+            self.resources = ResourceSampler(
+                self.configs.get('resource_sample_seconds', 30),
+                self.device,
+                log=self.training_log['resources'],
+            )
+            # iterations between releasing memory with offload_memory (0 only releases it before end of epoch evaluation)
+            self.offload_every = self.configs.get('offload_every', 0)
+            self.throughput_log = []
             self.label_order, self.id2label, self.label2id, self.id2name, self.name2id, self.label2name, self.name2label = self.get_conversions()
+            self.overlap_removed_offline = self.is_overlap_removed_offline()
+            # only the main process logs, so only it needs the probe set
+            self.probe_images, self.probe_targets = self.load_probe_set(
+                self.configs.get('val_probe_size', self.hyper_params['val_batch_size'])
+            ) if is_main_process() else (None, None)
             self.metric = mAP(
                 class_metrics=True, 
                 iou_type='segm', 
@@ -45,6 +73,8 @@ class Trainer:
 
     def write_configs_for_inference(self):
         """ This function should write the minimal info that must be the same for inference and training into a single location."""
+        if not is_main_process():
+            return
         inference_configs = dict()
         inference_configs['id2label'] = self.id2label
         inference_configs['label2id'] = self.label2id
@@ -84,30 +114,34 @@ class Trainer:
     def check_configs(self):
         assert self.configs['train_print_every'] % self.configs['log_every'] == 0, f"Check configs file to make sure the printing frequency lines up with logging frequency. print_every: {self.configs['train_print_every']}. log_every: {self.configs['log_every']}"
         
-    def load_data(self, folder_path, file_path, batch_size, shuffle=True):
-        transforms = v2.Compose([
-            v2.ToImage(),
-            v2.Grayscale(),
-            v2.ToDtype(torch.float32, 
-            scale=True),
-        ])
-        dataset = datasets.CocoDetection(
-            folder_path, 
-            file_path, 
-            transforms=transforms
-        )
-        dataset = datasets.wrap_dataset_for_transforms_v2(
-            dataset, 
-            target_keys=["boxes", "labels", "masks"]
-        )
-        loader = torch.utils.data.DataLoader(
-            dataset, 
-            batch_size=batch_size, 
-            collate_fn=lambda batch: tuple(zip(*batch)), 
-            shuffle=shuffle,
-            num_workers=4,
-        )
-        return loader
+    def load_data(self, folder_path, file_path, batch_size, shuffle=True, packed_path=None, loader_configs=None):
+        """
+        A loader over a COCO dataset, or over its packed copy (see pack_dataset.py) if packed_path is given.
+        loader_configs are the "data_loader" training configs (see data_loading.LOADER_DEFAULTS).
+        """
+        if packed_path is not None:
+            dataset = PackedMaskDataset(packed_path)
+        else:
+            dataset = load_coco_dataset(folder_path, file_path)
+        return make_loader(dataset, batch_size, shuffle=shuffle, loader_configs=loader_configs, distributed=is_distributed())
+
+    def get_autocast_dtype(self, name):
+        """ The dtype the training forward pass is autocast to, or None (from None or "float32") to train in float32 """
+        if name is None or name == "float32":
+            return None
+        if name not in AUTOCAST_DTYPES:
+            raise ValueError(f"Unknown autocast_dtype {name}. Expected one of {['float32', *AUTOCAST_DTYPES]}")
+        if name == "float16" and self.device.type != 'cuda':
+            raise ValueError("float16 autocast needs a GPU. Use bfloat16 on CPU")
+        return AUTOCAST_DTYPES[name]
+
+    def get_grad_scaler(self):
+        # float16 gradients can underflow, so its loss is scaled up; bfloat16 has float32's range and needs no scaling.
+        # float16 is only allowed on a GPU, so the CUDA scaler covers every enabled case
+        return torch.amp.GradScaler("cuda", enabled=self.autocast_dtype == torch.float16)
+
+    def autocast(self):
+        return torch.autocast(self.device.type, dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None)
 
     def load_model(self):
         if self.configs['load_from_checkpoint']:
@@ -122,8 +156,19 @@ class Trainer:
                 max_detections=self.hyper_params['max_detections'],
                 model_path=None
             ).to(self.device)
+        if self.configs.get('compile_backbone', False):
+            # compiled in place, so the state dict keeps its keys and checkpoints still load for inference
+            model.backbone.compile()
+        if is_distributed():
+            # gradients are averaged across processes in backward; the weights start the same, broadcast from rank 0
+            model = DistributedDataParallel(model, device_ids=[self.device.index] if self.device.type == 'cuda' else None)
         return model
 
+    @property
+    def module(self):
+        """ The model without its DistributedDataParallel wrapper, for predicting and saving """
+        return self.model.module if isinstance(self.model, DistributedDataParallel) else self.model
+
     def get_conversions(self):
         with open(self.configs['train_annotations_name'],'r') as file:
             categories = json.load(file)['categories']
@@ -137,27 +182,63 @@ class Trainer:
         name2label = dict([(val,key) for key, val in label2name.items()])
         return label_order, id2label, label2id, id2name, name2id, label2name, name2label
 
+    def is_overlap_removed_offline(self):
+        """
+        Whether both datasets were packed with their overlap removed in this trainer's class precedence, so preprocess
+        need not remove it. Packed masks can not be restored, so raises ValueError if a dataset was packed with its
+        overlap removed when 'pre-process' is off, or removed in a different precedence than class_order's.
+        """
+        id_order = [self.label2id[int(label)] for label in self.label_order]
+        removed = []
+        for name, loader in (("train", self.train_loader), ("val", self.val_loader)):
+            overlap_order = loader.dataset.overlap_order if isinstance(loader.dataset, PackedMaskDataset) else None
+            if overlap_order is None:
+                removed.append(False)
+                continue
+            if not self.hyper_params['pre-process']:
+                raise ValueError(f"The packed {name} dataset has its overlap removed, but 'pre-process' is off. Pack it again without --class-order")
+            if overlap_order != id_order:
+                raise ValueError(
+                    f"The packed {name} dataset had its overlap removed in category order {overlap_order}, but class_order gives {id_order}. "
+                    f"Pack it again with --class-order {' '.join(self.configs['class_order'])}"
+                )
+            removed.append(True)
+        return all(removed)
+
+    def load_probe_set(self, size):
+        """
+        The first size validation images and targets, pre-processed and kept on the device, so periodic logging
+        evaluates the same batch every time without starting the validation loader's workers to fetch it.
+        """
+        dataset = self.val_loader.dataset
+        images, targets = collate([dataset[i] for i in range(min(size, len(dataset)))])
+        return self.preprocess(images, targets)
+
     def preprocess(self, images, targets):
         targets = convert_labels(targets, self.id2label)
-        if self.hyper_params['pre-process']:
+        if self.hyper_params['pre-process'] and not self.overlap_removed_offline:
             images, targets = process(images, targets, self.label_order)
-        images = NestedTensorHandler.get_structure_on_device(images, self.device)
-        targets = NestedTensorHandler.get_structure_on_device(targets, self.device)
+        # copies from pinned batches (the "pin_memory" data loader config) overlap with compute
+        images = NestedTensorHandler.get_structure_on_device(images, self.device, non_blocking=True)
+        targets = NestedTensorHandler.get_structure_on_device(targets, self.device, non_blocking=True)
         return images, targets
 
-    def postprocess(self, images, preds):
-        if self.hyper_params['post-process']:
-            images, preds = process(images, preds, self.label_order)
-            return list(images), list(preds)
-        else:
-            return images, preds
+    def postprocess(self, preds):
+        # kept on the training device, where the metric is computed
+        return postprocess_predictions(
+            preds,
+            self.label_order,
+            binary_threshold=self.hyper_params['binary_threshold'],
+            remove_overlap=self.hyper_params['post-process'],
+            device=self.device,
+        )
 
     def plot_outputs(self, epoch, image=None):
+        if not is_main_process():
+            return
         if image is None:
-            images, targets = next(iter(self.val_loader))
-            images, targets = self.preprocess(images, targets)
-            preds = self.predict_internal(images[0:1])
-            image = images[0]
+            preds = self.predict_internal(self.probe_images[0:1])
+            image = self.probe_images[0]
             if len(image.shape) == 3:
                 image = image.mean(dim=0)
             elif len(image.shape) == 4:
@@ -184,9 +265,8 @@ class Trainer:
         targets_train = logging_info['targets_train']
         loss  = logging_info['loss']
         
-        images_val, targets_val = next(iter(self.val_loader))
-        images_val, targets_val = self.preprocess(images_val, targets_val)
-        
+        images_val, targets_val = self.probe_images, self.probe_targets
+
         preds_val = self.predict_internal(images_val)
         preds_train = self.predict_internal(images_train)
 
@@ -203,7 +283,7 @@ class Trainer:
             self.training_log[key].append(value)
         
     def evaluate_map(self, preds, targets):
-        targets = self.format_for_metric(list(targets))
+        targets = self.format_for_metric(targets)
         preds = self.format_for_metric(preds)
         #print(f"Preds Shapes: {[preds[0][key].shape for key in preds[0].keys()]}")
         #print(f"Preds: {print_structure(preds)}")
@@ -211,12 +291,18 @@ class Trainer:
         return self.metric(preds, targets)
 
     def format_for_metric(self, preds: list[dict[str, torch.Tensor]]) -> list[dict[str, torch.Tensor]]:
-        for i in range(len(preds)):
-            preds[i]['masks'] = (preds[i]['masks'] > self.hyper_params['binary_threshold']).to(self.device).to(torch.uint8).view(-1, preds[i]['masks'].shape[-2], preds[i]['masks'].shape[-1])
-            preds[i]['boxes'] = preds[i]['boxes'].to(torch.int64)
-        return preds
+        """ Copies of preds (or targets) with binary uint8 masks and int64 boxes. preds are left untouched, so the cached probe targets stay the same """
+        formatted = []
+        for pred in preds:
+            pred = dict(pred)
+            pred['masks'] = (pred['masks'] > self.hyper_params['binary_threshold']).to(self.device).to(torch.uint8).view(-1, pred['masks'].shape[-2], pred['masks'].shape[-1])
+            pred['boxes'] = pred['boxes'].to(torch.int64)
+            formatted.append(pred)
+        return formatted
 
     def print_training_info(self):
+        if not is_main_process():
+            return
         train_map = self.training_log['train_maps'][-1]
         val_map = self.training_log['val_maps'][-1]
         print("Training Performance")
@@ -232,6 +318,8 @@ class Trainer:
         print("\n", flush=True)
         
     def plot_training_vs_validation(self):
+        if not is_main_process():
+            return
         compare_maps(
             [value['map'].item() for value in self.training_log['train_maps']], 
             [value['map'].item() for value in self.training_log['val_maps']], 
@@ -239,25 +327,28 @@ class Trainer:
         )
 
     def save_model(self, epoch=None):
-        if self.configs['save_progress']:
+        if self.configs['save_progress'] and is_main_process():
             if 'model_folder' not in self.configs.keys():
-                torch.save(self.model.state_dict(), self.configs['model_path'])
+                torch.save(self.module.state_dict(), self.configs['model_path'])
             else:
-                torch.save(self.model.state_dict(), self.configs['model_folder'] + f"epoch{epoch}.pt")
+                torch.save(self.module.state_dict(), self.configs['model_folder'] + f"epoch{epoch}.pt")
 
     def offload_memory(self):
         gc.collect()
-        torch.cuda.empty_cache()
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
 
     def predict_internal(self, images):
-        was_training = self.model.training
-        self.model.eval()
+        # the unwrapped model, so predicting in one process never waits on the others
+        model = self.module
+        was_training = model.training
+        model.eval()
         with torch.no_grad():
-            preds = self.model(images)
+            preds = model(images)
         if was_training:
-            self.model.train()
+            model.train()
         #print(print_structure(preds))
-        images, preds = self.postprocess(images, preds)
+        preds = self.postprocess(preds)
         #print(print_structure(preds))
         preds = self.format_for_metric(preds)
         return preds
@@ -266,7 +357,7 @@ class Trainer:
         stores = dict([(key, []) for key in self.configs['class_order']])
         stores['Average'] = []
         for i, (images, targets) in enumerate(self.val_loader):
-            if i % self.configs['val_print_every'] == 0:
+            if i % self.configs['val_print_every'] == 0 and is_main_process():
                 print(f"Val Iter: {i}/{len(self.val_loader)} ")
             images, targets = self.preprocess(images, targets)
             preds = self.predict_internal(images)
@@ -274,57 +365,123 @@ class Trainer:
             for key, map_ in zip(maps['classes'].tolist(), maps['map_per_class'].tolist()):
                 stores[self.label2name[int(key)]].append(map_)
             stores['Average'].append(maps['map'].item())
-        output = dict([(key, float(np.mean(value))) for key, value in stores.items()])
+        # mean over the batches of every process
+        totals = all_reduce_sum(torch.tensor([[sum(value), len(value)] for value in stores.values()], dtype=torch.float64))
+        output = dict([(key, total / count if count else float('nan')) for key, (total, count) in zip(stores.keys(), totals.tolist())])
         return output
 
     def print_end_of_epoch_info(self):
-        print("#####\tEND OF EPOCH\t#####")
         performance_dict = self.full_evaluation()
+        if not is_main_process():
+            return
+        print("#####\tEND OF EPOCH\t#####")
         for key, value in performance_dict.items():
             print(f"\t{key}:\t{value:1.4f}")
         print(" ", flush=True)
     
+    def training_step(self, images, targets, sync=True):
+        """
+        Forward (autocast if configured) and backward pass of one batch, accumulating gradients. Returns the loss.
+        Without sync, distributed processes skip averaging these gradients; they are averaged with the next synced step's.
+        """
+        self.model.train()
+        skip_sync = isinstance(self.model, DistributedDataParallel) and not sync
+        with self.model.no_sync() if skip_sync else contextlib.nullcontext():
+            with self.autocast():
+                loss_dict = self.model(images, targets)
+                loss = sum(tuple([loss for loss in loss_dict.values()]))
+            self.scaler.scale(loss).backward()
+        return loss
+
+    def optimizer_step(self, optimizer):
+        self.scaler.step(optimizer)
+        self.scaler.update()
+        optimizer.zero_grad()
+
+    def benchmark(self, num_iterations, warmup=2):
+        """
+        Train for warmup and then num_iterations batches with the current autocast_dtype and compile_backbone, without
+        logging or evaluation, and return the images per second and peak memory of the timed iterations. Peak memory
+        is what torch allocated on a GPU, or the highest resident memory of this process sampled on CPU.
+        Changes the model's weights, so is meant for choosing settings rather than during a real run.
+        The training loader is cycled if it has fewer than warmup + num_iterations batches.
+        """
+        if num_iterations < 1:
+            raise ValueError(f"num_iterations must be at least 1, got {num_iterations}")
+        if warmup < 0:
+            raise ValueError(f"warmup must not be negative, got {warmup}")
+        if len(self.train_loader) == 0:
+            raise ValueError("The training loader has no batches to benchmark with")
+        optimizer = torch.optim.Adamax(self.model.parameters(), lr=self.hyper_params['learning_rate'])
+        sampler = ResourceSampler(0.05, self.device)
+        batches = (batch for _ in range(num_iterations + warmup) for batch in self.train_loader)
+        num_images = 0
+        for i in range(num_iterations + warmup):
+            if i == warmup:
+                if self.device.type == 'cuda':
+                    torch.cuda.synchronize(self.device)
+                    torch.cuda.reset_peak_memory_stats(self.device)
+                sampler.start()
+                start = time.perf_counter()
+            images, targets = self.preprocess(*next(batches))
+            self.training_step(images, targets)
+            self.optimizer_step(optimizer)
+            if i >= warmup:
+                num_images += len(images)
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        seconds = time.perf_counter() - start
+        sampler.stop()
+        if self.device.type == 'cuda':
+            peak_memory = torch.cuda.max_memory_allocated(self.device) / 2**20
+        else:
+            peak_memory = max(sample['rss_mib'] for sample in sampler.log)
+        return {"images_per_second": num_images / seconds, "peak_memory_mib": peak_memory}
+
     def train(self):
         optimizer = torch.optim.Adamax(self.model.parameters(), lr=self.hyper_params['learning_rate'])
         logging_info = dict()
+        self.resources.start()
         start_time = time.time()
         for epoch in range(self.hyper_params['num_epochs']):
-            for i, (images, targets) in enumerate(self.train_loader):
-                self.model.train()
-
+            if is_distributed():
+                self.train_loader.sampler.set_epoch(epoch)
+            for i, (images, targets) in enumerate(self.throughput.track(self.train_loader)):
                 images, targets = self.preprocess(images, targets)
-                loss_dict = self.model(images, targets)
-                loss = sum(tuple([loss for loss in loss_dict.values()]))
-                loss.backward()
-                if (i+1) % self.hyper_params['step_every'] == 0 or (i+1) == len(self.train_loader):
-                    optimizer.step()
-                    optimizer.zero_grad()
-                mem = get_nvidia_gpu_memory()[0]['used']
+                step = (i+1) % self.hyper_params['step_every'] == 0 or (i+1) == len(self.train_loader)
+                loss = self.training_step(images, targets, sync=step)
+                if step:
+                    self.optimizer_step(optimizer)
 
-                if i % self.configs['log_every'] == 0 or (i+1) == len(self.train_loader):
+                if (i % self.configs['log_every'] == 0 or (i+1) == len(self.train_loader)) and is_main_process():
                     logging_info['iter'] = i
                     logging_info['images_train'] = images
                     logging_info['targets_train'] = targets
                     logging_info['loss'] = loss.item()
-                    self.offload_memory()
                     self.log_training_info(logging_info)
                     
                     delta_t = time.time() - start_time
                     start_time = time.time()
                     mins = int(delta_t // 60)
                     secs = int(delta_t - 60 * mins)
-                    print(f"Epoch: {epoch} | Iter: {i} | Loss: {loss.item():1.3f} | Peak Memory: {mem}MiB | Iter Duration: {mins} mins {secs} secs", flush=True)
+                    print(f"Epoch: {epoch} | Iter: {i} | Loss: {loss.item():1.3f} | {self.resources.summary()} | Iter Duration: {mins} mins {secs} secs", flush=True)
 
                 if i % self.configs['train_print_every'] == 0 or (i+1) == len(self.train_loader):
                     self.print_training_info()
-                self.offload_memory()
-                
-                    
+                if self.offload_every and (i+1) % self.offload_every == 0:
+                    self.offload_memory()
+
+            self.throughput_log.append(self.throughput.report())
+            if is_main_process():
+                print(f"Epoch: {epoch} | Data: {self.throughput.summary()}", flush=True)
+
             # Evaluate performance at end of epoch
+            self.offload_memory()
             self.plot_outputs(epoch)
             self.save_model(epoch)
             self.plot_training_vs_validation()
             self.print_end_of_epoch_info()
+        self.resources.stop()
 
 
 
@@ -4,27 +4,27 @@ import subprocess
 
 class NestedTensorHandler:
     @staticmethod
-    def to_device(item, device):
+    def to_device(item, device, non_blocking=False):
         """Recursively send tensors to the specified device in the nested structure."""
         if isinstance(item, torch.Tensor):
-            # Move tensor to the specified device
-            return item.to(device)
+            # Move tensor to the specified device (asynchronously from pinned memory if non_blocking)
+            return item.to(device, non_blocking=non_blocking)
         elif isinstance(item, dict):
             # Recursively process dictionary items
-            return {k: NestedTensorHandler.to_device(v, device) for k, v in item.items()}
+            return {k: NestedTensorHandler.to_device(v, device, non_blocking) for k, v in item.items()}
         elif isinstance(item, list):
             # Recursively process list items
-            return [NestedTensorHandler.to_device(i, device) for i in item]
+            return [NestedTensorHandler.to_device(i, device, non_blocking) for i in item]
         elif isinstance(item, tuple):
             # Recursively process tuple items and convert it back to tuple
-            return tuple(NestedTensorHandler.to_device(i, device) for i in item)
+            return tuple(NestedTensorHandler.to_device(i, device, non_blocking) for i in item)
         else:
             # Return the item as is if it's not a tensor, list, dict, or tuple
             return item
     @staticmethod
-    def get_structure_on_device(nested_structure, device='cpu'):
+    def get_structure_on_device(nested_structure, device='cpu', non_blocking=False):
         """Return the nested structure with tensors moved to the specified device."""
-        return NestedTensorHandler.to_device(nested_structure, device)
+        return NestedTensorHandler.to_device(nested_structure, device, non_blocking)
 
 def get_nvidia_gpu_memory():
     try:
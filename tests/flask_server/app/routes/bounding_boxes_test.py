@@ -0,0 +1,30 @@
+from flask_server.app.routes.bounding_boxes import BoundingBoxIndex
+import numpy as np
+
+
+def brute_force_query(bboxes, bbox):
+    x, y, w, h = bbox
+    return [
+        i for i, (other_x, other_y, other_w, other_h) in enumerate(bboxes)
+        if not (x + w < other_x or x > other_x + other_w or y > other_y + other_h or y + h < other_y)
+    ]
+
+
+def test_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    bboxes = np.column_stack((rng.uniform(0, 500, (300, 2)), rng.uniform(1, 60, (300, 2)))).tolist()
+    index = BoundingBoxIndex(bboxes)
+    for query in np.column_stack((rng.uniform(0, 500, (200, 2)), rng.uniform(0, 80, (200, 2)))).tolist():
+        assert index.query(query).tolist() == brute_force_query(bboxes, query)
+
+
+def test_query_includes_touching_boxes():
+    index = BoundingBoxIndex([[0, 0, 5, 5], [10, 10, 2, 2], [10, 0, 1, 5]])
+    assert index.query([5, 5, 5, 5]).tolist() == [0, 1, 2]
+    assert index.query([6.5, 6.5, 1, 1]).tolist() == []
+
+
+def test_empty_index():
+    index = BoundingBoxIndex([])
+    assert len(index) == 0
+    assert index.query([0, 0, 1, 1]).tolist() == []
@@ -0,0 +1,204 @@
+from flask_server.app.models.base_model import Model
+from flask_server.app.routes.responses import AnnotationLabel, ModelAnnotation, ModelResponse
+from flask_server.app.routes.utils import decode_image, decode_base64_image
+import base64
+import io
+import json
+import numpy as np
+from PIL import Image
+import pytest
+
+
+def square_response(model, x):
+    """ One seed annotation covering a 2x2 square """
+    mask = np.zeros_like(x)
+    mask[1:3, 1:3] = 255
+    annotation = ModelAnnotation(
+        bbox=[1, 1, 2, 2],
+        mask=mask,
+        label=AnnotationLabel.SEED,
+        confidence=0.9,
+        area=4.0,
+        mean_intensity=0.0,
+        seed_id=None,
+    )
+    return ModelResponse(annotations=[annotation], width=x.shape[1], height=x.shape[0])
+
+
+@pytest.fixture
+def client(make_app, stub_model):
+    app = make_app(stub_model(batch_size=2), max_batch_size=3, max_wait_ms=1000)
+    return app.test_client(), app.extensions['model_registry']
+
+
+@pytest.fixture
+def square_client(make_app, stub_model):
+    return make_app(stub_model(respond=square_response)).test_client()
+
+
+def test_batches_by_shape():
+    xs = [np.zeros((2, 3)), np.zeros((4, 4)), np.zeros((2, 3)), np.zeros((2, 3)), np.zeros((4, 4))]
+    batches = list(Model.batches_by_shape(xs, 2))
+    assert batches == [[0, 2], [3], [1, 4]]
+
+
+def test_predict_single_image_keeps_response_shape(client, encode):
+    client, _ = client
+    response = client.post('/predict', json={"model_id": "RCNN", "images": [encode(np.zeros((3, 5), dtype=np.uint8))]})
+    assert response.status_code == 200
+    assert response.get_json()["width"] == 5
+
+
+def test_predict_multiple_images(client, encode):
+    client, registry = client
+    images = [
+        np.zeros((3, 5), dtype=np.uint8),
+        np.zeros((7, 2), dtype=np.uint8),
+        np.zeros((3, 5), dtype=np.uint8),
+    ]
+    response = client.post('/predict', json={"model_id": "RCNN", "images": [encode(image) for image in images]})
+    assert response.status_code == 200
+
+    predictions = response.get_json()
+    assert [(p["height"], p["width"]) for p in predictions] == [image.shape for image in images]
+    assert registry.load("RCNN").batches == [[0, 2], [1]]
+
+
+def encode_png(image: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="png")
+    return buffer.getvalue()
+
+
+def test_decode_image_matches_json_path(encode):
+    image = np.arange(30, dtype=np.uint8).reshape(5, 6)
+    rgb = np.dstack((image, image, image))
+    assert (decode_image(encode_png(image)) == image).all()
+    assert (decode_image(encode_png(rgb)) == decode_base64_image(encode(rgb))).all()
+
+
+def test_decode_image_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_image(b"not an image")
+
+
+def test_predict_multipart(client):
+    client, _ = client
+    data = {
+        "model_id": "RCNN",
+        "images": [
+            (io.BytesIO(encode_png(np.zeros((3, 5), dtype=np.uint8))), "a.png"),
+            (io.BytesIO(encode_png(np.zeros((4, 2), dtype=np.uint8))), "b.png"),
+        ],
+    }
+    response = client.post('/predict', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert [(p["height"], p["width"]) for p in response.get_json()] == [(3, 5), (4, 2)]
+
+
+def test_predict_octet_stream(client):
+    client, _ = client
+    response = client.post(
+        '/predict?model_id=RCNN',
+        data=encode_png(np.zeros((3, 5), dtype=np.uint8)),
+        content_type='application/octet-stream',
+    )
+    assert response.status_code == 200
+    assert response.get_json()["width"] == 5
+
+
+@pytest.mark.parametrize("query, headers", [
+    ("?mask_format=rle", {}),
+    ("", {"Accept": "application/vnd.seedbank.rle+json"}),
+])
+def test_predict_rle_masks(query, headers, square_client, encode):
+    client = square_client
+    response = client.post(
+        f'/predict{query}',
+        json={"model_id": "RCNN", "images": [encode(np.zeros((5, 6), dtype=np.uint8))]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    prediction = response.get_json()
+    expected_rle = {"offset": [1, 1], "size": [2, 2], "counts": [0, 4]}
+    assert prediction["annotations"][0]["mask"] == expected_rle
+    assert prediction["composite_masks"]["1"] == expected_rle
+
+
+def test_predict_png_masks_by_default(square_client, encode):
+    client = square_client
+    response = client.post('/predict', json={"model_id": "RCNN", "images": [encode(np.zeros((5, 6), dtype=np.uint8))]})
+    assert isinstance(response.get_json()["annotations"][0]["mask"], str)
+
+
+def test_predict_label_map(square_client, encode):
+    client = square_client
+    response = client.post('/predict', json={
+        "model_id": "RCNN",
+        "composite_format": "label_map",
+        "images": [encode(np.zeros((5, 6), dtype=np.uint8))],
+    })
+    assert response.status_code == 200
+
+    prediction = response.get_json()
+    assert "composite_masks" not in prediction
+    label_map = np.array(Image.open(io.BytesIO(base64.b64decode(prediction["label_map"]))))
+    expected = np.zeros((5, 6), dtype=np.uint8)
+    expected[1:3, 1:3] = 1 << AnnotationLabel.SEED.value
+    assert (label_map == expected).all()
+
+
+def test_predict_rejects_unknown_composite_format(client, encode):
+    client, _ = client
+    response = client.post('/predict?composite_format=nope', json={
+        "model_id": "RCNN",
+        "images": [encode(np.zeros((3, 5), dtype=np.uint8))],
+    })
+    assert response.status_code == 500
+
+
+@pytest.mark.parametrize("query, headers", [
+    ("?stream=true", {}),
+    ("", {"Accept": "application/x-ndjson"}),
+])
+def test_predict_stream(query, headers, square_client, encode):
+    client = square_client
+    images = [encode(np.zeros((5, 6), dtype=np.uint8)), encode(np.zeros((4, 4), dtype=np.uint8))]
+    response = client.post(f'/predict{query}', json={"model_id": "RCNN", "images": images}, headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(r["image"], r["type"]) for r in records] == [
+        (image, record_type)
+        for image in range(2)
+        for record_type in ("header", "annotation", "composite_masks", "seed_indices")
+    ]
+    assert (records[4]["width"], records[4]["height"]) == (4, 4)
+
+    buffered = client.post('/predict', json={"model_id": "RCNN", "images": images}).get_json()
+    assert records[1]["annotation"] == buffered[0]["annotations"][0]
+    assert records[2]["composite_masks"] == buffered[0]["composite_masks"]
+
+
+def test_predict_stream_continues_after_a_failed_image(make_app, stub_model, encode):
+    def respond(model, x):
+        if x.shape == (3, 3):
+            raise ValueError("bad image")
+        return square_response(model, x)
+    # one image per forward pass, so only the middle one fails
+    client = make_app(stub_model(respond=respond), max_batch_size=1).test_client()
+    images = [encode(np.zeros(shape, dtype=np.uint8)) for shape in [(5, 6), (3, 3), (4, 4)]]
+    response = client.post('/predict?stream=true', json={"model_id": "RCNN", "images": images})
+    assert response.status_code == 200
+
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    record_types = ("header", "annotation", "composite_masks", "seed_indices")
+    assert [(r["image"], r["type"]) for r in records] == [
+        *[(0, record_type) for record_type in record_types],
+        (1, "error"),
+        *[(2, record_type) for record_type in record_types],
+    ]
+    assert "bad image" in records[4]["exception"]
+    assert (records[5]["width"], records[5]["height"]) == (4, 4)
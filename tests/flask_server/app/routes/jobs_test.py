@@ -0,0 +1,74 @@
+import threading
+import time
+import numpy as np
+import pytest
+
+
+def wait_for(client, job_id, status, timeout=10):
+    start = time.time()
+    while time.time() - start < timeout:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(f"Job {job_id} never reached {status}")
+
+
+@pytest.fixture
+def gate():
+    """ Held closed, so predictions only finish once a test opens it """
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def client(make_app, stub_model, gate):
+    return make_app(stub_model(gate=gate), job_workers=1, max_queued_jobs=1).test_client()
+
+
+def test_job_lifecycle(client, gate, encode):
+    payload = {"model_id": "RCNN", "images": [encode(np.zeros((3, 5), dtype=np.uint8))] * 2}
+    response = client.post('/jobs', json=payload)
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert response.headers["Location"].endswith(f"/jobs/{job_id}")
+
+    wait_for(client, job_id, "RUNNING")
+    assert client.get(f'/jobs/{job_id}/result').status_code == 202
+
+    gate.set()
+    job = wait_for(client, job_id, "COMPLETE")
+    assert job["progress"] == pytest.approx(1.0)
+
+    result = client.get(f'/jobs/{job_id}/result')
+    assert result.status_code == 200
+    assert [prediction["width"] for prediction in result.get_json()] == [5, 5]
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/result').status_code == 404
+
+
+def test_queue_is_bounded(client, encode):
+    payload = {"model_id": "RCNN", "images": [encode(np.zeros((3, 5), dtype=np.uint8))]}
+    running = client.post('/jobs', json=payload).get_json()["job_id"]
+    wait_for(client, running, "RUNNING")
+
+    assert client.post('/jobs', json=payload).status_code == 202
+    assert client.post('/jobs', json=payload).status_code == 503
+
+
+def test_finished_jobs_expire(make_app, encode):
+    app = make_app(job_result_ttl=0)
+    client = app.test_client()
+    payload = {"model_id": "RCNN", "images": [encode(np.zeros((3, 5), dtype=np.uint8))]}
+    job_id = client.post('/jobs', json=payload).get_json()["job_id"]
+
+    job = app.extensions['job_manager'].jobs[job_id]
+    start = time.time()
+    while job.finished_at is None and time.time() - start < 10:
+        time.sleep(0.01)
+    time.sleep(0.01)
+    assert client.get(f'/jobs/{job_id}').status_code == 404
@@ -82,6 +82,76 @@ class TestModelAnnotation:
 
         assert actual_json == expected_json
 
+    def test_to_json_includes_stats_when_given(self, get_single_annotation):
+        annotation = get_single_annotation
+        assert "stats" not in annotation.to_json()
+        annotation.stats = {"std": 0.0, "p50": 255.0}
+        assert annotation.to_json()["stats"] == {"std": 0.0, "p50": 255.0}
+
+    def test_mask_is_stored_cropped(self, get_single_annotation):
+        annotation = get_single_annotation
+        assert annotation.crop.shape == (3, 3)
+        assert annotation.offset == (0, 0)
+        assert annotation.mask.shape == (10, 10)
+        assert annotation.mask[0:3, 0:3].all()
+        assert annotation.mask.sum() == 9 * 255
+
+    def test_cropped_mask_matches_full_frame(self):
+        full = np.zeros((12, 14), dtype=np.uint8)
+        full[4:7, 5:9] = 255
+        from_full = ModelAnnotation(
+            bbox=[5.0, 4.0, 4.0, 3.0],
+            mask=full,
+            label=AnnotationLabel.SEED,
+            confidence=0.9,
+            area=12.0,
+            mean_intensity=255,
+            seed_id=None,
+        )
+        from_crop = ModelAnnotation(
+            bbox=[5.0, 4.0, 4.0, 3.0],
+            mask=full[4:7, 5:9],
+            label=AnnotationLabel.SEED,
+            confidence=0.9,
+            area=12.0,
+            mean_intensity=255,
+            seed_id=None,
+            offset=(5, 4),
+            image_shape=(12, 14),
+        )
+
+        assert from_full.offset == from_crop.offset == (5, 4)
+        assert (from_full.mask == full).all()
+        assert (from_crop.mask == full).all()
+        assert from_full.to_json() == from_crop.to_json()
+
+    def test_overlap_partial(self):
+        mask1 = np.zeros((10, 10), dtype=np.uint8)
+        mask1[0:4, 0:4] = 255
+        mask2 = np.zeros_like(mask1)
+        mask2[2:6, 2:6] = 255
+        annotation1 = ModelAnnotation(
+            bbox=[0.0, 0.0, 4.0, 4.0],
+            mask=mask1,
+            label=AnnotationLabel.SEED,
+            confidence=0.9,
+            area=16.0,
+            mean_intensity=255,
+            seed_id=None,
+        )
+        annotation2 = ModelAnnotation(
+            bbox=[2.0, 2.0, 4.0, 4.0],
+            mask=mask2,
+            label=AnnotationLabel.VOID,
+            confidence=0.9,
+            area=16.0,
+            mean_intensity=255,
+            seed_id=None,
+        )
+
+        assert annotation1.overlap(annotation2) == pytest.approx(4 / 28)
+        assert annotation2.overlap(annotation1) == pytest.approx(4 / 28)
+
 
 @pytest.fixture
 def get_single_annotation() -> ModelAnnotation:
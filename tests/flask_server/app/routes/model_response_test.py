@@ -2,8 +2,12 @@ from flask_server.app.routes.responses import (
     AnnotationLabel,
     ModelAnnotation,
     ModelResponse,
+    PngEncoder,
 )
+import base64
+import io
 import numpy as np
+from PIL import Image
 import pytest
 
 
@@ -27,6 +31,37 @@ class TestModelResponse:
         assert (actual_masks[3] == expected_endosperm_mask).all()
         assert (actual_masks[5] == expected_void_mask).all()
 
+    def test_label_map_packs_composite_masks(self, get_response):
+        composite_masks = get_response.get_composite_masks()
+        label_map = get_response.get_label_map()
+
+        assert label_map.dtype == np.uint8
+        for label, mask in composite_masks.items():
+            assert ((label_map & (1 << label)) > 0).tolist() == (mask > 0).tolist()
+        assert label_map[4, 4] == (1 << AnnotationLabel.SEED.value) | (1 << AnnotationLabel.ENDOSPERM.value)
+        assert label_map[9, 0] == 0
+
+    def test_to_json_label_map(self, get_response):
+        prediction = get_response.to_json(composite_format="label_map")
+        assert "composite_masks" not in prediction
+        decoded = np.array(Image.open(io.BytesIO(base64.b64decode(prediction["label_map"]))))
+        assert (decoded == get_response.get_label_map()).all()
+
+    def test_to_json_with_parallel_encoder(self, get_response):
+        encoder = PngEncoder(num_workers=3, cache_size=8)
+        assert get_response.to_json(encoder=encoder) == get_response.to_json()
+
+    def test_iter_json_matches_to_json(self, get_response):
+        records = list(get_response.iter_json(encoder=PngEncoder(num_workers=2)))
+        assert [r["type"] for r in records] == ["header"] + ["annotation"] * 5 + ["composite_masks", "seed_indices"]
+        assert [r["index"] for r in records[1:-2]] == list(range(5))
+
+        expected = get_response.to_json()
+        assert {k: records[0][k] for k in ("width", "height")} == {"width": 10, "height": 10}
+        assert [r["annotation"] for r in records[1:-2]] == expected["annotations"]
+        assert records[-2]["composite_masks"] == expected["composite_masks"]
+        assert records[-1]["seed_indices"] == expected["seed_indices"]
+
     def test_flatten_seed_indices(self, get_response):
         expected_seed_indices = [[0, 4], [1, 3], [2]]
         actual_seed_indices = get_response.flatten_seed_indices()
@@ -116,6 +151,35 @@ class TestModelResponse:
         actual_json = get_response.to_json()
         assert expected_json == actual_json
 
+    def test_populate_seed_indices_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        annotations = []
+        for _ in range(60):
+            x, y = rng.integers(0, 90, 2)
+            w, h = rng.integers(1, 12, 2)
+            mask = np.zeros((100, 100), dtype=np.uint8)
+            mask[y:y + h, x:x + w] = 255
+            label = AnnotationLabel.SEED if rng.random() < 0.5 else AnnotationLabel.ENDOSPERM
+            annotations.append(ModelAnnotation(
+                bbox=[int(x), int(y), int(w), int(h)],
+                mask=mask,
+                label=label,
+                confidence=0.9,
+                area=int(w * h),
+                mean_intensity=255,
+                seed_id=None,
+            ))
+        ModelResponse(annotations, 100, 100)
+
+        seeds = [x for x in annotations if x.label == AnnotationLabel.SEED]
+        for annotation in annotations:
+            if annotation.label == AnnotationLabel.SEED:
+                continue
+            overlaps = [annotation.overlap(seed) for seed in seeds]
+            best = int(np.argmax(overlaps))
+            expected = seeds[best].seed_id if overlaps[best] > 0.05 else None
+            assert annotation.seed_id == expected
+
 
 @pytest.fixture
 def get_response():
@@ -1,4 +1,7 @@
-from flask_server.app.routes.responses import get_base64_encoding, add_transparency
+from flask_server.app.routes.responses import get_base64_encoding, add_transparency, get_rle_encoding, decode_rle, encode_mask, PngEncoder
+import base64
+import io
+from PIL import Image
 import numpy as np
 
 
@@ -31,3 +34,79 @@ def test_add_transparency():
     actual_image = add_transparency(image)
 
     assert (actual_image == expected_image).all()
+
+
+def test_get_rle_encoding():
+    mask = np.zeros((6, 8), dtype=np.uint8)
+    mask[1:3, 2] = 255
+    mask[2, 3:5] = 255
+
+    expected_rle = {
+        "offset": [2, 1],
+        "size": [2, 3],
+        "counts": [0, 2, 1, 1, 1, 1],
+    }
+    actual_rle = get_rle_encoding(mask)
+
+    assert actual_rle == expected_rle
+
+
+def test_get_rle_encoding_empty_mask():
+    assert get_rle_encoding(np.zeros((4, 4), dtype=np.uint8)) == {"offset": [0, 0], "size": [0, 0], "counts": []}
+
+
+def test_decode_rle_round_trip():
+    rng = np.random.default_rng(0)
+    mask = np.zeros((40, 30), dtype=np.uint8)
+    mask[5:25, 7:20] = (rng.random((20, 13)) > 0.5) * 255
+
+    assert (decode_rle(get_rle_encoding(mask), 40, 30) == mask).all()
+    assert (decode_rle(encode_mask(np.zeros_like(mask), "rle"), 40, 30) == 0).all()
+
+
+def test_png_encoder_matches_serial_encoding():
+    rng = np.random.default_rng(0)
+    masks = [(rng.random((40, 30)) > 0.5).astype(np.uint8) * 255 for _ in range(8)]
+    encoder = PngEncoder(num_workers=4, cache_size=16)
+    assert encoder.map(encoder.encode, masks) == [get_base64_encoding(mask) for mask in masks]
+
+
+def test_png_encoder_caches_identical_masks():
+    encoder = PngEncoder(cache_size=2)
+    empty = np.zeros((20, 20), dtype=np.uint8)
+    first = encoder.encode(empty)
+    assert encoder.encode(empty.copy()) == first
+    assert encoder.get_metrics()["cache_hits"] == 1
+    assert encoder.get_metrics()["cache_misses"] == 1
+
+    # same bytes, different shape
+    encoder.encode(np.zeros((10, 40), dtype=np.uint8))
+    encoder.encode(np.ones((20, 20), dtype=np.uint8))
+    assert encoder.get_metrics()["cache_size"] == 2
+    assert encoder.get_metrics()["cache_misses"] == 3
+
+
+def test_png_encoder_compress_level():
+    mask = np.zeros((64, 64), dtype=np.uint8)
+    mask[10:50, 5:30] = 255
+    fast = PngEncoder(compress_level=1).encode(mask)
+    decoded = np.array(Image.open(io.BytesIO(base64.b64decode(fast))))
+    assert (decoded == mask).all()
+
+
+def test_png_encoder_keeps_a_bounded_window_in_flight():
+    encoder = PngEncoder(num_workers=2)
+    pulled = []
+
+    def items():
+        for i in range(50):
+            pulled.append(i)
+            yield i
+
+    results = encoder.imap(lambda i: i * 2, items())
+    for consumed in range(1, 51):
+        assert next(results) == 2 * (consumed - 1)
+        # items taken from the input but not yet yielded to the reader
+        assert len(pulled) - consumed <= encoder.window
+    assert next(results, None) is None
+    assert len(pulled) == 50
@@ -0,0 +1,138 @@
+from flask_server.app.models.cache import PredictionCache
+from flask_server.app.models.registry import ModelRegistry
+from flask_server.app.models.scheduler import BatchScheduler
+from flask_server.app.routes.responses import ModelResponse
+import os
+import pickle
+import numpy as np
+
+
+def test_key_depends_on_pixels_model_and_fingerprint():
+    image = np.zeros((4, 6), dtype=np.uint8)
+    key = PredictionCache.key(image, "RCNN", "v1")
+    assert PredictionCache.key(image.copy(), "RCNN", "v1") == key
+    assert PredictionCache.key(np.zeros((6, 4), dtype=np.uint8), "RCNN", "v1") != key
+    assert PredictionCache.key(image, "YOLO", "v1") != key
+    assert PredictionCache.key(image, "RCNN", "v2") != key
+
+
+def test_memory_tier_is_lru():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get_metrics()["memory_hits"] == 3
+    assert cache.get_metrics()["misses"] == 1
+
+
+def test_disk_tier_survives_restart_and_is_bounded(tmp_path):
+    response = ModelResponse(annotations=[], width=3, height=2)
+    cache = PredictionCache(max_entries=1, disk_dir=str(tmp_path))
+    cache.put("a", response)
+    cache.put("b", response)
+
+    restarted = PredictionCache(max_entries=1, disk_dir=str(tmp_path))
+    assert restarted.get("a").width == 3
+    assert restarted.get_metrics()["disk_hits"] == 1
+
+    entry_size = os.path.getsize(tmp_path / "a.pkl")
+    # files are ordered by modification time when the cache starts
+    os.utime(tmp_path / "a.pkl", (0, 0))
+    bounded = PredictionCache(max_entries=0, disk_dir=str(tmp_path), max_disk_bytes=2 * entry_size)
+    bounded.put("c", response)
+    assert sorted(os.listdir(tmp_path)) == ["b.pkl", "c.pkl"]
+
+
+def test_repeated_predictions_are_cached(make_app, stub_model, encode):
+    settings = {"version": "v1"}
+    app = make_app(stub_model(fingerprint=lambda model: settings["version"]))
+    client = app.test_client()
+    registry = app.extensions['model_registry']
+    payload = {"model_id": "RCNN", "images": [encode(np.zeros((4, 6), dtype=np.uint8))]}
+
+    for _ in range(3):
+        assert client.post('/predict', json=payload).get_json()["width"] == 6
+    assert len(registry.load("RCNN").batches) == 1
+
+    # new weights or settings invalidate earlier predictions
+    settings["version"] = "v2"
+    client.post('/predict', json=payload)
+    assert len(registry.load("RCNN").batches) == 2
+
+    metrics = client.get('/metrics').get_json()["prediction_cache"]
+    assert metrics["memory_hits"] == 2
+    assert metrics["misses"] == 2
+
+
+def test_predictions_are_cached_under_the_model_that_made_them(stub_model):
+    # each build stands for newly loaded weights, with its own fingerprint, and predicts that fingerprint
+    model = stub_model(fingerprint=lambda model: f"v{model.build_id}", respond=lambda model, x: model.get_fingerprint())
+    registry = ModelRegistry({"RCNN": model})
+    cache = PredictionCache()
+    scheduler = BatchScheduler(registry, max_batch_size=1, max_wait_ms=0, cache=cache)
+    image = np.zeros((4, 6), dtype=np.uint8)
+
+    # hold the model so the batch can only run after the reload
+    with registry.locks["RCNN"]:
+        future = scheduler.submit("RCNN", image)
+        registry.reload("RCNN")
+    assert future.result(timeout=5) == "v2"
+
+    assert cache.get(PredictionCache.key(image, "RCNN", "v1")) is None
+    assert cache.get(PredictionCache.key(image, "RCNN", "v2")) == "v2"
+    assert scheduler.predict("RCNN", image) == "v2"
+
+
+def test_disk_errors_are_cache_misses(tmp_path, monkeypatch):
+    cache = PredictionCache(max_entries=0, disk_dir=str(tmp_path))
+    cache.put("a", 1)
+
+    # evicted by another thread between being read and being touched
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "utime", evicted)
+        assert cache.get("a") is None
+
+    def full_disk(*args, **kwargs):
+        raise OSError("No space left on device")
+    monkeypatch.setattr(pickle, "dump", full_disk)
+    cache.put("b", 2)
+    assert cache.get("b") is None
+    assert cache.get_metrics()["disk_errors"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["a.pkl"]
+
+
+def test_disk_size_is_tracked_without_rescanning(tmp_path, monkeypatch):
+    response = ModelResponse(annotations=[], width=3, height=2)
+    PredictionCache(max_entries=0, disk_dir=str(tmp_path)).put("a", response)
+    entry_size = os.path.getsize(tmp_path / "a.pkl")
+
+    cache = PredictionCache(max_entries=0, disk_dir=str(tmp_path), max_disk_bytes=2 * entry_size)
+    assert cache.disk_bytes == entry_size
+
+    def scandir(path):
+        raise AssertionError("The cache directory should only be scanned on start")
+    monkeypatch.setattr(os, "scandir", scandir)
+    cache.put("b", response)
+    assert cache.get("a").width == 3
+    # a was read more recently than b, so b goes first
+    cache.put("c", response)
+    assert sorted(os.listdir(tmp_path)) == ["a.pkl", "c.pkl"]
+    assert cache.disk_bytes == 2 * entry_size
+
+
+def test_a_failing_cache_does_not_stop_predictions(stub_model):
+    class FailingCache(PredictionCache):
+        def put(self, key, response):
+            raise OSError("No space left on device")
+
+    model = stub_model(fingerprint=lambda model: "v1", respond=lambda model, x: int(x.sum()))
+    scheduler = BatchScheduler(ModelRegistry({"RCNN": model}), max_batch_size=1, max_wait_ms=0, cache=FailingCache())
+    assert scheduler.submit("RCNN", np.ones((2, 2))).result(timeout=5) == 4
+    assert scheduler.submit("RCNN", np.full((2, 2), 2)).result(timeout=5) == 8
+    assert scheduler.workers["RCNN"].is_alive()
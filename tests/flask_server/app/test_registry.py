@@ -0,0 +1,53 @@
+from flask_server.app.models.registry import ModelRegistry
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def model(stub_model):
+    return stub_model()
+
+
+@pytest.fixture
+def registry(model):
+    return ModelRegistry({"RCNN": model, "YOLO": model}, default_model_id="YOLO")
+
+
+def test_models_built_once(registry, model):
+    first = registry.load("RCNN")
+    second = registry.load("RCNN")
+    assert first is second
+    assert model.builds == 1
+
+
+def test_unknown_model_falls_back_to_default(registry, model):
+    assert registry.resolve("something else") == "YOLO"
+    strict = ModelRegistry({"RCNN": model})
+    with pytest.raises(KeyError):
+        strict.resolve("YOLO")
+
+
+def test_unload_and_reload(registry):
+    first = registry.load("YOLO")
+    reloaded = registry.reload("YOLO")
+    assert reloaded is not first
+    assert registry.load("YOLO") is reloaded
+    assert registry.unload("YOLO") is True
+    assert registry.is_loaded("YOLO") is False
+    assert registry.unload("YOLO") is False
+
+
+def test_predict_route_reuses_model(make_app, model, encode):
+    client = make_app(model).test_client()
+    image = encode(np.zeros((4, 6), dtype=np.uint8))
+
+    for _ in range(3):
+        response = client.post('/predict', json={"model_id": "RCNN", "images": [image]})
+        assert response.status_code == 200
+        assert response.get_json()["width"] == 6
+    assert model.builds == 1
+
+    response = client.post('/models/RCNN/reload')
+    assert response.status_code == 200
+    assert model.builds == 2
+    assert client.post('/models/unknown/reload').status_code == 404
@@ -0,0 +1,58 @@
+from flask_server.app.models.registry import ModelRegistry
+from flask_server.app.models.scheduler import BatchScheduler
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def registry(stub_model):
+    def respond(model, x):
+        return int(x.sum())
+    return ModelRegistry({
+        "RCNN": stub_model(respond=respond),
+        "FAIL": stub_model(fails=True),
+        "SHORT": stub_model(respond=respond, drop_last=True),
+    })
+
+
+def batch_sizes(model):
+    return [len(batch) for batch in model.batches]
+
+
+def test_concurrent_requests_are_coalesced(registry):
+    scheduler = BatchScheduler(registry, max_batch_size=4, max_wait_ms=1000)
+    images = [np.full((2, 2), i) for i in range(4)]
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda image: scheduler.predict("RCNN", image), images))
+
+    assert results == [0, 4, 8, 12]
+    assert batch_sizes(registry.load("RCNN")) == [4]
+
+    metrics = scheduler.get_metrics()["RCNN"]
+    assert metrics["queue_depth"] == 0
+    assert metrics["batches"] == 1
+    assert metrics["images"] == 4
+    assert metrics["batch_sizes"] == {4: 1}
+
+
+def test_batch_is_flushed_after_deadline(registry):
+    scheduler = BatchScheduler(registry, max_batch_size=8, max_wait_ms=5)
+    assert scheduler.predict_batch("RCNN", [np.ones((2, 2)), np.ones((2, 2))]) == [4, 4]
+    assert batch_sizes(registry.load("RCNN")) == [2]
+
+
+def test_exceptions_reach_every_request(registry):
+    scheduler = BatchScheduler(registry, max_batch_size=2, max_wait_ms=1000)
+    futures = [scheduler.submit("FAIL", np.ones((2, 2))) for _ in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result()
+
+
+def test_missing_responses_fail_every_request(registry):
+    scheduler = BatchScheduler(registry, max_batch_size=2, max_wait_ms=1000)
+    futures = [scheduler.submit("SHORT", np.ones((2, 2))) for _ in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
@@ -0,0 +1,59 @@
+from flask_server.app.models.tiling import get_tiles, predict_tiled, tile_origins
+import cv2 as cv
+import numpy as np
+import pytest
+
+
+def detect_components(tiles):
+    """ A stand-in detector: every connected blob of non-zero pixels is one instance, labelled by its value """
+    outputs = []
+    for tile in tiles:
+        count, components, stats, _ = cv.connectedComponentsWithStats((tile > 0).astype(np.uint8))
+        boxes, scores, labels, masks = [], [], [], []
+        for i in range(1, count):
+            x, y, w, h, area = stats[i]
+            boxes.append([x, y, x + w, y + h])
+            scores.append(area / tile.size)
+            labels.append(int(tile[components == i][0]))
+            masks.append((components == i).astype(np.uint8))
+        outputs.append((np.array(boxes).reshape(-1, 4), np.array(scores), np.array(labels), np.array(masks)))
+    return outputs
+
+
+@pytest.mark.parametrize("length, tile_size, overlap", [(50, 100, 20), (100, 100, 20), (250, 100, 20), (1000, 256, 64)])
+def test_tiles_cover_with_overlap(length, tile_size, overlap):
+    origins = tile_origins(length, tile_size, overlap)
+    assert origins[0] == 0
+    assert origins[-1] + min(tile_size, length) == length
+    assert all(later - earlier <= tile_size - overlap for earlier, later in zip(origins, origins[1:]))
+
+
+def test_tiles_are_the_same_size():
+    tiles = get_tiles(250, 180, 100, 30)
+    assert {(w, h) for _, _, w, h in tiles} == {(100, 100)}
+    assert max(x + w for x, _, w, _ in tiles) == 180
+    assert max(y + h for _, y, _, h in tiles) == 250
+
+
+def test_tiled_detections_match_whole_image():
+    image = np.zeros((240, 330), dtype=np.uint8)
+    cv.circle(image, (30, 30), 12, 1, -1)
+    cv.circle(image, (100, 95), 15, 2, -1)        # across the edges of four tiles
+    cv.rectangle(image, (20, 150), (310, 170), 1, -1)  # wider than several tiles
+    cv.circle(image, (175, 60), 10, 1, -1)
+    cv.circle(image, (197, 60), 10, 1, -1)        # a close neighbour in the next tile
+
+    detections = predict_tiled(image, detect_components, tile_size=100, overlap=40, batch_size=3)
+    expected = detect_components([image])[0]
+
+    def full_frame(crop, offset):
+        mask = np.zeros(image.shape, dtype=bool)
+        x, y = offset
+        mask[y:y + crop.shape[0], x:x + crop.shape[1]] = crop > 0
+        return mask
+
+    actual = sorted((d.label, full_frame(d.crop, d.offset).tobytes()) for d in detections)
+    assert actual == sorted((int(label), (mask > 0).tobytes()) for label, mask in zip(expected[2], expected[3]))
+
+    bar = max(detections, key=lambda d: d.crop.size)
+    assert bar.box.tolist() == [20, 150, 311, 171]
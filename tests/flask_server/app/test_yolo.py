@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+pytest.importorskip("ultralytics")
+
+from flask_server.app.models.yolo import nearest_indices, upsample_crop
+from flask_server.app.routes.responses import crop_to_content
+
+
+@pytest.mark.parametrize("input_shape, output_shape", [((40, 56), (120, 170)), ((160, 160), (1000, 1333)), ((64, 48), (30, 50)), ((7, 9), (7, 9))])
+def test_upsample_crop_matches_full_upsampling(input_shape, output_shape):
+    generator = torch.Generator().manual_seed(0)
+    masks = torch.zeros(20, *input_shape)
+    for mask in masks:
+        y, x = torch.randint(0, input_shape[0], (2,), generator=generator), torch.randint(0, input_shape[1], (2,), generator=generator)
+        mask[y.min():y.max() + 1, x.min():x.max() + 1] = (torch.rand(int(y.max() - y.min()) + 1, int(x.max() - x.min()) + 1, generator=generator) > 0.3).float()
+    masks[0] = 0
+    masks[1, 3, 4] = 1
+    full = F.interpolate(masks.unsqueeze(1), size=output_shape, mode='nearest').squeeze(1)
+    rows, columns = nearest_indices(input_shape[0], output_shape[0]), nearest_indices(input_shape[1], output_shape[1])
+    for mask, full_mask in zip(masks, full):
+        crop, offset = upsample_crop(mask > 0, rows, columns)
+        expected, expected_offset = crop_to_content(full_mask.numpy().astype(np.uint8))
+        assert offset == expected_offset
+        assert np.array_equal(crop.numpy().astype(np.uint8), expected)
@@ -0,0 +1,95 @@
+from flask_server.app import create_app
+from flask_server.app.models.base_model import Model
+from flask_server.app.routes.responses import ModelResponse
+import base64
+import io
+import numpy as np
+from PIL import Image
+import pytest
+
+
+def empty_response(model, x):
+    return ModelResponse(annotations=[], width=x.shape[1], height=x.shape[0])
+
+
+class StubModel(Model):
+    """
+    A Model without a network, for the server tests. Its behaviour is set by class attributes, which the stub_model
+    fixture overrides per test:
+        respond: respond(model, image) gives each image's response (by default an empty ModelResponse of its shape)
+        batch_size: group same-shaped images into forward passes of at most this many (None passes all at once)
+        gate: a threading.Event every forward pass waits on (for up to 10 seconds) before answering
+        fails: every forward pass raises ValueError
+        drop_last: forward passes return one response fewer than the images they were given
+        fingerprint: fingerprint(model) gives get_fingerprint's value (None by default, so nothing is cached)
+    builds counts the instances of the class, each instance knowing its own build_id, and batches records the
+    indices of the images in each forward pass.
+    """
+    respond = staticmethod(empty_response)
+    batch_size = None
+    gate = None
+    fails = False
+    drop_last = False
+    fingerprint = staticmethod(lambda model: None)
+    builds = 0
+
+    def __init__(self):
+        type(self).builds += 1
+        self.build_id = type(self).builds
+        self.batches = []
+        self.model = self.build_model()
+
+    def build_model(self):
+        pass
+
+    def predict(self, x):
+        return self.predict_batch([x])[0]
+
+    def predict_batch(self, xs):
+        if self.gate is not None:
+            self.gate.wait(timeout=10)
+        if self.fails:
+            raise ValueError("bad batch")
+        batches = self.batches_by_shape(xs, self.batch_size) if self.batch_size else [list(range(len(xs)))]
+        responses = [None] * len(xs)
+        for batch in batches:
+            self.batches.append(batch)
+            for i in batch:
+                responses[i] = self.respond(self, xs[i])
+        return responses[:-1] if self.drop_last else responses
+
+    def get_fingerprint(self):
+        return self.fingerprint(self)
+
+
+@pytest.fixture
+def stub_model():
+    """ Makes a StubModel class with the behaviour given as keyword arguments, counting its own builds """
+    def make(**behaviour):
+        unknown = set(behaviour) - {"respond", "batch_size", "gate", "fails", "drop_last", "fingerprint"}
+        if unknown:
+            raise TypeError(f"Unknown stub model behaviour {sorted(unknown)}")
+        for name in ("respond", "fingerprint"):
+            if name in behaviour:
+                behaviour[name] = staticmethod(behaviour[name])
+        return type("ConfiguredStubModel", (StubModel,), {**behaviour, "builds": 0})
+    return make
+
+
+@pytest.fixture
+def make_app(stub_model):
+    """ Makes the app with model (a stub_model class, a plain one by default) serving both RCNN and YOLO """
+    def make(model=None, **kwargs):
+        model = model or stub_model()
+        return create_app(model_factories={"RCNN": model, "YOLO": model}, **kwargs)
+    return make
+
+
+@pytest.fixture
+def encode():
+    """ A PNG data URL of an image, as the web client sends it """
+    def encode(image: np.ndarray) -> str:
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format="png")
+        return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return encode
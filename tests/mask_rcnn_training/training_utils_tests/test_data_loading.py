@@ -0,0 +1,62 @@
+import pickle
+import pytest
+import torch
+from src.mask_rcnn_training.training_utils.data_loading import ThroughputMonitor, collate, make_loader
+
+DATASET = [(torch.full((1, 4, 4), float(i)), {'labels': torch.tensor([i])}) for i in range(10)]
+
+def first_values(loader):
+    return [int(image[0, 0, 0]) for images, _ in loader for image in images]
+
+
+def test_collate_is_picklable():
+    assert pickle.loads(pickle.dumps(collate)) is collate
+    images, targets = collate(DATASET[:3])
+    assert len(images) == len(targets) == 3
+    assert targets[2]['labels'].item() == 2
+
+
+def test_seed_makes_shuffling_reproducible():
+    configs = {"num_workers": 0, "seed": 3}
+    assert first_values(make_loader(DATASET, 4, loader_configs=configs)) == first_values(make_loader(DATASET, 4, loader_configs=configs))
+    assert sorted(first_values(make_loader(DATASET, 4, loader_configs=configs))) == list(range(10))
+
+
+def test_worker_options_are_only_set_with_workers():
+    loader = make_loader(DATASET, 4, loader_configs={"num_workers": 0, "persistent_workers": True, "prefetch_factor": 4})
+    assert loader.num_workers == 0
+    assert not loader.persistent_workers
+    loader = make_loader(DATASET, 4, loader_configs={"num_workers": 2, "persistent_workers": True, "prefetch_factor": 4})
+    assert loader.persistent_workers
+    assert loader.prefetch_factor == 4
+
+
+def test_unknown_configs():
+    with pytest.raises(ValueError):
+        make_loader(DATASET, 4, loader_configs={"workers": 2})
+
+
+def test_throughput_monitor_counts_a_pass():
+    monitor = ThroughputMonitor()
+    batches = list(monitor.track(make_loader(DATASET, 4, shuffle=False, loader_configs={"num_workers": 0})))
+    assert len(batches) == 3
+    report = monitor.report()
+    assert report["images"] == 10
+    assert report["batches"] == 3
+    assert 0 <= report["waiting_seconds"] <= report["seconds"]
+    assert 0 <= report["waiting_fraction"] <= 1
+    assert "images/s" in monitor.summary()
+
+
+def test_distributed_loader_shards_the_dataset(tmp_path):
+    torch.distributed.init_process_group('gloo', init_method=f"file://{tmp_path / 'store'}", rank=0, world_size=1)
+    try:
+        loader = make_loader(DATASET, 4, loader_configs={"num_workers": 0, "seed": 1}, distributed=True)
+        assert isinstance(loader.sampler, torch.utils.data.distributed.DistributedSampler)
+        loader.sampler.set_epoch(0)
+        first_epoch = first_values(loader)
+        loader.sampler.set_epoch(1)
+        assert sorted(first_epoch) == sorted(first_values(loader)) == list(range(10))
+        assert first_epoch != first_values(loader)
+    finally:
+        torch.distributed.destroy_process_group()
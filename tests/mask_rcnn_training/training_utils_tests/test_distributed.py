@@ -0,0 +1,22 @@
+import torch
+from src.mask_rcnn_training.training_utils.distributed import all_reduce_sum, get_rank, get_world_size, init_distributed, is_distributed, is_main_process
+
+
+def test_single_process_is_not_distributed(monkeypatch):
+    monkeypatch.delenv('WORLD_SIZE', raising=False)
+    assert init_distributed(use_gpu=False) == torch.device('cpu')
+    assert not is_distributed()
+    assert get_rank() == 0
+    assert get_world_size() == 1
+    assert is_main_process()
+    tensor = torch.tensor([1.0, 2.0])
+    assert all_reduce_sum(tensor) is tensor
+
+
+def test_all_reduce_sum_in_a_process_group(tmp_path):
+    torch.distributed.init_process_group('gloo', init_method=f"file://{tmp_path / 'store'}", rank=0, world_size=1)
+    try:
+        assert is_distributed()
+        assert torch.equal(all_reduce_sum(torch.tensor([[1.0, 2.0]])), torch.tensor([[1.0, 2.0]]))
+    finally:
+        torch.distributed.destroy_process_group()
@@ -0,0 +1,28 @@
+import pytest
+import torch
+from torchvision.models.detection import maskrcnn_resnet50_fpn_v2
+from src.mask_rcnn_training.training_utils.model_builder import export_onnx, OnnxMaskRCNN
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def test_onnx_export_matches_eager_model(tmp_path):
+    torch.manual_seed(0)
+    model = maskrcnn_resnet50_fpn_v2(weights=None, weights_backbone=None, num_classes=6, min_size=200, max_size=333).eval()
+    model.roi_heads.score_thresh = 0.0
+    model.roi_heads.detections_per_img = 20
+
+    onnx_path = export_onnx(model, str(tmp_path / "rcnn.onnx"), sample_shape=(1, 120, 160))
+    onnx_model = OnnxMaskRCNN(onnx_path, intra_op_threads=1)
+
+    # a different size from the traced sample
+    image = torch.rand(1, 150, 130)
+    with torch.no_grad():
+        expected = model([image])[0]
+    actual = onnx_model([image])[0]
+
+    assert actual["masks"].shape == expected["masks"].shape
+    assert torch.equal(actual["labels"], expected["labels"])
+    assert torch.allclose(actual["boxes"], expected["boxes"], atol=1e-2)
+    assert torch.allclose(actual["scores"], expected["scores"], atol=1e-3)
+    assert torch.allclose(actual["masks"], expected["masks"], atol=1e-2)
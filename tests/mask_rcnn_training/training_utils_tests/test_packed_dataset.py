@@ -0,0 +1,82 @@
+import json
+import pickle
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision import datasets
+from torchvision.transforms import v2
+from src.mask_rcnn_training.training_utils.packed_dataset import PackedMaskDataset, pack_coco_dataset
+from src.mask_rcnn_training.training_utils.ring_mask_converter import remove_overlap
+
+@pytest.fixture
+def coco_dataset(tmp_path):
+    """ Four grayscale images of two sizes with overlapping square instances of three categories, one image unannotated """
+    rng = np.random.default_rng(0)
+    images, annotations = [], []
+    for image_id, (height, width) in enumerate([(40, 60), (40, 60), (32, 32), (40, 60)], start=1):
+        file_name = f"{image_id}.png"
+        Image.fromarray(rng.integers(0, 256, (height, width), dtype=np.uint8)).save(tmp_path / file_name)
+        images.append({"id": image_id, "file_name": file_name, "height": height, "width": width})
+        if image_id == 3:
+            continue
+        for _ in range(int(rng.integers(1, 6))):
+            x, y = (int(v) for v in rng.integers(0, 20, 2))
+            size = int(rng.integers(4, 12))
+            polygon = [x, y, x + size, y, x + size, y + size, x, y + size]
+            annotations.append({
+                "id": len(annotations) + 1, "image_id": image_id, "category_id": int(rng.integers(0, 3)),
+                "segmentation": [polygon], "bbox": [x, y, size, size], "area": size * size, "iscrowd": 0,
+            })
+    categories = [{"id": i, "name": name} for i, name in enumerate(["Seed", "Interior", "Void"])]
+    annotations_path = tmp_path / "annotations.json"
+    with open(annotations_path, 'w') as file:
+        json.dump({"images": images, "annotations": annotations, "categories": categories}, file)
+    return str(tmp_path), str(annotations_path)
+
+def coco_items(folder_path, annotations_path):
+    transforms = v2.Compose([v2.ToImage(), v2.Grayscale(), v2.ToDtype(torch.float32, scale=True)])
+    dataset = datasets.wrap_dataset_for_transforms_v2(
+        datasets.CocoDetection(folder_path, annotations_path, transforms=transforms),
+        target_keys=["boxes", "labels", "masks"],
+    )
+    return [dataset[i] for i in range(len(dataset))]
+
+
+@pytest.mark.parametrize("overlap_order", [None, [2, 0, 1]])
+def test_packed_items_match_coco_loader(coco_dataset, tmp_path, overlap_order):
+    folder_path, annotations_path = coco_dataset
+    assert pack_coco_dataset(folder_path, annotations_path, str(tmp_path / "packed"), overlap_order=overlap_order) == 4
+    packed = PackedMaskDataset(str(tmp_path / "packed"))
+    assert len(packed) == 4
+    assert packed.overlap_order == overlap_order
+
+    for (image, target), (packed_image, packed_target) in zip(coco_items(folder_path, annotations_path), packed):
+        assert torch.equal(packed_image, image)
+        assert packed_image.dtype == torch.float32
+        if 'masks' not in target:
+            assert packed_target['masks'].shape == (0, *image.shape[-2:])
+            assert len(packed_target['labels']) == len(packed_target['boxes']) == 0
+            continue
+        masks = target['masks']
+        if overlap_order is not None:
+            masks = remove_overlap(image, masks, target['labels'], torch.tensor(overlap_order))
+        assert torch.equal(packed_target['masks'], masks)
+        assert packed_target['masks'].dtype == masks.dtype
+        assert torch.equal(packed_target['labels'], target['labels'])
+        assert torch.equal(packed_target['boxes'], target['boxes'])
+        assert packed_target['boxes'].canvas_size == target['boxes'].canvas_size
+
+
+def test_pickled_dataset_maps_files_again(coco_dataset, tmp_path):
+    pack_coco_dataset(*coco_dataset, str(tmp_path / "packed"))
+    packed = PackedMaskDataset(str(tmp_path / "packed"))
+    image, _ = packed[0]
+    copy = pickle.loads(pickle.dumps(packed))
+    assert copy.arrays is None
+    assert torch.equal(copy[0][0], image)
+
+
+def test_missing_pack(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PackedMaskDataset(str(tmp_path))
@@ -1,5 +1,5 @@
 import torch
-from millenium.src.mask_rcnn_training.training_utils.plotting import get_total_masks
+from src.mask_rcnn_training.training_utils.plotting import get_total_masks
 
 def test_get_total_masks():
     mask1a = torch.tensor([[0,0,1],[0,0,1],[0,0,1]])
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+import torch
+from src.mask_rcnn_training.training_utils.postprocessing import mask_statistics, postprocess_predictions, statistics_per_mask
+from src.mask_rcnn_training.training_utils.ring_mask_converter import remove_overlap
+
+LABEL_ORDER = torch.tensor([1, 2, 3])
+
+def random_pred(generator, num_masks, height, width):
+    corners = torch.rand(num_masks, 2, generator=generator) * torch.tensor([width / 2, height / 2])
+    return {
+        'boxes': torch.cat((corners, corners + 5), dim=1),
+        'labels': LABEL_ORDER[torch.randint(len(LABEL_ORDER), (num_masks,), generator=generator)],
+        'scores': torch.rand(num_masks, generator=generator),
+        'masks': torch.rand(num_masks, 1, height, width, generator=generator),
+    }
+
+@pytest.fixture
+def batch():
+    generator = torch.Generator().manual_seed(0)
+    preds = [random_pred(generator, 6, 12, 16), random_pred(generator, 0, 12, 16), random_pred(generator, 4, 9, 7)]
+    images = [torch.randint(0, 256, pred['masks'].shape[-2:], generator=generator, dtype=torch.uint8) for pred in preds]
+    return preds, images
+
+
+@pytest.mark.parametrize("overlap", [True, False])
+def test_masks_match_threshold_then_remove_overlap(batch, overlap):
+    preds, _ = batch
+    out = postprocess_predictions(preds, LABEL_ORDER, binary_threshold=0.25, remove_overlap=overlap)
+    for pred, result in zip(preds, out):
+        expected = pred['masks'] > 0.25
+        if overlap:
+            expected = remove_overlap(expected, expected, pred['labels'], LABEL_ORDER)
+        assert result['masks'].dtype == torch.bool
+        assert result['masks'].shape == pred['masks'].shape
+        assert torch.equal(result['masks'], expected)
+        assert torch.equal(result['labels'], pred['labels'])
+        assert torch.equal(result['scores'], pred['scores'])
+        assert torch.equal(result['boxes'], pred['boxes'].double())
+
+
+def test_xywh_boxes(batch):
+    preds, _ = batch
+    out = postprocess_predictions(preds, LABEL_ORDER, box_format="xywh")
+    for pred, result in zip(preds, out):
+        x0, y0, x1, y1 = pred['boxes'].double().unbind(dim=1)
+        assert torch.equal(result['boxes'], torch.stack((x0, y0, x1 - x0, y1 - y0), dim=1))
+
+
+def test_unknown_box_format(batch):
+    with pytest.raises(ValueError):
+        postprocess_predictions(batch[0], LABEL_ORDER, box_format="cxcywh")
+
+
+def test_label_map(batch):
+    preds, _ = batch
+    label_map = {1: 30, 2: 10, 3: 20}
+    out = postprocess_predictions(preds, LABEL_ORDER, label_map=label_map)
+    for pred, result in zip(preds, out):
+        assert result['labels'].tolist() == [label_map[int(label)] for label in pred['labels']]
+    with pytest.raises(KeyError):
+        postprocess_predictions(preds, LABEL_ORDER, label_map={1: 30, 2: 10})
+
+
+def test_areas_and_mean_intensities(batch):
+    preds, images = batch
+    out = postprocess_predictions(preds, LABEL_ORDER, intensity_images=images)
+    for image, result in zip(images, out):
+        masks = result['masks'].numpy().reshape(-1, *image.shape).astype(np.uint8)
+        areas = masks.sum(axis=(1, 2)).astype(np.float64)
+        means = (masks * image.numpy()).sum(axis=(1, 2)) / np.maximum(areas, 1)
+        assert result['areas'].tolist() == areas.tolist()
+        assert result['mean_intensities'].tolist() == means.tolist()
+        assert set(result['statistics']) == {'std', 'min', 'max', 'p10', 'p25', 'p50', 'p75', 'p90'}
+    assert 'mean_intensities' not in postprocess_predictions(preds, LABEL_ORDER)[0]
+
+
+@pytest.mark.parametrize("dtype", [torch.uint8, torch.float32])
+def test_mask_statistics_match_numpy(dtype):
+    generator = torch.Generator().manual_seed(1)
+    image = torch.randint(0, 256, (30, 40), generator=generator).to(dtype)
+    masks = torch.rand(70, 1, 30, 40, generator=generator) > 0.7
+    masks[3] = False
+    masks[4] = False
+    masks[4, 0, 5, 5] = True
+    statistics = mask_statistics(masks, image, chunk_size=16)
+    for i, mask in enumerate(masks.numpy()):
+        values = image.numpy()[mask[0]].astype(np.float64)
+        if len(values) == 0:
+            expected = [0.0] * 10
+        else:
+            expected = [len(values), values.mean(), values.std(), values.min(), values.max()]
+            expected += list(np.percentile(values, [10, 25, 50, 75, 90]))
+        assert [float(statistics[name][i]) for name in statistics] == pytest.approx(expected, abs=1e-9)
+
+
+def test_statistics_per_mask():
+    statistics = mask_statistics(torch.ones(2, 3, 3, dtype=torch.bool), torch.arange(9).reshape(3, 3))
+    per_mask = statistics_per_mask(statistics)
+    assert len(per_mask) == 2
+    assert per_mask[0] == {'std': pytest.approx(np.std(np.arange(9))), 'min': 0.0, 'max': 8.0,
+                           'p10': pytest.approx(0.8), 'p25': 2.0, 'p50': 4.0, 'p75': 6.0, 'p90': pytest.approx(7.2)}
+
+
+def test_empty_batch():
+    assert postprocess_predictions([], LABEL_ORDER) == []
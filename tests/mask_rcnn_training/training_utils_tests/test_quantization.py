@@ -0,0 +1,54 @@
+import json
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+from torchvision.models.detection import maskrcnn_resnet50_fpn_v2
+from src.mask_rcnn_training.training_utils.data_loading import load_coco_dataset
+from src.mask_rcnn_training.training_utils.quantization import load_calibration_images, optimise_for_cpu
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    model = maskrcnn_resnet50_fpn_v2(weights=None, weights_backbone=None, num_classes=6, min_size=160, max_size=200).eval()
+    model.roi_heads.detections_per_img = 10
+    return model
+
+
+def test_dynamic_quantizes_heads(model):
+    quantized = optimise_for_cpu(model, quantization="dynamic")
+    assert isinstance(quantized.roi_heads.box_predictor.cls_score, DynamicQuantizedLinear)
+    # the original model is left untouched
+    assert isinstance(model.roi_heads.box_predictor.cls_score, torch.nn.Linear)
+
+
+def test_static_channels_last_model_predicts(model):
+    images = [torch.rand(1, 120, 150) for _ in range(2)]
+    quantized = optimise_for_cpu(model, quantization="static", channels_last=True, calibration_images=images)
+    assert quantized.backbone.fpn.inner_blocks[0][0].weight.is_contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        pred = quantized([images[0]])[0]
+    assert set(pred.keys()) == {"boxes", "labels", "scores", "masks"}
+    assert pred["masks"].shape[-2:] == (120, 150)
+
+
+def test_static_needs_calibration_images(model):
+    with pytest.raises(ValueError):
+        optimise_for_cpu(model, quantization="static")
+
+
+def test_calibration_images_are_the_first_in_order(tmp_path):
+    images = []
+    for image_id in range(1, 5):
+        Image.fromarray(np.full((8, 10), 10 * image_id, dtype=np.uint8)).save(tmp_path / f"{image_id}.png")
+        images.append({"id": image_id, "file_name": f"{image_id}.png", "height": 8, "width": 10})
+    with open(tmp_path / "annotations.json", 'w') as file:
+        json.dump({"images": images, "annotations": [], "categories": [{"id": 0, "name": "Seed"}]}, file)
+    calibration = load_calibration_images(str(tmp_path), str(tmp_path / "annotations.json"), num_images=3)
+    dataset = load_coco_dataset(str(tmp_path), str(tmp_path / "annotations.json"))
+    assert len(calibration) == 3
+    for i, image in enumerate(calibration):
+        assert torch.equal(image, dataset[i][0])
+    assert len(load_calibration_images(str(tmp_path), str(tmp_path / "annotations.json"), num_images=10)) == 4
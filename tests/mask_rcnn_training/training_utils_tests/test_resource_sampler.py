@@ -0,0 +1,31 @@
+import time
+from src.mask_rcnn_training.training_utils.resource_sampler import ResourceSampler, process_rss_mib
+
+
+def test_process_rss_is_positive():
+    assert process_rss_mib() > 0
+
+
+def test_sampler_publishes_to_log_in_background():
+    log = []
+    with ResourceSampler(0.01, 'cpu', log=log) as sampler:
+        time.sleep(0.1)
+        assert sampler.thread.is_alive()
+    assert sampler.thread is None
+    # a sample on start, on stop, and some in between
+    assert len(log) > 2
+    assert [sample['time'] for sample in log] == sorted(sample['time'] for sample in log)
+    for sample in log:
+        assert sample['rss_mib'] > 0
+        assert sample['cpu_percent'] >= 0
+        assert sample['gpu_max_allocated_mib'] is None
+    assert "RSS" in sampler.summary()
+
+
+def test_stopped_sampler_stops_sampling():
+    sampler = ResourceSampler(0.01, 'cpu').start()
+    sampler.stop()
+    num_samples = len(sampler.log)
+    time.sleep(0.05)
+    assert len(sampler.log) == num_samples
+    assert ResourceSampler(1, 'cpu').summary() == "No resource samples"
@@ -1,5 +1,6 @@
+import pytest
 import torch
-from millenium.src.mask_rcnn_training.training_utils.ring_mask_converter import get_total_mask, get_anti_mask, remove_overlap
+from src.mask_rcnn_training.training_utils.ring_mask_converter import get_total_mask, get_anti_mask, remove_overlap, remove_overlap_batch
 
 def test_get_total_mask():
     label_order = torch.tensor([14,11,31])
@@ -79,11 +80,84 @@ def test_remove_overlap():
     assert all([o == e for o, e in zip(out_masks.shape, expected_masks.shape)]), f"Shape expected: {expected_masks.shape} \n Shape got: {out_masks.shape}"
     assert torch.all(out_masks == expected_masks), f"Out Masks: {out_masks} \n Expected Masks: {expected_masks}"
 
+def reference_get_total_mask(image, masks, labels, label_order, binary_threshold=0.5):
+    """ The original per-mask loop, kept to check the vectorised version against """
+    label2id = dict([(int(label), i) for i, label in enumerate(label_order)])
+    total_masks = torch.zeros(size=(len(label_order), image.shape[1], image.shape[2])).to(masks.device)
+    for i in range(len(masks)):
+        j = label2id[int(labels[i])]
+        total_masks[j,:,:] = total_masks[j,:,:].bool() | (masks[i,:,:] > binary_threshold)
+    return total_masks
+
+def reference_get_anti_mask(image, masks, labels, label_order, binary_threshold=0.5):
+    total_masks = reference_get_total_mask(image, masks, labels, label_order)
+    out_masks = torch.zeros_like(total_masks)
+    for i in range(len(label_order)):
+        out_masks[i,:,:] = torch.any(total_masks[i+1:,:,:].view(-1, image.shape[1], image.shape[2]).bool(),dim=0)
+    return out_masks
+
+def reference_remove_overlap(image, masks, labels, label_order, binary_threshold=0.5):
+    anti_masks = reference_get_anti_mask(image, masks, labels, label_order, binary_threshold)
+    masks_out = torch.zeros_like(masks)
+    label2id = dict([(int(key), i) for i, key in enumerate(label_order)])
+    for i in range(len(masks)):
+        j = label2id[int(labels[i])]
+        masks_out[i,:,:] = (masks[i,:,:]>binary_threshold).bool() & ~anti_masks[j,:,:].bool()
+    return masks_out
+
+def random_prediction(generator, num_masks, height, width, label_order, mask_format):
+    image = torch.rand(size=(1, height, width), generator=generator)
+    scores = torch.rand(size=(num_masks, 1, height, width), generator=generator)
+    labels = label_order[torch.randint(len(label_order), size=(num_masks,), generator=generator)]
+    if mask_format == "float":
+        masks = scores.squeeze(1)
+    elif mask_format == "bool":
+        masks = scores > 0.7
+    else:
+        masks = (scores.squeeze(1) > 0.6).to(torch.uint8)
+    return image, masks, labels
+
+@pytest.mark.parametrize("mask_format", ["float", "bool", "uint8"])
+@pytest.mark.parametrize("num_masks", [0, 1, 7])
+@pytest.mark.parametrize("binary_threshold", [0.5, 0.25])
+def test_matches_reference(mask_format, num_masks, binary_threshold):
+    generator = torch.Generator().manual_seed(num_masks)
+    label_order = torch.tensor([1, 2, 3, 4, 5])
+    image, masks, labels = random_prediction(generator, num_masks, 13, 17, label_order, mask_format)
+
+    total = get_total_mask(image, masks, labels, label_order, binary_threshold)
+    expected_total = reference_get_total_mask(image, masks, labels, label_order, binary_threshold)
+    assert total.dtype == expected_total.dtype and torch.equal(total, expected_total)
+
+    anti = get_anti_mask(image, masks, labels, label_order, binary_threshold)
+    expected_anti = reference_get_anti_mask(image, masks, labels, label_order, binary_threshold)
+    assert anti.dtype == expected_anti.dtype and torch.equal(anti, expected_anti)
+
+    out = remove_overlap(image, masks, labels, label_order, binary_threshold)
+    expected_out = reference_remove_overlap(image, masks, labels, label_order, binary_threshold)
+    assert out.shape == expected_out.shape and out.dtype == expected_out.dtype
+    assert torch.equal(out, expected_out)
+
+def test_remove_overlap_batch_matches_per_image():
+    generator = torch.Generator().manual_seed(0)
+    label_order = torch.tensor([14, 11, 31])
+    predictions = [
+        random_prediction(generator, 4, 9, 11, label_order, "bool"),
+        random_prediction(generator, 0, 9, 11, label_order, "bool"),
+        random_prediction(generator, 6, 12, 8, label_order, "bool"),
+        random_prediction(generator, 3, 9, 11, label_order, "bool"),
+    ]
+    images, masks, labels = zip(*predictions)
+    out = remove_overlap_batch(images, masks, labels, label_order)
+    for (image, image_masks, image_labels), image_out in zip(predictions, out):
+        assert torch.equal(image_out, reference_remove_overlap(image, image_masks, image_labels, label_order))
+
+def test_unknown_label():
+    image = torch.zeros(size=(1, 4, 4))
+    with pytest.raises(KeyError):
+        remove_overlap(image, torch.ones(size=(1, 4, 4)), torch.tensor([9]), torch.tensor([1, 2]))
+
 if __name__ == "__main__":
     test_get_total_mask()
     test_get_anti_mask()
     test_remove_overlap()
-
-    
-    
-    
\ No newline at end of file
@@ -0,0 +1,223 @@
+import json
+import os
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torchvision.models.detection import maskrcnn_resnet50_fpn
+import src.mask_rcnn_training.training_utils.trainer as trainer_module
+from src.mask_rcnn_training.training_utils.data_loading import collate
+from src.mask_rcnn_training.training_utils.distributed import all_reduce_sum, cleanup_distributed
+from src.mask_rcnn_training.training_utils.packed_dataset import pack_coco_dataset
+from src.mask_rcnn_training.training_utils.trainer import Trainer
+
+HYPER_PARAMS = {
+    "train_batch_size": 2, "val_batch_size": 2, "step_every": 1, "num_epochs": 1, "learning_rate": 1e-4,
+    "max_detections": 10, "binary_threshold": 0.5, "pre-process": True, "post-process": True,
+}
+
+@pytest.fixture
+def coco_dataset(tmp_path):
+    """ Six 32x32 grayscale images, each with two square instances of the three categories """
+    rng = np.random.default_rng(0)
+    images, annotations = [], []
+    for image_id in range(1, 7):
+        Image.fromarray(rng.integers(0, 256, (32, 32), dtype=np.uint8)).save(tmp_path / f"{image_id}.png")
+        images.append({"id": image_id, "file_name": f"{image_id}.png", "height": 32, "width": 32})
+        for _ in range(2):
+            x, y = (int(v) for v in rng.integers(0, 16, 2))
+            annotations.append({
+                "id": len(annotations) + 1, "image_id": image_id, "category_id": int(rng.integers(0, 3)),
+                "segmentation": [[x, y, x + 10, y, x + 10, y + 10, x, y + 10]], "bbox": [x, y, 10, 10], "area": 100, "iscrowd": 0,
+            })
+    categories = [{"id": i, "name": name} for i, name in enumerate(["Seed", "Interior", "Void"])]
+    with open(tmp_path / "annotations.json", 'w') as file:
+        json.dump({"images": images, "annotations": annotations, "categories": categories}, file)
+    return str(tmp_path), str(tmp_path / "annotations.json")
+
+def untrained_model(num_classes, max_detections=200, model_path=None):
+    """ Stands in for get_model, without pre-trained weights to download """
+    return maskrcnn_resnet50_fpn(
+        weights=None, weights_backbone=None, num_classes=num_classes, min_size=32, max_size=32, box_detections_per_img=max_detections,
+    )
+
+@pytest.fixture
+def make_trainer(coco_dataset, tmp_path, monkeypatch):
+    """ Builds a CPU Trainer over coco_dataset with a small untrained model, with configs and hyper params overridden """
+    monkeypatch.setattr(trainer_module, "get_model", untrained_model)
+    folder_path, annotations_path = coco_dataset
+
+    def make(configs=None, hyper_params=None):
+        with open(tmp_path / "hyper_params.json", 'w') as file:
+            json.dump({**HYPER_PARAMS, **(hyper_params or {})}, file)
+        with open(tmp_path / "configs.json", 'w') as file:
+            json.dump({
+                "train_images_path": folder_path, "train_annotations_name": annotations_path,
+                "val_images_path": folder_path, "val_annotations_name": annotations_path,
+                "model_path": str(tmp_path / "model.pt"), "map_plot_path": str(tmp_path / "map.png"),
+                "vis_plot_path": str(tmp_path / "vis"), "inference_configs_save_path": str(tmp_path / "inference_configs.json"),
+                "hyper_params_path": str(tmp_path / "hyper_params.json"), "train_print_every": 1, "log_every": 1,
+                "val_print_every": 1, "num_classes": 3, "class_order": ["Seed", "Interior", "Void"], "use_gpu": False,
+                "save_progress": False, "load_from_checkpoint": False, "data_loader": {"num_workers": 0, "seed": 0},
+                **(configs or {}),
+            }, file)
+        return Trainer(str(tmp_path / "configs.json"))
+    return make
+
+class UnusableLoader:
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __iter__(self):
+        raise AssertionError("The validation loader should not be iterated")
+
+def cpu_trainer():
+    trainer = Trainer(None, full_init=False)
+    trainer.device = torch.device('cpu')
+    return trainer
+
+
+@pytest.mark.parametrize("name, dtype", [(None, None), ("float32", None), ("bfloat16", torch.bfloat16)])
+def test_autocast_dtype(name, dtype):
+    trainer = cpu_trainer()
+    trainer.autocast_dtype = trainer.get_autocast_dtype(name)
+    assert trainer.autocast_dtype == dtype
+    assert not trainer.get_grad_scaler().is_enabled()
+    with trainer.autocast():
+        product = torch.ones(2, 2) @ torch.ones(2, 2)
+    assert product.dtype == (dtype or torch.float32)
+
+
+def test_float16_needs_a_gpu():
+    with pytest.raises(ValueError):
+        cpu_trainer().get_autocast_dtype("float16")
+
+
+def test_unknown_autocast_dtype():
+    with pytest.raises(ValueError):
+        cpu_trainer().get_autocast_dtype("int8")
+
+
+@pytest.mark.parametrize("num_iterations, warmup, batches", [(0, 2, [None]), (1, -1, [None]), (1, 2, [])])
+def test_benchmark_needs_iterations_and_batches(num_iterations, warmup, batches):
+    trainer = cpu_trainer()
+    trainer.train_loader = batches
+    with pytest.raises(ValueError):
+        trainer.benchmark(num_iterations, warmup=warmup)
+
+
+def test_probe_set_is_the_first_validation_items(make_trainer):
+    trainer = make_trainer(configs={"val_probe_size": 3})
+    dataset = trainer.val_loader.dataset
+    assert len(trainer.probe_images) == len(trainer.probe_targets) == 3
+    for i, (image, target) in enumerate(zip(trainer.probe_images, trainer.probe_targets)):
+        assert image.device == trainer.device
+        assert torch.equal(image, dataset[i][0])
+        assert target['masks'].device == trainer.device
+        expected_labels = [trainer.id2label[int(label)] for label in dataset[i][1]['labels']]
+        assert target['labels'].tolist() == expected_labels
+
+
+def test_logging_reuses_the_probe_set(make_trainer):
+    trainer = make_trainer()
+    assert len(trainer.probe_images) == HYPER_PARAMS['val_batch_size']
+    probe_images = trainer.probe_images
+    trainer.val_loader = UnusableLoader(trainer.val_loader.dataset)
+    logging_info = {'images_train': trainer.probe_images, 'targets_train': trainer.probe_targets, 'loss': 1.0}
+    trainer.log_training_info(logging_info)
+    trainer.log_training_info(logging_info)
+    assert len(trainer.training_log['val_maps']) == 2
+    assert trainer.probe_images is probe_images
+    trainer.plot_outputs(0)
+
+
+def test_evaluating_the_probe_set_leaves_it_unchanged(make_trainer):
+    trainer = make_trainer()
+    tensors = [dict(target) for target in trainer.probe_targets]
+    targets = [{key: value.clone() for key, value in target.items()} for target in trainer.probe_targets]
+    preds = trainer.predict_internal(trainer.probe_images)
+    first = trainer.evaluate_map(preds, trainer.probe_targets)
+    second = trainer.evaluate_map(preds, trainer.probe_targets)
+    assert first.keys() == second.keys()
+    for key in first:
+        assert torch.equal(first[key], second[key]), key
+    for target, tensor, original in zip(trainer.probe_targets, tensors, targets):
+        for key, value in original.items():
+            assert target[key] is tensor[key], key
+            assert target[key].dtype == value.dtype, key
+            assert torch.equal(target[key], value), key
+
+
+def evaluate_shard(trainer):
+    """
+    This process's validation indices, with the loss (seeded per image, as Mask R-CNN samples proposals at random) and
+    the full_evaluation mAPs over the validation set, each averaged over every process
+    """
+    output = trainer.full_evaluation()
+    indices = list(trainer.val_loader.sampler)
+    dataset = trainer.val_loader.dataset
+    losses = []
+    trainer.module.train()
+    # batch norm on its running statistics, so an image's loss does not depend on the rest of its batch
+    trainer.module.apply(lambda module: module.eval() if isinstance(module, torch.nn.BatchNorm2d) else None)
+    with torch.no_grad():
+        for index in indices:
+            images, targets = trainer.preprocess(*collate([dataset[index]]))
+            torch.manual_seed(index)
+            losses.append(sum(trainer.module(images, targets).values()).item())
+    total, count = all_reduce_sum(torch.tensor([sum(losses), len(losses)], dtype=torch.float64)).tolist()
+    return {"indices": indices, "loss": total / count, "maps": output}
+
+def evaluate_in_process_group(rank, world_size, configs_path, results_path):
+    """ The torch.multiprocessing.spawn worker: one rank of a gloo process group joined through a file """
+    os.environ.update(WORLD_SIZE=str(world_size), RANK=str(rank), LOCAL_RANK=str(rank))
+    torch.set_num_threads(1)
+    trainer_module.get_model = untrained_model
+    torch.distributed.init_process_group('gloo', init_method=f"file://{results_path}/store", rank=rank, world_size=world_size)
+    try:
+        torch.manual_seed(0)
+        trainer = Trainer(configs_path)
+        with open(f"{results_path}/{rank}.json", 'w') as file:
+            json.dump(evaluate_shard(trainer), file)
+    finally:
+        cleanup_distributed()
+
+
+def test_two_processes_match_one(make_trainer, tmp_path):
+    hyper_params = {"val_batch_size": 1}
+    torch.manual_seed(0)
+    expected = evaluate_shard(make_trainer(hyper_params=hyper_params))
+    (tmp_path / "results").mkdir()
+    torch.multiprocessing.spawn(evaluate_in_process_group, args=(2, str(tmp_path / "configs.json"), str(tmp_path / "results")), nprocs=2)
+    results = []
+    for rank in range(2):
+        with open(tmp_path / "results" / f"{rank}.json") as file:
+            results.append(json.load(file))
+
+    # each process evaluates its own half of the validation set
+    assert set(results[0]['indices']).isdisjoint(results[1]['indices'])
+    assert sorted(results[0]['indices'] + results[1]['indices']) == sorted(expected['indices'])
+    for result in results:
+        assert result['loss'] == pytest.approx(expected['loss'])
+        assert result['maps'] == pytest.approx(expected['maps'], nan_ok=True)
+
+
+def packed_paths(coco_dataset, tmp_path, overlap_order):
+    pack_coco_dataset(*coco_dataset, str(tmp_path / "packed"), overlap_order=overlap_order)
+    return {"train_packed_path": str(tmp_path / "packed"), "val_packed_path": str(tmp_path / "packed")}
+
+
+@pytest.mark.parametrize("overlap_order, pre_process, removed_offline", [
+    (None, True, False),
+    (None, False, False),
+    ([0, 1, 2], True, True),
+])
+def test_packed_overlap_removal(make_trainer, coco_dataset, tmp_path, overlap_order, pre_process, removed_offline):
+    trainer = make_trainer(configs=packed_paths(coco_dataset, tmp_path, overlap_order), hyper_params={"pre-process": pre_process})
+    assert trainer.overlap_removed_offline == removed_offline
+
+
+@pytest.mark.parametrize("overlap_order, pre_process", [([0, 1, 2], False), ([2, 1, 0], True)])
+def test_packed_overlap_removal_contradicting_configs(make_trainer, coco_dataset, tmp_path, overlap_order, pre_process):
+    with pytest.raises(ValueError):
+        make_trainer(configs=packed_paths(coco_dataset, tmp_path, overlap_order), hyper_params={"pre-process": pre_process})
@@ -12,7 +12,9 @@ const initialStructure = {
     classification_count: {FULL: 0, PART: 0, EMPTY: 0, INFESTED: 0},
     seed_health_dict: {},
     batch_id: null,
+    batch_ids: null,
     response: null,
+    responses: null,
     root_image: null,
     image: null,
 };
@@ -1,7 +1,7 @@
 import React, { useEffect, useState } from "react";
 import ConfigDrop from "./Config";
 import { useAnalysedData } from '../AnalysedDataContext.js';
-import { classifier, countMaskLabels } from './Utils.js';
+import { classifier, countMaskLabels, maskToDataURL } from './Utils.js';
 import JSZip from 'jszip';
 import { saveAs } from 'file-saver';
 import ThresholdSliderArea from "./ThresholdSlider.js";
@@ -111,6 +111,8 @@ function StatisticsBar() {
             const row = [index, ...Object.values(obj).map(value => {
                 if (Array.isArray(value)) {
                     return `"${value.join(';').replace(/"/g, '""')}"`;
+                } else if (value !== null && typeof value === 'object') {
+                    return `"${JSON.stringify(value).replace(/"/g, '""')}"`;
                 } else if (typeof value === 'string') {
                     return `"${value.replace(/"/g, '""')}"`;
                 }
@@ -119,8 +121,8 @@ function StatisticsBar() {
             csvRows.push(row);
 
             if (obj.mask) {
-                // Properly format the base64 string for conversion
-                const base64Data = `data:image/png;base64,${obj.mask}`;
+                // Properly format the base64 string (or rasterised RLE) for conversion
+                const base64Data = maskToDataURL(obj.mask, data.response.width, data.response.height);
                 const imgBlob = dataURItoBlob(base64Data);
                 zip.file(`${data.batch_id}_mask_${index}.png`, imgBlob);
             }
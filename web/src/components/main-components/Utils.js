@@ -80,6 +80,43 @@ function classifier(data) {
 }
 
 
+// Masks arrive either as base64 PNG strings or, when requested with mask_format=rle, as
+// { offset: [x, y], size: [height, width], counts: [...] } run lengths over the cropped mask
+// in column-major order, starting with background. RLE masks are rasterised here into the
+// same full-frame PNG the server would otherwise have sent (white, half transparent).
+function maskToDataURL(mask, width, height) {
+    if (typeof mask === 'string') {
+        return 'data:image/png;base64,' + mask;
+    }
+    let canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    let ctx = canvas.getContext('2d');
+    let [cropHeight, cropWidth] = mask.size;
+    if (cropHeight > 0 && cropWidth > 0) {
+        let imageData = ctx.createImageData(cropWidth, cropHeight);
+        let pixels = imageData.data;
+        let position = 0;
+        mask.counts.forEach((count, i) => {
+            if (i % 2 === 1) { // odd runs are mask pixels
+                for (let j = position; j < position + count; j++) {
+                    let row = j % cropHeight;
+                    let col = Math.floor(j / cropHeight);
+                    let k = 4 * (row * cropWidth + col);
+                    pixels[k] = 255;
+                    pixels[k + 1] = 255;
+                    pixels[k + 2] = 255;
+                    pixels[k + 3] = 128;
+                }
+            }
+            position += count;
+        });
+        ctx.putImageData(imageData, mask.offset[0], mask.offset[1]);
+    }
+    return canvas.toDataURL();
+}
+
+
 function seedImageLoader(seed_idx, data, callback) {
 
     let annotations = data.response.annotations.filter((annotation) => annotation.seed_id === seed_idx);
@@ -147,7 +184,7 @@ function seedMaskLoader(mask_idx, seed_idx, data, callback) {
     }
 
     let maskImage = new Image();
-    maskImage.src = 'data:image/png;base64,' + mask_annotation.mask;
+    maskImage.src = maskToDataURL(mask_annotation.mask, data.response.width, data.response.height);
     maskImage.onload = () => {
         let canvas = document.createElement('canvas');
         let ctx = canvas.getContext('2d');
@@ -266,7 +303,7 @@ function seedClassificationLoader(classification_idx, data, callback) {
 
         let maskImages = annotations.map((annotation) => {
             let maskImage = new Image();
-            maskImage.src = 'data:image/png;base64,' + annotation.mask;
+            maskImage.src = maskToDataURL(annotation.mask, data.response.width, data.response.height);
             return maskImage;
         });
 
@@ -326,4 +363,4 @@ function seedClassificationLoader(classification_idx, data, callback) {
 
 
 
-export { calculateNumberOfSeeds, getSeedIndexes, countMaskLabels, classifier, seedImageLoader, seedMaskLoader, seedClassificationLoader };
\ No newline at end of file
+export { calculateNumberOfSeeds, getSeedIndexes, countMaskLabels, classifier, maskToDataURL, seedImageLoader, seedMaskLoader, seedClassificationLoader };
\ No newline at end of file
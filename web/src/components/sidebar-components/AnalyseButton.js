@@ -19,10 +19,10 @@ function AnalyseButton() {
     
         const url = 'http://127.0.0.1:5000/predict';
     
-        // Encode images to Base64 and prepare payload
-        // Hacky way to avoid doing batches, just take the last image with the slice
+        // Images are uploaded as raw files in a multipart body; base64 copies are only kept for display
+        // All images are sent in one request; the server batches them and returns one response per image
 
-        let imagesToBase64Promises = request.payload.images.slice(-1).map(file => 
+        let imagesToBase64Promises = request.payload.images.map(file => 
             new Promise((resolve, reject) => {
                 const reader = new FileReader();
                 reader.onloadend = () => resolve(reader.result);
@@ -34,18 +34,15 @@ function AnalyseButton() {
         
         try {
             const base64Images = await Promise.all(imagesToBase64Promises);
-            const payloadData = { 
-                ...request.payload,
-                images: base64Images, // Correctly include base64 images in payload
-                model_id: request.payload.model_id,
-            };
+            const formData = new FormData();
+            formData.append('model_id', request.payload.model_id);
+            // Run-length encoded masks are far smaller than full-frame PNGs and are rasterised client-side
+            formData.append('mask_format', 'rle');
+            request.payload.images.forEach(file => formData.append('images', file, file.name));
     
             const response = await fetch(url, {
                 method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify(payloadData),
+                body: formData,
             });
 
             console.log('Response:', response);
@@ -53,24 +50,29 @@ function AnalyseButton() {
             const response_json = await response.json();
             console.log('RESPONSE OK: 200');
             console.log(response_json);
-    
-            // Assuming response processing remains the same
-            const modelResponse = {
+
+            // A single image returns one response object, a batch returns a list in upload order
+            const responses = (Array.isArray(response_json) ? response_json : [response_json]).map(response_json => ({
                 width: response_json.width,
                 height: response_json.height,
                 annotations: response_json.annotations,
                 composite_masks: response_json.composite_masks,
                 seed_indices: response_json.seed_indices,
-            };
+            }));
+            const last = responses.length - 1;
+            // One batch id per response, named after its image, so saved files match the displayed result
+            const batch_ids = request.payload.images.map(file => file.name.split(".")[0]);
     
-            // Update UI based on response
+            // Update UI based on response, displaying the most recently uploaded image
             updateAnalysedData({
                 ...data,
-                response: modelResponse,
+                response: responses[last],
+                responses: responses,
                 state: "COMPLETE",
-                batch_id: request.payload.images[0].name.split(".")[0],
-                root_image: base64Images[0],
-                img: base64Images[0],
+                batch_id: batch_ids[last],
+                batch_ids: batch_ids,
+                root_image: base64Images[last],
+                img: base64Images[last],
             });
     
             updateRequest({ state: "COMPLETE" });